@@ -0,0 +1,370 @@
+"""Serves the upload and points endpoints on a single asyncio event loop,
+for many concurrent keep-alive connections and slow clients:
+
+    python async_host.py
+
+A connection costs a coroutine rather than a thread, so a client trickling
+a large receipt only holds its own connection. Requests are parsed with a
+small HTTP/1.1 reader (Content-Length bodies, keep-alive unless the client
+asks to close). Work that can wait is done in a thread executor, so that
+the loop keeps serving other connections: decoding and processing bodies
+of INLINE_BODY_BYTES or more, processing receipts the processor sends to
+its process pool (with SCORING_WORKERS set), and every upload and points
+lookup when the store is not in memory or is shared, since those wait on
+disk or on commits. Bodies of STREAM_BODY_BYTES or more are read from the
+connection a chunk at a time into a spooled file, in memory up to
+SPOOL_BYTES and on disk beyond, and decoded from it a value at a time
+instead of into one dict, as host.py does, so memory stays flat however
+large they are.
+
+Responses match host.py. The store, rules, cache size and logging are
+configured through the same environment variables, and PORT selects the
+port (8000 by default)."""
+
+import asyncio
+import logging
+import os
+import signal
+import tempfile
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import IO, Any, Callable, Dict, NamedTuple, Optional, Tuple
+
+from receipt_processor import ReceiptProcessor, codec
+from receipt_processor.logs import SAMPLED, configure_logging
+from receipt_processor.metrics import (
+    POINTS_CACHE,
+    REQUEST_SECONDS,
+    REQUESTS,
+)
+from receipt_processor.service import (
+    STREAM_BODY_BYTES,
+    PointsResponses,
+    etag_matches,
+    processor_from_environment,
+)
+from receipt_processor.streaming import (
+    MAX_BODY_BYTES,
+    READ_SIZE,
+    SPOOL_BYTES,
+    ReceiptTooLargeError,
+)
+
+log = logging.getLogger("async_host")
+
+MAX_HEADER_BYTES = 64 * 1024
+# Bodies of at least this size are decoded and processed off the event loop
+INLINE_BODY_BYTES = 64 * 1024
+# Idle keep-alive connections are closed after this many seconds
+KEEP_ALIVE_SECONDS = 5
+# Time allowed for a client to send a whole request once it has started
+REQUEST_SECONDS_LIMIT = 60
+
+REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    415: "Unsupported Media Type",
+    500: "Internal Server Error",
+}
+TEXT = "text/html; charset=utf-8"
+JSON = "application/json"
+
+UPLOAD_ROUTE = "/receipts/process"
+POINTS_ROUTE = "/receipts/<string:ID>/points"
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    # Header names in lower case
+    headers: Dict[str, str]
+    body: bytes
+    keepAlive: bool
+    # The body instead, when it was spooled, see read_spooled
+    stream: Optional[IO[bytes]] = None
+
+
+class Reply(NamedTuple):
+    status: int
+    body: str = ""
+    contentType: str = TEXT
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+
+class HTTPError(Exception):
+    """A request that cannot be parsed; the connection is closed after
+    answering with status."""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Reads one request, or returns None when the client closed the
+    connection between requests."""
+    try:
+        head = await asyncio.wait_for(
+            reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_SECONDS
+        )
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise HTTPError(400, "Request headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+    if "transfer-encoding" in headers:
+        raise HTTPError(411, "Chunked bodies are not supported")
+    length = headers.get("content-length", "0")
+    if not (length.isascii() and length.isdigit()):
+        raise HTTPError(400, "Malformed Content-Length")
+    length = int(length)
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, "The request body is too large")
+    body, stream = b"", None
+    try:
+        if length and length >= STREAM_BODY_BYTES:
+            stream = await read_spooled(reader, length)
+        else:
+            body = await asyncio.wait_for(
+                reader.readexactly(length), REQUEST_SECONDS_LIMIT
+            )
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+        return None
+
+    connection = headers.get("connection", "").lower()
+    keepAlive = (
+        connection != "close"
+        if version == "HTTP/1.1"
+        else connection == "keep-alive"
+    )
+    return Request(
+        method, target.partition("?")[0], headers, body, keepAlive, stream
+    )
+
+
+async def read_spooled(
+    reader: asyncio.StreamReader, length: int
+) -> IO[bytes]:
+    """Reads a body of length bytes into a spooled file, a chunk at a time,
+    within REQUEST_SECONDS_LIMIT. Returns the file, rewound."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + REQUEST_SECONDS_LIMIT
+    spool = tempfile.SpooledTemporaryFile(SPOOL_BYTES)
+    try:
+        while length:
+            chunk = await asyncio.wait_for(
+                reader.read(min(READ_SIZE, length)), deadline - loop.time()
+            )
+            if not chunk:
+                raise asyncio.IncompleteReadError(b"", length)
+            spool.write(chunk)
+            length -= len(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def encode_reply(reply: Reply, keepAlive: bool) -> bytes:
+    body = reply.body.encode()
+    lines = [f"HTTP/1.1 {reply.status} {REASONS[reply.status]}"]
+    if reply.status != 304:
+        lines.append(f"Content-Type: {reply.contentType}")
+        lines.append(f"Content-Length: {len(body)}")
+    lines.extend(f"{name}: {value}" for name, value in reply.headers)
+    lines.append(f"Connection: {'keep-alive' if keepAlive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class AsyncReceiptServer:
+    """Serves POST /receipts/process and GET /receipts/{id}/points for a
+    ReceiptProcessor, one coroutine per connection."""
+
+    def __init__(
+        self,
+        receiptProcessor: ReceiptProcessor,
+        executor: Optional[Executor] = None,
+        inlineBodyBytes: int = INLINE_BODY_BYTES,
+    ) -> None:
+        self.receiptProcessor = receiptProcessor
+        self.executor = executor or ThreadPoolExecutor(
+            thread_name_prefix="receipts"
+        )
+        self.inlineBodyBytes = inlineBodyBytes
+        self.pointsResponses = PointsResponses(receiptProcessor)
+        store = receiptProcessor.receipts
+        # Whether lookups and writes are cheap enough for the loop
+        self.inlineStore = store.inMemory and not store.shared
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(
+            self.handle_connection,
+            host,
+            port,
+            limit=MAX_HEADER_BYTES,
+            backlog=4096,
+        )
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except HTTPError as error:
+                    reply = Reply(error.status, str(error))
+                    writer.write(encode_reply(reply, keepAlive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                start = time.perf_counter()
+                try:
+                    route, reply = await self.dispatch(request)
+                except Exception:
+                    log.exception(
+                        "Request failed", extra={"path": request.path}
+                    )
+                    route, reply = "error", Reply(500, "Internal Server Error")
+                finally:
+                    if request.stream is not None:
+                        request.stream.close()
+                REQUESTS.inc(route, str(reply.status))
+                REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+                writer.write(encode_reply(reply, request.keepAlive))
+                await writer.drain()
+                if not request.keepAlive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: Request) -> Tuple[str, Reply]:
+        """Returns the route that matched and the reply to the request."""
+        path = request.path
+        if path == "/receipts/process":
+            if request.method != "POST":
+                return UPLOAD_ROUTE, Reply(405, "Method Not Allowed")
+            return UPLOAD_ROUTE, await self.upload(request)
+        parts = path.split("/")
+        if len(parts) == 4 and parts[1:4:2] == ["receipts", "points"]:
+            if request.method != "GET":
+                return POINTS_ROUTE, Reply(405, "Method Not Allowed")
+            if self.inlineStore:
+                return POINTS_ROUTE, self.points(request, parts[2])
+            return POINTS_ROUTE, await self.in_executor(
+                self.points, request, parts[2]
+            )
+        return "unmatched", Reply(404, "Not Found")
+
+    async def upload(self, request: Request) -> Reply:
+        contentType = request.headers.get("content-type", "")
+        if contentType.partition(";")[0].strip() != JSON:
+            return Reply(415, "The receipt must be sent as application/json")
+        if request.stream is not None:
+            return await self.in_executor(self.process_stream, request.stream)
+        body = request.body
+        if len(body) >= self.inlineBodyBytes or not self.inlineStore:
+            return await self.in_executor(self.process, body)
+        try:
+            receipt = codec.loads(body)
+        except ValueError:
+            log.info("Invalid receipt uploaded")
+            return Reply(400, "The receipt is invalid")
+        if self.receiptProcessor.uses_pool(receipt):
+            return await self.in_executor(self.process_receipt, receipt)
+        return self.process_receipt(receipt)
+
+    async def in_executor(self, func: Callable[..., Reply], *args) -> Reply:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def process(self, body: bytes) -> Reply:
+        try:
+            receipt = codec.loads(body)
+        except ValueError:
+            log.info("Invalid receipt uploaded")
+            return Reply(400, "The receipt is invalid")
+        return self.process_receipt(receipt)
+
+    def process_receipt(self, receipt: Any) -> Reply:
+        return self._reply(self.receiptProcessor.process_receipt, receipt)
+
+    def process_stream(self, stream: IO[bytes]) -> Reply:
+        return self._reply(self.receiptProcessor.process_stream, stream)
+
+    def _reply(self, process: Callable[[Any], str], source: Any) -> Reply:
+        """Replies with the id that process returns for the receipt read
+        from source, or with the reason it was refused."""
+        log.debug("Processing receipt")
+        try:
+            ID = process(source)
+        except ReceiptTooLargeError:
+            log.info("Oversized receipt uploaded")
+            return Reply(413, "The receipt is too large")
+        except ValueError:
+            log.info("Invalid receipt uploaded")
+            return Reply(400, "The receipt is invalid")
+        return Reply(200, codec.dumps({"id": ID}) + "\n", JSON)
+
+    def points(self, request: Request, ID: str) -> Reply:
+        log.debug("Processing receipt query", extra={"id": ID})
+        if (cached := self.pointsResponses.get(ID)) is None:
+            log.info("Unknown receipt queried", extra={"id": ID})
+            return Reply(404, "No receipt found for that id")
+        body, etag, hit = cached
+        log.info("Valid receipt queried", extra={"id": ID, **SAMPLED})
+        headers = (
+            ("ETag", f'"{etag}"'),
+            ("Cache-Control", self.pointsResponses.cacheControl),
+        )
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            POINTS_CACHE.inc("not_modified")
+            return Reply(304, headers=headers)
+        POINTS_CACHE.inc("hit" if hit else "miss")
+        return Reply(200, body, JSON, headers)
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.receiptProcessor.close()
+
+
+async def main() -> None:
+    configure_logging()
+    server = AsyncReceiptServer(processor_from_environment())
+    port = int(os.environ.get("PORT", "8000"))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    listener = await server.serve("0.0.0.0", port)
+    log.info("Serving", extra={"port": port})
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        # Flushes the store
+        server.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+"""Compares how the Flask app under gunicorn (one worker, THREADS threads)
+and the asyncio server cope with slow clients. Slow clients open a
+connection and trickle a large receipt upload a few bytes at a time, as
+clients on poor networks do; meanwhile fast clients poll points on
+keep-alive connections. Reports the fast clients' throughput and latency
+for a growing number of slow clients.
+
+    python -m benchmarks.bench_async [seconds]
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from .common import sample_receipt
+from .loadtest import PORT, wait_for_server
+
+FAST_CLIENTS = 8
+SLOW_CLIENTS = [0, 16, 256, 2000]
+THREADS = 4
+
+SERVERS = {
+    "gunicorn (gthread)": [
+        "gunicorn", "--config", "gunicorn.conf.py", "host:app"
+    ],
+    "asyncio": [sys.executable, "async_host.py"],
+}
+
+
+def http_request(method: str, path: str, body: bytes = b"") -> bytes:
+    return (
+        f"{method} {path} HTTP/1.1\r\nHost: bench\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        "\r\n"
+    ).encode() + body
+
+
+async def read_response(reader) -> int:
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    length = 0
+    for line in head.split("\r\n"):
+        if line.lower().startswith("content-length:"):
+            length = int(line.split(":")[1])
+    await reader.readexactly(length)
+    return int(head.split()[1])
+
+
+async def upload_receipt() -> str:
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    body = json.dumps(sample_receipt(5)).encode()
+    writer.write(http_request("POST", "/receipts/process", body))
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    length = int(head.lower().split("content-length:")[1].split()[0])
+    ID = json.loads(await reader.readexactly(length))["id"]
+    writer.close()
+    return ID
+
+
+async def slow_client(stop: asyncio.Event) -> None:
+    """Trickles a 500 item receipt, 16 bytes every 100ms, until stopped."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    except OSError:
+        return
+    data = http_request(
+        "POST", "/receipts/process", json.dumps(sample_receipt(500)).encode()
+    )
+    try:
+        for i in range(0, len(data), 16):
+            if stop.is_set():
+                break
+            writer.write(data[i:i + 16])
+            await writer.drain()
+            await asyncio.sleep(0.1)
+    except OSError:
+        pass
+    writer.close()
+
+
+async def fast_client(ID: str, deadline: float, latencies) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", PORT)
+    request = http_request("GET", f"/receipts/{ID}/points")
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        writer.write(request)
+        try:
+            status = await asyncio.wait_for(
+                read_response(reader), deadline - time.monotonic()
+            )
+        except asyncio.TimeoutError:
+            break
+        if status == 200:
+            latencies.append(time.perf_counter() - start)
+    writer.close()
+
+
+async def measure(slowClients: int, seconds: float):
+    ID = await upload_receipt()
+    stop = asyncio.Event()
+    slow = [
+        asyncio.create_task(slow_client(stop)) for _ in range(slowClients)
+    ]
+    # Let the slow clients connect and start their uploads
+    await asyncio.sleep(1)
+    latencies = []
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(
+        *(fast_client(ID, deadline, latencies) for _ in range(FAST_CLIENTS))
+    )
+    stop.set()
+    await asyncio.gather(*slow)
+    return latencies
+
+
+def run(name: str, command, slowClients: int, seconds: float) -> None:
+    env = {
+        **os.environ,
+        "PORT": str(PORT),
+        "WEB_CONCURRENCY": "1",
+        "THREADS": str(THREADS),
+        "RECEIPT_STORE": "memory",
+        "LOG_LEVEL": "WARNING",
+    }
+    server = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_server(server)
+        latencies = sorted(asyncio.run(measure(slowClients, seconds)))
+    finally:
+        server.terminate()
+        server.wait()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e3 if latencies else 0
+    print(
+        f"{name:<20} {slowClients:>5} slow clients "
+        f"{len(latencies) / seconds:>9,.0f} fast requests/s "
+        f"p99 {p99:>8.1f} ms"
+    )
+
+
+def main() -> None:
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for slowClients in SLOW_CLIENTS:
+        for name, command in SERVERS.items():
+            run(name, command, slowClients, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compares one process_receipts call on a batch with a process_receipt
+call per receipt, end to end and stage by stage (validation and scoring),
+on varied receipts with and without duplicates. Ids are generated per
+receipt either way, so that stage is timed once for reference.
+
+    python -m benchmarks.bench_batch [batch size]
+"""
+
+import sys
+import timeit
+from typing import Any, Callable
+
+from receipt_processor import ReceiptProcessor
+from receipt_processor.canonical import receipt_id
+from receipt_processor.points import (
+    calculate_batch_points,
+    calculate_parsed_points,
+)
+from receipt_processor.validator import ReceiptValidator
+
+from .common import generate_receipts
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def best_time(func: Callable[[], Any], repeat: int = 5) -> float:
+    """The best of repeat single runs, in seconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def process_singly(receipts) -> None:
+    processor = ReceiptProcessor()
+    for receipt in receipts:
+        try:
+            processor.process_receipt(receipt)
+        except ValueError:
+            pass
+
+
+def process_batch(receipts) -> None:
+    ReceiptProcessor().process_receipts(receipts)
+
+
+def compare(label: str, single: float, batch: float) -> None:
+    print(
+        f"{label:<40} {single * 1000:>10,.1f} ms {batch * 1000:>10,.1f} ms "
+        f"{single / batch:>8.2f}x"
+    )
+
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BATCH_SIZE
+    validator = ReceiptValidator()
+    print(f"{'':<40} {'single':>13} {'batch':>13} {'speedup':>9}")
+    for itemCount, duplicates in [(5, 0.0), (5, 0.5), (50, 0.0)]:
+        receipts = generate_receipts(
+            size, itemCount, duplicateRatio=duplicates, invalidRatio=0.05
+        )
+        label = f"{itemCount} items, {duplicates:.0%} duplicates"
+        compare(
+            f"end to end ({label})",
+            best_time(lambda: process_singly(receipts)),
+            best_time(lambda: process_batch(receipts)),
+        )
+        compare(
+            f"validate ({label})",
+            best_time(lambda: list(map(validator.check, receipts))),
+            best_time(lambda: validator.check_many(receipts)),
+        )
+        parsed = [
+            result[0]
+            for result in validator.check_many(receipts)
+            if result[0] is not None
+        ]
+        compare(
+            f"score ({label})",
+            best_time(lambda: list(map(calculate_parsed_points, parsed))),
+            best_time(lambda: calculate_batch_points(parsed)),
+        )
+        ids = best_time(lambda: list(map(receipt_id, receipts)))
+        print(f"{f'generate ids ({label})':<40} {ids * 1000:>10,.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Measures lookups of unknown ids in a SQLite store of COUNT receipts,
+directly and through FilteredStore, and the filter's false positive rate
+and size. The filter is sized for exactly COUNT ids, the worst case before
+it grows."""
+
+import os
+import tempfile
+import time
+import uuid
+
+from receipt_processor.store import FilteredStore, SQLiteStore
+
+COUNT = 200_000
+LOOKUPS = 50_000
+
+
+def lookups_per_second(store, ids) -> float:
+    start = time.perf_counter()
+    for ID in ids:
+        store.get(ID)
+    return len(ids) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteStore(os.path.join(directory, "receipts.db"))
+        stored = [str(uuid.uuid4()) for _ in range(COUNT)]
+        store.put_many((ID, 1) for ID in stored)
+        store.flush()
+        start = time.perf_counter()
+        filtered = FilteredStore(store, capacity=COUNT)
+        filling = time.perf_counter() - start
+
+        unknown = [str(uuid.uuid4()) for _ in range(LOOKUPS)]
+        known = stored[:LOOKUPS]
+        for name, ids in [("unknown", unknown), ("known", known)]:
+            direct = lookups_per_second(store, ids)
+            through = lookups_per_second(filtered, ids)
+            print(
+                f"{name + ' ids':<16} {direct:>11,.0f} lookups/s direct "
+                f"{through:>11,.0f} lookups/s filtered"
+            )
+        falsePositives = sum(
+            ID in filtered.filter for ID in unknown
+        )
+        print(
+            f"false positives  {falsePositives / LOOKUPS:.4f} observed "
+            f"{filtered.false_positive_rate():.4f} estimated, "
+            f"{filtered.filter.nbytes():,} bytes, "
+            f"filled from {COUNT:,} ids in {filling:.2f} s"
+        )
+        filtered.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Compares the JSON backends of codec on realistic payloads: receipt
+uploads of several sizes, a batch upload, and the batch response. Both
+directions are timed, decoding from the bytes a request body arrives as."""
+
+import json
+
+from receipt_processor import codec
+
+from .common import report, sample_receipt, time_per_call
+
+
+def payloads():
+    for itemCount in [1, 5, 50, 500]:
+        yield f"receipt, {itemCount} items", sample_receipt(itemCount)
+    batch = []
+    for i in range(100):
+        receipt = sample_receipt(5)
+        receipt["retailer"] = f"Store {i}"
+        batch.append(receipt)
+    yield "batch of 100 receipts", batch
+    yield "batch response, 100 ids", {
+        "ids": ["7fb1377b-b223-49d9-a31a-5a02701dd310"] * 100,
+        "errors": [],
+    }
+
+
+def main() -> None:
+    for name, payload in payloads():
+        body = json.dumps(payload).encode()
+        for backend in codec.BACKENDS:
+            codec.use_backend(backend)
+            report(
+                f"loads {name} ({backend})",
+                time_per_call(lambda: codec.loads(body)),
+            )
+        for backend in codec.BACKENDS:
+            codec.use_backend(backend)
+            report(
+                f"dumps {name} ({backend})",
+                time_per_call(lambda: codec.dumps(payload)),
+            )
+    codec.use_backend()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Compares the cost of generating receipt ids before and after the
+streaming canonical encoding. The old process_receipt generated the id
+twice per new receipt, so that is the baseline for a new upload."""
+
+import json
+import uuid
+
+from receipt_processor.canonical import receipt_id
+
+from .common import report, sample_receipt, time_per_call
+
+
+def legacy_id(receipt) -> str:
+    receiptStr = json.dumps(receipt, sort_keys=True)
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, receiptStr))
+
+
+def main() -> None:
+    for itemCount in [1, 50, 500, 5000]:
+        receipt = sample_receipt(itemCount)
+        assert receipt_id(receipt) == legacy_id(receipt)
+        legacy = time_per_call(lambda: legacy_id(receipt))
+        current = time_per_call(lambda: receipt_id(receipt))
+        report(f"json.dumps + uuid5 ({itemCount} items)", legacy)
+        report(f"new upload, old path, 2 ids ({itemCount} items)", 2 * legacy)
+        report(f"receipt_id ({itemCount} items)", current)
+        print(f"{'speedup per new upload':<48} {2 * legacy / current:>16.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measures LogStore: the cost its log adds to writes, compared with a
+plain CompactStore, and recovery time with a snapshot of COUNT ids and a
+log tail, compared with replaying the whole log.
+
+    python -m benchmarks.bench_log [count]
+
+COUNT defaults to 50 million, which needs about 6GB of memory (the table,
+and its copy while the snapshot is taken) and as much disk."""
+
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+from receipt_processor.store import CompactStore, LogStore
+
+WRITES = 200_000
+TAIL = 100_000
+LOOKUPS = 100_000
+REPLAYED = 1_000_000
+
+
+def random_key(rng: random.Random) -> int:
+    # The top bit keeps the high half non-zero, as in any versioned uuid
+    return rng.getrandbits(128) | (1 << 127)
+
+
+def write_overhead(directory: str) -> None:
+    ids = [str(uuid.uuid4()) for _ in range(WRITES)]
+    for name, store in [
+        ("compact", CompactStore()),
+        ("log", LogStore(os.path.join(directory, "writes"))),
+    ]:
+        start = time.perf_counter()
+        for ID in ids:
+            store.put(ID, 1)
+        store.flush()
+        elapsed = time.perf_counter() - start
+        store.close()
+        print(f"{name + ' put':<40} {WRITES / elapsed:>12,.0f} writes/s")
+
+
+def recovery(directory: str, count: int) -> None:
+    rng = random.Random(0)
+    path = os.path.join(directory, "recovery")
+    store = LogStore(path, snapshotRecords=count + TAIL + 1)
+    start = time.perf_counter()
+    with store._lock:
+        for _ in range(count):
+            store._put_key(random_key(rng), 1)
+    print(f"{'built table':<40} {time.perf_counter() - start:>12.1f} s")
+    start = time.perf_counter()
+    store.snapshot()
+    print(f"{'snapshot':<40} {time.perf_counter() - start:>12.1f} s")
+    store.put_many((str(uuid.uuid4()), 1) for _ in range(TAIL))
+    store.close()
+
+    start = time.perf_counter()
+    store = LogStore(path)
+    opened = time.perf_counter() - start
+    assert len(store) == count + TAIL
+    print(
+        f"{f'recover {count:,} + {TAIL:,} log':<40} "
+        f"{opened:>12.3f} s"
+    )
+    his, los = store._table[0], store._table[1]
+    slots = [i for i in range(0, len(his), len(his) // LOOKUPS) if his[i]]
+    ids = [str(uuid.UUID(int=(his[i] << 64) | los[i])) for i in slots]
+    start = time.perf_counter()
+    found = store.get_many(ids)
+    elapsed = time.perf_counter() - start
+    assert None not in found
+    print(
+        f"{'first lookups after recovery':<40} "
+        f"{len(ids) / elapsed:>12,.0f} reads/s"
+    )
+    store.close()
+
+    # Without snapshots every record is replayed
+    path = os.path.join(directory, "replay")
+    store = LogStore(path, snapshotRecords=REPLAYED + 1)
+    store.put_many((str(uuid.uuid4()), 1) for _ in range(REPLAYED))
+    store.close()
+    start = time.perf_counter()
+    LogStore(path).close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{f'replay {REPLAYED:,} log records':<40} {elapsed:>12.3f} s "
+        f"(~{elapsed * count / REPLAYED:,.0f} s for {count:,})"
+    )
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        write_overhead(directory)
+        recovery(directory, count)
+
+
+if __name__ == "__main__":
+    main()
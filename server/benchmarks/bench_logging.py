@@ -0,0 +1,88 @@
+"""Compares the latency that logging adds to a request thread: synchronous
+print against the queued, structured logger. Output goes to a stream that
+now and then blocks for a couple of milliseconds, like a full stdout pipe
+does when the log collector falls behind."""
+
+import logging
+import time
+
+from receipt_processor.logs import (
+    SAMPLED,
+    configure_logging,
+    shutdown_logging,
+)
+
+CALLS = 20_000
+# One write in STALL_EVERY blocks for STALL_SECONDS
+STALL_EVERY = 200
+STALL_SECONDS = 0.002
+
+
+class StallingStream:
+    def __init__(self) -> None:
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        if self.writes % STALL_EVERY == 0:
+            time.sleep(STALL_SECONDS)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return [
+        latencies[int(len(latencies) * p)] * 1e6 for p in (0.5, 0.99, 0.999)
+    ]
+
+
+def report(name: str, latencies) -> None:
+    p50, p99, p999 = percentiles(latencies)
+    print(
+        f"{name:<32} p50 {p50:>8.1f} us  p99 {p99:>8.1f} us  "
+        f"p99.9 {p999:>8.1f} us"
+    )
+
+
+def measure(logOnce):
+    latencies = []
+    for i in range(CALLS):
+        start = time.perf_counter()
+        logOnce(i)
+        latencies.append(time.perf_counter() - start)
+        # Leave the background writer time to drain, as between requests
+        time.sleep(0.00002)
+    return latencies
+
+
+def main() -> None:
+    stream = StallingStream()
+    report(
+        "print",
+        measure(
+            lambda i: print(
+                f"New receipt stored: id: {i} points: 28", file=stream
+            )
+        ),
+    )
+
+    log = logging.getLogger("benchmark")
+    for rate in [1.0, 0.1]:
+        configure_logging(level="INFO", sampleRate=rate, stream=stream)
+        report(
+            f"queued logging, sample {rate}",
+            measure(
+                lambda i: log.info(
+                    "New receipt stored",
+                    extra={"id": i, "points": 28, **SAMPLED},
+                )
+            ),
+        )
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
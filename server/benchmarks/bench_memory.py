@@ -0,0 +1,54 @@
+"""Measures resident memory per stored receipt for the in-memory stores.
+Each backend is filled in its own process so that RSS growth can be
+attributed to it alone.
+
+    python -m benchmarks.bench_memory [count]
+"""
+
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+
+from receipt_processor.store import CompactStore, MemoryStore
+
+DEFAULT_COUNT = 10_000_000
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss() -> int:
+    """Returns the current resident set size of this process in bytes."""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * PAGE_SIZE
+
+
+def fill(name: str, count: int) -> None:
+    before = rss()
+    store = MemoryStore() if name == "memory" else CompactStore(count)
+    start = time.perf_counter()
+    # uuid5 ids are random 128-bit values with version bits set, uuid4
+    # ids have the same shape and are much cheaper to generate here
+    for points in range(count):
+        store.put(str(uuid.uuid4()), points % 200)
+    elapsed = time.perf_counter() - start
+    grown = rss() - before
+    line = (
+        f"{name:<8} {count:>12,} receipts {grown / count:>8.1f} B/entry RSS "
+        f"{count / elapsed:>12,.0f} puts/s"
+    )
+    if isinstance(store, CompactStore):
+        line += f" {store.bytes_per_entry():>6.1f} B/entry in arrays"
+    print(line, flush=True)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_COUNT
+    for name in ["memory", "compact"]:
+        process = multiprocessing.Process(target=fill, args=(name, count))
+        process.start()
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
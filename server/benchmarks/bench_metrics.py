@@ -0,0 +1,57 @@
+"""Measures what the stage and rule timers cost. With timing disabled the
+instrumentation is a handful of flag checks per receipt; this reports
+their cost next to the full process_receipt path, and the cost of the
+path with timing enabled."""
+
+from receipt_processor import ReceiptProcessor
+from receipt_processor.metrics import TIMING
+from receipt_processor.store import MemoryStore
+
+from .common import report, sample_receipt, time_per_call
+
+# Flag checks on the process_receipt path: one when it starts, one per
+# stage (generate_id, validate, score, store) and one in scoring
+CHECKS_PER_RECEIPT = 6
+
+
+class NullStore(MemoryStore):
+    """Never stores anything, so every upload takes the new receipt path."""
+
+    def put(self, ID: str, points: int) -> None:
+        pass
+
+
+def checks() -> None:
+    for _ in range(CHECKS_PER_RECEIPT):
+        if TIMING.enabled:
+            pass
+
+
+def no_checks() -> None:
+    for _ in range(CHECKS_PER_RECEIPT):
+        pass
+
+
+def main() -> None:
+    checkCost = max(time_per_call(checks) - time_per_call(no_checks), 0)
+    for itemCount in [1, 50]:
+        receipt = sample_receipt(itemCount)
+        receiptProcessor = ReceiptProcessor(NullStore())
+        TIMING.enabled = False
+        disabled = time_per_call(
+            lambda: receiptProcessor.process_receipt(receipt)
+        )
+        TIMING.enabled = True
+        enabled = time_per_call(
+            lambda: receiptProcessor.process_receipt(receipt)
+        )
+        TIMING.enabled = False
+        report(f"process_receipt, timing off ({itemCount} items)", disabled)
+        report(f"process_receipt, timing on ({itemCount} items)", enabled)
+        report(f"flag checks while off ({itemCount} items)", checkCost)
+        print(f"{'overhead while off':<48} {checkCost / disabled:>16.2%}")
+        print(f"{'overhead while on':<48} {enabled / disabled - 1:>16.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Load-tests GET /receipts/{id}/points with the response cache off, on,
+and on with clients that send If-None-Match. A gunicorn server with one
+worker is preloaded with receipts, then polled by client processes.
+
+    python -m benchmarks.bench_points_cache [clients] [seconds]
+"""
+
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+from .common import sample_receipt
+from .loadtest import PORT, wait_for_server
+
+RECEIPTS = 1000
+
+
+def upload(count: int):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT)
+    receipt = sample_receipt(5)
+    ids = []
+    for i in range(count):
+        receipt["retailer"] = f"Store {i}"
+        connection.request(
+            "POST",
+            "/receipts/process",
+            json.dumps(receipt),
+            {"Content-Type": "application/json"},
+        )
+        ids.append(json.loads(connection.getresponse().read())["id"])
+    return ids
+
+
+def client(ids, conditional: bool, seconds: float, seed: int, results):
+    connection = http.client.HTTPConnection("127.0.0.1", PORT)
+    rng = random.Random(seed)
+    etags = {}
+    completed = failed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        ID = rng.choice(ids)
+        headers = {}
+        if conditional and ID in etags:
+            headers["If-None-Match"] = etags[ID]
+        connection.request("GET", f"/receipts/{ID}/points", headers=headers)
+        response = connection.getresponse()
+        response.read()
+        if response.status == 200:
+            etags[ID] = response.getheader("ETag")
+            completed += 1
+        elif response.status == 304:
+            completed += 1
+        else:
+            failed += 1
+    results.put((completed, failed))
+
+
+def run(
+    name: str, cacheSize: int, conditional: bool, clients: int, seconds: float
+) -> None:
+    env = {
+        **os.environ,
+        "PORT": str(PORT),
+        "WEB_CONCURRENCY": "1",
+        "RECEIPT_STORE": "memory",
+        "POINTS_CACHE_SIZE": str(cacheSize),
+        "LOG_LEVEL": "WARNING",
+    }
+    server = subprocess.Popen(
+        ["gunicorn", "--config", "gunicorn.conf.py", "host:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_server(server)
+        ids = upload(RECEIPTS)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=client, args=(ids, conditional, seconds, seed, results)
+            )
+            for seed in range(clients)
+        ]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        server.terminate()
+        server.wait()
+    completed = sum(done for done, _ in totals)
+    failed = sum(fail for _, fail in totals)
+    print(
+        f"{name:<32} {completed / seconds:>10,.0f} requests/s "
+        f"{failed:>6} failed"
+    )
+
+
+def main() -> None:
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    run("cache off", 0, False, clients, seconds)
+    run("cache on", 100_000, False, clients, seconds)
+    run("cache on, If-None-Match", 100_000, True, clients, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Finds where validating and scoring in the process pool starts to beat
+doing it inline, by receipt size, and how batch throughput scales with the
+number of workers. Pool times include pickling and the round trip, so the
+crossover is the smallest receipt worth sending to a worker (INLINE_ITEMS).
+
+    python -m benchmarks.bench_pool [max workers]"""
+
+import os
+import sys
+import time
+
+from receipt_processor import ReceiptProcessor
+
+from .bench_metrics import NullStore
+from .common import report, sample_receipt, time_per_call
+
+ITEM_COUNTS = [1, 10, 50, 100, 250, 500, 1000, 2500]
+BATCH_SIZE = 2000
+BATCH_ITEMS = 20
+
+
+def crossover() -> None:
+    inline = ReceiptProcessor(NullStore())
+    pooled = ReceiptProcessor(NullStore(), workers=1, inlineItems=0)
+    print(f"{'items':>6} {'inline ns':>14} {'pool ns':>14} {'speedup':>8}")
+    for itemCount in ITEM_COUNTS:
+        receipt = sample_receipt(itemCount)
+        inlineNs = time_per_call(lambda: inline.process_receipt(receipt))
+        pooledNs = time_per_call(lambda: pooled.process_receipt(receipt))
+        print(
+            f"{itemCount:>6} {inlineNs:>14,.0f} {pooledNs:>14,.0f} "
+            f"{inlineNs / pooledNs:>8.2f}"
+        )
+    pooled.close()
+
+
+def scaling(maxWorkers: int) -> None:
+    batch = []
+    for i in range(BATCH_SIZE):
+        receipt = sample_receipt(BATCH_ITEMS)
+        receipt["retailer"] = f"Store {i}"
+        batch.append(receipt)
+    inline = ReceiptProcessor(NullStore())
+    report(
+        f"batch of {BATCH_SIZE} inline",
+        time_per_call(lambda: inline.process_receipts(batch), repeat=3),
+    )
+    for workers in range(1, maxWorkers + 1):
+        pooled = ReceiptProcessor(NullStore(), workers=workers, inlineItems=0)
+        # Start the workers before timing
+        pooled.process_receipts(batch)
+        start = time.perf_counter()
+        pooled.process_receipts(batch)
+        elapsed = time.perf_counter() - start
+        report(f"batch of {BATCH_SIZE} with {workers} workers", elapsed * 1e9)
+        pooled.close()
+
+
+def main() -> None:
+    maxWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    crossover()
+    scaling(maxWorkers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compares scoring a parsed receipt with the compiled default rules
+against points.calculate_parsed_points, and shows that extra rules cost
+only their own comparison."""
+
+from receipt_processor.points import calculate_parsed_points
+from receipt_processor.rules import DEFAULT_RULES, compile_rules
+from receipt_processor.validator import ReceiptValidator
+
+from .common import report, sample_receipt, time_per_call
+
+EXTRA_RULES = [
+    {
+        "name": f"promo_{i}",
+        "field": "total",
+        "when": {"multiple_of": f"{i}.00"},
+        "award": {"points": i},
+    }
+    for i in range(1, 21)
+]
+
+
+def main() -> None:
+    compiled = compile_rules(DEFAULT_RULES)
+    extended = compile_rules(DEFAULT_RULES + EXTRA_RULES)
+    for itemCount in [1, 10, 100]:
+        parsed, _ = ReceiptValidator().check(sample_receipt(itemCount))
+        report(
+            f"calculate_parsed_points ({itemCount} items)",
+            time_per_call(lambda: calculate_parsed_points(parsed)),
+        )
+        report(
+            f"compiled default rules ({itemCount} items)",
+            time_per_call(lambda: compiled(parsed)),
+        )
+        report(
+            f"compiled with {len(EXTRA_RULES)} more rules ({itemCount} items)",
+            time_per_call(lambda: extended(parsed)),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compares write and read throughput of the receipt store backends,
+including SQLite without group commit (one transaction per write), and
+batched reads through get_many. The bounded store holds half the ids, so
+every other write evicts one."""
+
+import os
+import tempfile
+import time
+import uuid
+
+from receipt_processor.store import (
+    BoundedStore,
+    CompactStore,
+    MemoryStore,
+    SQLiteStore,
+)
+
+COUNT = 100_000
+# Ids per get_many call, as in the bulk points lookup
+BATCH_SIZE = 1000
+
+
+def run(name: str, store, ids) -> None:
+    start = time.perf_counter()
+    for points, ID in enumerate(ids):
+        store.put(ID, points)
+    store.flush()
+    writes = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ID in ids:
+        store.get(ID)
+    reads = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(ids), BATCH_SIZE):
+        store.get_many(ids[i:i + BATCH_SIZE])
+    batchReads = time.perf_counter() - start
+    store.close()
+    print(
+        f"{name:<28} {len(ids) / writes:>11,.0f} writes/s "
+        f"{len(ids) / reads:>11,.0f} reads/s "
+        f"{len(ids) / batchReads:>11,.0f} batched reads/s"
+    )
+
+
+def main() -> None:
+    ids = [str(uuid.uuid4()) for _ in range(COUNT)]
+    with tempfile.TemporaryDirectory() as directory:
+        run("memory", MemoryStore(), ids)
+        run(
+            "memory (bounded, ttl)",
+            BoundedStore(maxEntries=COUNT // 2, ttl=3600),
+            ids,
+        )
+        run("compact", CompactStore(), ids)
+        run(
+            "sqlite (group commit)",
+            SQLiteStore(os.path.join(directory, "grouped.db")),
+            ids,
+        )
+        # Committing every write is slow, so only time a slice of the ids
+        run(
+            "sqlite (commit per write)",
+            SQLiteStore(os.path.join(directory, "single.db"), batchSize=1),
+            ids[: COUNT // 20],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Compares reading one large receipt as a stream (process_stream) with
+parsing its whole body first (process_receipt, as for request.json): the
+peak resident memory each adds, their time, and how soon each rejects a
+receipt whose first item is invalid. Every measurement runs in its own
+process, so that peak RSS can be attributed to it alone.
+
+    python -m benchmarks.bench_streaming [item counts...]
+"""
+
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from receipt_processor import ReceiptProcessor, codec
+
+from .bench_memory import rss
+from .common import sample_receipt
+
+DEFAULT_ITEM_COUNTS = [10_000, 100_000, 500_000]
+
+
+def parse_whole(processor: ReceiptProcessor, path: str) -> None:
+    with open(path, "rb") as file:
+        processor.process_receipt(codec.loads(file.read()))
+
+
+def stream(processor: ReceiptProcessor, path: str) -> None:
+    with open(path, "rb") as file:
+        processor.process_stream(
+            file, maxBytes=os.path.getsize(path), maxItems=sys.maxsize
+        )
+
+
+PATHS = {"parse whole": parse_whole, "stream": stream}
+
+
+def measure(name: str, path: str, label: str) -> None:
+    processor = ReceiptProcessor()
+    before = rss()
+    start = time.perf_counter()
+    try:
+        PATHS[name](processor, path)
+    except ValueError:
+        pass
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(
+        f"{label:<28} {name:<12} {(peak - before) / 2**20:>10,.1f} MiB "
+        f"{elapsed * 1000:>10,.1f} ms",
+        flush=True,
+    )
+
+
+def run(name: str, path: str, label: str) -> None:
+    process = multiprocessing.Process(
+        target=measure, args=(name, path, label)
+    )
+    process.start()
+    process.join()
+
+
+def main() -> None:
+    itemCounts = [int(count) for count in sys.argv[1:]]
+    print(f"{'receipt':<28} {'path':<12} {'peak RSS':>14} {'time':>13}")
+    with tempfile.TemporaryDirectory() as directory:
+        for itemCount in itemCounts or DEFAULT_ITEM_COUNTS:
+            receipt = sample_receipt(itemCount)
+            valid = os.path.join(directory, "valid.json")
+            with open(valid, "w") as file:
+                json.dump(receipt, file)
+            receipt["items"][0]["price"] = "free"
+            invalid = os.path.join(directory, "invalid.json")
+            with open(invalid, "w") as file:
+                json.dump(receipt, file)
+            del receipt
+            size = os.path.getsize(valid) / 2**20
+            for name in PATHS:
+                run(name, valid, f"{itemCount:,} items ({size:.1f} MiB)")
+            for name in PATHS:
+                run(name, invalid, f"{itemCount:,} items, first invalid")
+
+
+if __name__ == "__main__":
+    main()
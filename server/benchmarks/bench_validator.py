@@ -0,0 +1,85 @@
+"""Compares the single-pass ReceiptValidator against the original chain of
+_validate_* methods, which is reproduced here as the baseline."""
+
+import re
+from datetime import datetime
+from typing import Any, Dict
+
+from receipt_processor.points import (
+    calculate_parsed_points,
+    calculate_receipt_points,
+)
+from receipt_processor.validator import REGEX, ReceiptValidator
+
+from .common import report, sample_receipt, time_per_call
+
+
+def legacy_valid_receipt(receipt: Dict[str, Any]) -> bool:
+    """The validation path as it was before ReceiptValidator."""
+
+    def valid_date(value: Any, fmt: str) -> bool:
+        if not isinstance(value, str):
+            return False
+        try:
+            datetime.strptime(value, fmt)
+            return True
+        except ValueError:
+            return False
+
+    def valid_items(receipt: Dict[str, Any]) -> bool:
+        if (
+            "items" not in receipt
+            or not isinstance(receipt["items"], list)
+            or len(receipt["items"]) < 1
+        ):
+            return False
+        for item in receipt["items"]:
+            if not (
+                "shortDescription" in item
+                and isinstance(item["shortDescription"], str)
+                and re.match(REGEX["desc"], item["shortDescription"])
+                and "price" in item
+                and isinstance(item["price"], str)
+                and re.match(REGEX["price"], item["price"])
+            ):
+                return False
+        return True
+
+    return bool(
+        "retailer" in receipt
+        and isinstance(receipt["retailer"], str)
+        and re.match(REGEX["retailer"], receipt["retailer"])
+        and valid_date(receipt.get("purchaseDate"), "%Y-%m-%d")
+        and valid_date(receipt.get("purchaseTime"), "%H:%M")
+        and valid_items(receipt)
+        and "total" in receipt
+        and isinstance(receipt["total"], str)
+        and re.match(REGEX["total"], receipt["total"])
+    )
+
+
+def main() -> None:
+    validator = ReceiptValidator()
+    for itemCount in [1, 5, 50, 500]:
+        receipt = sample_receipt(itemCount)
+        assert legacy_valid_receipt(receipt) and validator.is_valid(receipt)
+        legacy = time_per_call(lambda: legacy_valid_receipt(receipt))
+        current = time_per_call(lambda: validator.is_valid(receipt))
+        report(f"legacy _valid_receipt ({itemCount} items)", legacy)
+        report(f"ReceiptValidator ({itemCount} items)", current)
+        print(f"{'speedup':<48} {legacy / current:>16.2f}x")
+        # check() also parses, which saves work in the scoring that follows
+        legacy = time_per_call(
+            lambda: legacy_valid_receipt(receipt)
+            and calculate_receipt_points(receipt)
+        )
+        current = time_per_call(
+            lambda: calculate_parsed_points(validator.check(receipt)[0])
+        )
+        report(f"legacy validate and score ({itemCount} items)", legacy)
+        report(f"check and score parsed ({itemCount} items)", current)
+        print(f"{'speedup':<48} {legacy / current:>16.2f}x")
+
+
+if __name__ == "__main__":
+    main()
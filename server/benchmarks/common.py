@@ -0,0 +1,80 @@
+"""Shared helpers for the benchmark scripts. Run any benchmark from the
+server folder, e.g. `python -m benchmarks.bench_validator`."""
+
+import random
+import timeit
+from typing import Any, Callable, Dict, List
+
+RETAILERS = ["Target", "M&M Corner Market", "Walgreens", "Trader Joes"]
+DESCRIPTIONS = [
+    "Gatorade", "Mountain Dew 12PK", "Emils Cheese Pizza", "Dasani"
+]
+
+
+def sample_receipt(itemCount: int = 5) -> Dict[str, Any]:
+    """Builds a valid receipt with the given number of items."""
+    return {
+        "retailer": "M&M Corner Market",
+        "purchaseDate": "2022-03-20",
+        "purchaseTime": "14:33",
+        "items": [
+            {"shortDescription": f"Gatorade {i}", "price": f"{i % 50}.25"}
+            for i in range(itemCount)
+        ],
+        "total": "9.00",
+    }
+
+
+def generate_receipts(
+    count: int,
+    itemCount: int,
+    duplicateRatio: float = 0.0,
+    invalidRatio: float = 0.0,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Builds count varied receipts of itemCount items each. About
+    duplicateRatio of them repeat an earlier receipt of the list, and about
+    invalidRatio break one rule of the contract (a bad date, a bad price or
+    a missing total). The same arguments always give the same receipts."""
+    rng = random.Random(seed)
+    receipts: List[Dict[str, Any]] = []
+    for i in range(count):
+        if receipts and rng.random() < duplicateRatio:
+            receipts.append(rng.choice(receipts))
+            continue
+        cents = [rng.randrange(1, 5000) for _ in range(itemCount)]
+        receipt = {
+            "retailer": rng.choice(RETAILERS),
+            "purchaseDate": f"2022-{rng.randint(1, 12):02}-"
+            f"{rng.randint(1, 28):02}",
+            "purchaseTime": f"{rng.randint(0, 23):02}:{rng.randint(0, 59):02}",
+            "items": [
+                {
+                    "shortDescription": f"{rng.choice(DESCRIPTIONS)} {i}",
+                    "price": f"{c // 100}.{c % 100:02}",
+                }
+                for c in cents
+            ],
+            "total": f"{sum(cents) // 100}.{sum(cents) % 100:02}",
+        }
+        if rng.random() < invalidRatio:
+            flaw = rng.randrange(3)
+            if flaw == 0:
+                receipt["purchaseDate"] = "2022-02-30"
+            elif flaw == 1:
+                receipt["items"][-1]["price"] = "1.5"
+            else:
+                del receipt["total"]
+        receipts.append(receipt)
+    return receipts
+
+
+def time_per_call(func: Callable[[], Any], repeat: int = 5) -> float:
+    """Returns the best observed time, in nanoseconds, of a single call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def report(name: str, nanoseconds: float) -> None:
+    print(f"{name:<48} {nanoseconds:>14,.0f} ns")
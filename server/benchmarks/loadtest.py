@@ -0,0 +1,114 @@
+"""Load-tests the production server as the worker count grows from 1 to N.
+For each worker count a gunicorn server is started on a fresh shared SQLite
+store and driven by client processes that upload a receipt and then fetch
+its points, counting every request that got the expected response.
+
+    python -m benchmarks.loadtest [max_workers] [seconds]
+"""
+
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .common import sample_receipt
+
+PORT = 8099
+CLIENTS_PER_WORKER = 4
+
+
+def client(seconds: float, seed: int, results) -> None:
+    connection = http.client.HTTPConnection("127.0.0.1", PORT)
+    headers = {"Content-Type": "application/json"}
+    receipt = sample_receipt(5)
+    completed = failed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        # A new receipt every time so that uploads are not duplicates
+        receipt["retailer"] = f"Store {seed} {completed}"
+        connection.request(
+            "POST", "/receipts/process", json.dumps(receipt), headers
+        )
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            failed += 1
+            continue
+        ID = json.loads(body)["id"]
+        connection.request("GET", f"/receipts/{ID}/points")
+        response = connection.getresponse()
+        response.read()
+        # Ids must resolve no matter which worker answers
+        if response.status == 200:
+            completed += 2
+        else:
+            failed += 1
+    results.put((completed, failed))
+
+
+def wait_for_server(process: subprocess.Popen) -> None:
+    for _ in range(100):
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", PORT)
+            connection.request("GET", "/receipts/unknown/points")
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn did not start")
+
+
+def run(workers: int, seconds: float) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "PORT": str(PORT),
+            "WEB_CONCURRENCY": str(workers),
+            "RECEIPT_STORE": f"sqlite:///{directory}/receipts.db?shared=1",
+        }
+        server = subprocess.Popen(
+            ["gunicorn", "--config", "gunicorn.conf.py", "host:app"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_server(server)
+            results = multiprocessing.Queue()
+            clients = [
+                multiprocessing.Process(
+                    target=client, args=(seconds, seed, results)
+                )
+                for seed in range(workers * CLIENTS_PER_WORKER)
+            ]
+            for process in clients:
+                process.start()
+            totals = [results.get() for _ in clients]
+            for process in clients:
+                process.join()
+        finally:
+            server.terminate()
+            server.wait()
+    completed = sum(done for done, _ in totals)
+    failed = sum(fail for _, fail in totals)
+    print(
+        f"{workers:>3} workers {completed / seconds:>10,.0f} requests/s "
+        f"{failed:>6} failed"
+    )
+
+
+def main() -> None:
+    maxWorkers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    for workers in range(1, maxWorkers + 1):
+        run(workers, seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""Benchmarks every stage of the receipt pipeline, from validation to the
+HTTP endpoints, on generated receipts of 1 to 1000 items with several mixes
+of duplicate and invalid receipts. Reports, per receipt, the time in
+nanoseconds and the memory allocated at the peak of a pass (tracemalloc),
+and, for the stages that store receipts, the memory they retain.
+
+    python -m benchmarks.suite run [--save] [--filter TEXT]
+    python -m benchmarks.suite compare BASELINE [CANDIDATE]
+
+run --save keeps the results in benchmarks/results/<commit>.json (with a
+-dirty suffix for uncommitted changes, or --label). compare prints how the
+candidate, by default the current commit, changed against the baseline,
+flagging cases that got more than --threshold slower."""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from receipt_processor import ReceiptProcessor
+from receipt_processor.points import calculate_receipt_points
+from receipt_processor.store import MemoryStore
+
+from .common import generate_receipts
+
+RESULTS = os.path.join(os.path.dirname(__file__), "results")
+ITEM_COUNTS = [1, 10, 100, 1000]
+# (name, duplicate ratio, invalid ratio)
+MIXES = [
+    ("unique", 0.0, 0.0),
+    ("50% duplicates", 0.5, 0.0),
+    ("10% invalid", 0.0, 0.1),
+]
+# Items per pass, spread over fewer receipts as they grow
+ITEMS_PER_PASS = 4000
+
+Receipts = List[Dict[str, Any]]
+# Prepares a pass over the receipts, outside of the measurement, and
+# returns the pass
+Setup = Callable[[Receipts], Callable[[], Any]]
+
+
+class Case(NamedTuple):
+    name: str
+    receipts: Receipts
+    setup: Setup
+    # Whether the pass keeps what it stores, so retained memory is reported
+    stores: bool = False
+
+
+def _processor_pass(receipts: Receipts) -> Callable[[], Any]:
+    processor = ReceiptProcessor()
+
+    def run() -> None:
+        for receipt in receipts:
+            try:
+                processor.process_receipt(receipt)
+            except ValueError:
+                pass
+
+    return run
+
+
+def _batch_pass(receipts: Receipts) -> Callable[[], Any]:
+    processor = ReceiptProcessor()
+    return lambda: processor.process_receipts(receipts)
+
+
+def _stage_pass(stage: Callable[[Any], Any]) -> Setup:
+    def setup(receipts: Receipts) -> Callable[[], Any]:
+        return lambda: [stage(receipt) for receipt in receipts]
+
+    return setup
+
+
+def _http_client():
+    # Keeps the service's logging out of the measurements
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    import host
+
+    return host, host.app.test_client()
+
+
+def _upload_pass(receipts: Receipts) -> Callable[[], Any]:
+    host, client = _http_client()
+    host.receiptProcessor.receipts = MemoryStore()
+
+    def run() -> None:
+        for receipt in receipts:
+            client.post("/receipts/process", json=receipt)
+
+    return run
+
+
+def _points_pass(receipts: Receipts) -> Callable[[], Any]:
+    host, client = _http_client()
+    host.receiptProcessor.receipts = MemoryStore()
+    paths = [
+        f"/receipts/{host.receiptProcessor.process_receipt(receipt)}/points"
+        for receipt in receipts
+    ]
+
+    def run() -> None:
+        for path in paths:
+            client.get(path)
+
+    return run
+
+
+def cases() -> List[Case]:
+    processor = ReceiptProcessor()
+    stages = [
+        ("_valid_receipt", _stage_pass(processor._valid_receipt)),
+        ("_generate_id", _stage_pass(processor._generate_id)),
+        ("calculate_receipt_points", _stage_pass(calculate_receipt_points)),
+    ]
+    pipelines = [
+        ("process_receipt", _processor_pass),
+        ("process_receipts", _batch_pass),
+        ("POST /receipts/process", _upload_pass),
+    ]
+    result = []
+    for itemCount in ITEM_COUNTS:
+        count = max(ITEMS_PER_PASS // itemCount, 8)
+        receipts = generate_receipts(count, itemCount)
+        for stage, setup in stages:
+            name = f"{stage} ({itemCount} items)"
+            result.append(Case(name, receipts, setup))
+        for mix, duplicateRatio, invalidRatio in MIXES:
+            mixed = generate_receipts(
+                count, itemCount, duplicateRatio, invalidRatio
+            )
+            for pipeline, setup in pipelines:
+                result.append(
+                    Case(
+                        f"{pipeline} ({itemCount} items, {mix})",
+                        mixed,
+                        setup,
+                        stores=True,
+                    )
+                )
+        result.append(
+            Case(
+                f"GET /receipts/{{id}}/points ({itemCount} items)",
+                receipts,
+                _points_pass,
+            )
+        )
+    return result
+
+
+def measure(case: Case, repeat: int) -> Dict[str, float]:
+    """Returns the best time of repeat passes, and the memory peak and
+    retention of one more pass under tracemalloc, all per receipt."""
+    count = len(case.receipts)
+    best = float("inf")
+    for _ in range(repeat):
+        run = case.setup(case.receipts)
+        gc.collect()
+        start = time.perf_counter_ns()
+        run()
+        best = min(best, time.perf_counter_ns() - start)
+
+    run = case.setup(case.receipts)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = run()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "ns": best / count,
+        "peak_bytes": (peak - before) / count,
+        "retained_bytes": (current - before) / count if case.stores else 0,
+    }
+
+
+def commit_label() -> str:
+    """The current commit's short hash, suffixed -dirty when the tree has
+    uncommitted changes."""
+    git = ["git", "-C", os.path.dirname(__file__)]
+    commit = subprocess.run(
+        git + ["rev-parse", "--short", "HEAD"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    dirty = subprocess.run(
+        git + ["status", "--porcelain", "--untracked-files=no"],
+        capture_output=True, text=True, check=True,
+    ).stdout.strip()
+    return commit + "-dirty" if dirty else commit
+
+
+def results_path(label: str) -> str:
+    return os.path.join(RESULTS, f"{label}.json")
+
+
+def load_results(label: str) -> Dict[str, Dict[str, float]]:
+    with open(results_path(label)) as file:
+        return json.load(file)["results"]
+
+
+def run_suite(arguments: argparse.Namespace) -> None:
+    results = {}
+    print(f"{'case':<58} {'ns/receipt':>12} {'peak B':>10} {'kept B':>8}")
+    for case in cases():
+        if arguments.filter and arguments.filter not in case.name:
+            continue
+        result = measure(case, arguments.repeat)
+        results[case.name] = result
+        print(
+            f"{case.name:<58} {result['ns']:>12,.0f} "
+            f"{result['peak_bytes']:>10,.0f} {result['retained_bytes']:>8,.0f}"
+        )
+    if arguments.save:
+        label = arguments.label or commit_label()
+        os.makedirs(RESULTS, exist_ok=True)
+        with open(results_path(label), "w") as file:
+            json.dump(
+                {
+                    "label": label,
+                    "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "python": sys.version.split()[0],
+                    "machine": platform.platform(),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+        print(f"Saved to {results_path(label)}")
+
+
+def compare(
+    baseline: Dict[str, Dict[str, float]],
+    candidate: Dict[str, Dict[str, float]],
+    threshold: float,
+) -> List[Tuple[str, float, float]]:
+    """Prints the change of every case in both results and returns the
+    (case, baseline ns, candidate ns) that slowed down by more than the
+    threshold, a fraction."""
+    regressions = []
+    print(f"{'case':<58} {'baseline':>12} {'candidate':>12} {'change':>8}")
+    for name, old in baseline.items():
+        if name not in candidate:
+            continue
+        new = candidate[name]
+        change = new["ns"] / old["ns"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append((name, old["ns"], new["ns"]))
+            flag = "  slower"
+        print(
+            f"{name:<58} {old['ns']:>12,.0f} {new['ns']:>12,.0f} "
+            f"{change:>+8.1%}{flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the receipt pipeline."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--filter", help="only run cases containing this text")
+    run.add_argument("--repeat", type=int, default=5)
+    run.add_argument("--save", action="store_true", help="keep the results")
+    run.add_argument("--label", help="save under this name, not the commit")
+    compareCommand = commands.add_parser(
+        "compare", help="compare saved results"
+    )
+    compareCommand.add_argument("baseline")
+    compareCommand.add_argument("candidate", nargs="?")
+    compareCommand.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="slowdown reported as a regression, default 0.10",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.command == "run":
+        run_suite(arguments)
+        return
+    regressions = compare(
+        load_results(arguments.baseline),
+        load_results(arguments.candidate or commit_label()),
+        arguments.threshold,
+    )
+    if regressions:
+        print(f"{len(regressions)} cases regressed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Production serving configuration, used by the Docker image:
+
+    gunicorn --config gunicorn.conf.py host:app
+
+Every worker process builds its own ReceiptProcessor, so with more than one
+worker RECEIPT_STORE must point at a shared store (e.g.
+sqlite:////app/data/receipts.db?shared=1) for an id returned by one worker
+to resolve on any other.
+
+Each worker also has its own metrics. With more than one worker they are
+shared through METRICS_DIR, a fresh temporary directory unless it is set,
+so that /metrics adds up every worker's counters whichever one answers."""
+
+import glob
+import multiprocessing
+import os
+import tempfile
+
+from receipt_processor.store import open_store
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("THREADS", "4"))
+worker_class = "gthread"
+# Keep-alive lets load balancers and batch clients reuse connections
+keepalive = 5
+
+store = open_store(os.environ.get("RECEIPT_STORE", "memory"))
+if workers > 1 and not store.shared:
+    raise RuntimeError(
+        "RECEIPT_STORE must be a shared store when WEB_CONCURRENCY > 1"
+    )
+# Only the check needs the store here, each worker opens its own
+store.close()
+del store
+
+if workers > 1:
+    # Read by each worker's host module, which the workers inherit
+    metricsDirectory = os.environ.get("METRICS_DIR")
+    if metricsDirectory is None:
+        metricsDirectory = tempfile.mkdtemp(prefix="receipt-metrics-")
+        os.environ["METRICS_DIR"] = metricsDirectory
+    # Totals start again from zero with the server
+    for path in glob.glob(os.path.join(metricsDirectory, "*.json")):
+        os.remove(path)
+
+
+def worker_exit(server, worker):
+    """Flushes the worker's store, and its last metrics, before it exits."""
+    from host import receiptProcessor
+    from receipt_processor.metrics import REGISTRY
+
+    receiptProcessor.close()
+    REGISTRY.write_snapshot()
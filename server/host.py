@@ -1,34 +1,551 @@
-from flask import Flask, jsonify, request
-from receipt_processor import ReceiptProcessor
+import atexit
+import logging
+import os
+import time
+
+from flask import (
+    Flask,
+    Response,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from flask.json.provider import DefaultJSONProvider
+from receipt_processor import codec
+from receipt_processor.aggregates import (
+    HISTOGRAM_BUCKETS,
+    points_histogram,
+    top_retailers,
+)
+from receipt_processor.canonical import is_receipt_id, receipt_id
+from receipt_processor.cluster import HOP_HEADER, SECRET_HEADER, NodeError
+from receipt_processor.logs import SAMPLED, configure_logging
+from receipt_processor.metrics import (
+    POINTS_CACHE,
+    REGISTRY,
+    REQUEST_SECONDS,
+    REQUESTS,
+    TIMING,
+    Gauge,
+)
+from receipt_processor.service import (
+    STREAM_BODY_BYTES,
+    PointsResponses,
+    cluster_from_environment,
+    processor_from_environment,
+)
+from receipt_processor.store import FilteredStore, NewReceipt
+from receipt_processor.streaming import MAX_BODY_BYTES, ReceiptTooLargeError
+from receipt_processor.validator import parse_date
+
+# LOG_LEVEL and LOG_SAMPLE_RATE tune logging, see logs.configure_logging
+configure_logging()
+log = logging.getLogger("host")
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Parses request bodies and writes responses with codec, which uses
+    orjson when it is installed. Pretty printing (debug mode) and other
+    json.dumps options still go through the standard library."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs and kwargs != {"separators": (",", ":")}:
+            return super().dumps(obj, **kwargs)
+        return codec.dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return codec.loads(s)
+
 
 app = Flask(__name__)
+app.json = CodecJSONProvider(app)
+
+# Configured by RECEIPT_STORE, SCORING_WORKERS, POINTS_RULES and
+# ID_FILTER_ERROR_RATE
+receiptProcessor = processor_from_environment()
+atexit.register(receiptProcessor.close)
+
+# METRICS_TIMING=1 turns on the per-stage and per-rule timers
+TIMING.enabled = os.environ.get("METRICS_TIMING") == "1"
+# Set by gunicorn.conf.py with several workers, so that /metrics adds up
+# the counters of every worker
+if metricsDirectory := os.environ.get("METRICS_DIR"):
+    REGISTRY.share(metricsDirectory)
+REGISTRY.register(
+    Gauge(
+        "receipts_stored",
+        "Receipts held in the store.",
+        lambda: len(receiptProcessor.receipts),
+    )
+)
+if isinstance(receiptProcessor.receipts, FilteredStore):
+    REGISTRY.register(
+        Gauge(
+            "receipt_id_filter_false_positive_rate",
+            "Estimated share of unknown ids the filter lets through.",
+            receiptProcessor.receipts.false_positive_rate,
+        )
+    )
+# Set in cluster mode, by CLUSTER_NODES and CLUSTER_SELF
+cluster = cluster_from_environment()
+# Points bodies and ETags, cached for POINTS_CACHE_SIZE ids
+pointsResponses = PointsResponses(receiptProcessor)
 
-receiptProcessor = ReceiptProcessor()
+
+@app.before_request
+def start_request_timer():
+    g.requestStart = time.perf_counter()
+
+
+@app.before_request
+def authenticate_nodes():
+    """In cluster mode, serves the /cluster routes and forwarded requests
+    only to nodes that send the cluster's secret."""
+    if cluster is None:
+        return None
+    if request.path.startswith("/cluster/") or HOP_HEADER in request.headers:
+        if not cluster.is_peer(request.headers.get(SECRET_HEADER)):
+            log.warning(
+                "Cluster request without the secret",
+                extra={"path": request.path},
+            )
+            return "Forbidden", 403
+    return None
+
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUESTS.inc(route, str(response.status_code))
+    REQUEST_SECONDS.observe(time.perf_counter() - g.requestStart, route)
+    return response
 
 
 @app.route("/receipts/process", methods=["POST"])
 def upload_receipt():
+    length = request.content_length
+    if length is not None and length > MAX_BODY_BYTES:
+        return "The receipt is too large", 413
+    # Large bodies, and bodies of unknown length, are read as they arrive.
+    # In cluster mode the body is kept whole, to forward it to its owner.
+    if (
+        request.is_json
+        and (length is None or length >= STREAM_BODY_BYTES)
+        and not _sharded()
+    ):
+        return _upload_stream()
+    if timed := TIMING.enabled:
+        start = time.perf_counter()
     receipt = request.json
-    print(f"\nProcessing receipt...")
+    if timed:
+        TIMING.record("parse_json", start)
+    if _sharded() and (owner := _remote_owner(receipt_id(receipt))):
+        return _forward(owner)
+    log.debug("Processing receipt")
     try:
         ID = receiptProcessor.process_receipt(receipt)
     except ValueError:
-        print("Invalid receipt uploaded")
+        log.info("Invalid receipt uploaded")
         return "The receipt is invalid", 400
 
     return jsonify({"id": ID}), 200
 
 
+def _upload_stream():
+    """upload_receipt, reading and checking the receipt as it arrives."""
+    log.debug("Processing streamed receipt")
+    try:
+        ID = receiptProcessor.process_stream(request.stream)
+    except ReceiptTooLargeError as error:
+        log.info("Oversized receipt uploaded", extra={"error": str(error)})
+        return "The receipt is too large", 413
+    except ValueError:
+        log.info("Invalid receipt uploaded")
+        return "The receipt is invalid", 400
+
+    return jsonify({"id": ID}), 200
+
+
+@app.route("/receipts/process:batch", methods=["POST"])
+def upload_receipts():
+    """Accepts a JSON array, or an NDJSON body with one receipt per line, and
+    returns ids aligned with the input alongside per-index errors."""
+    log.debug("Processing receipt batch")
+    if request.mimetype == "application/x-ndjson":
+        receipts, errors = _parse_ndjson(request.get_data(as_text=True))
+    else:
+        receipts, errors = request.get_json(silent=True), {}
+    if not isinstance(receipts, list):
+        log.info("Invalid receipt batch uploaded")
+        return "The receipt batch is invalid", 400
+
+    if _sharded():
+        IDs = _process_sharded(receipts, errors)
+    else:
+        IDs = _process_batch(receipts, errors)
+
+    return jsonify({
+        "ids": IDs,
+        "errors": [
+            {"index": index, **error}
+            for index, error in sorted(errors.items())
+        ],
+    }), 200
+
+
+def _process_batch(receipts, errors):
+    """Processes the receipts that parsed, adding an entry to errors for
+    each invalid one. Returns their ids."""
+    IDs, invalid = receiptProcessor.process_receipts(receipts)
+    for index, violations in invalid.items():
+        if index not in errors:
+            errors[index] = {
+                "error": "The receipt is invalid",
+                "violations": [str(violation) for violation in violations],
+            }
+    return IDs
+
+
+def _process_sharded(receipts, errors):
+    """_process_batch, with each receipt processed by the node that owns
+    its id. Receipts that did not parse stay here, for their errors."""
+    local = list(range(len(receipts)))
+    remote = {}
+    for index, receipt in enumerate(receipts):
+        if index not in errors:
+            owner = _remote_owner(receipt_id(receipt))
+            if owner is not None:
+                remote.setdefault(owner, []).append(index)
+    if remote:
+        elsewhere = {i for indexes in remote.values() for i in indexes}
+        local = [i for i in local if i not in elsewhere]
+
+    IDs = [None] * len(receipts)
+    localErrors = {}
+    localIDs = _process_batch([receipts[i] for i in local], localErrors)
+    for position, index in enumerate(local):
+        IDs[index] = localIDs[position]
+        if position in localErrors:
+            errors.setdefault(index, localErrors[position])
+    for owner, indexes in remote.items():
+        status, _, body = cluster.forward(
+            owner,
+            "POST",
+            "/receipts/process:batch",
+            codec.dumps([receipts[i] for i in indexes]).encode(),
+            {"Content-Type": "application/json"},
+        )
+        if status != 200:
+            raise NodeError(f"{owner} answered {status}")
+        result = codec.loads(body)
+        for index, ID in zip(indexes, result["ids"]):
+            IDs[index] = ID
+        for error in result["errors"]:
+            errors[indexes[error.pop("index")]] = error
+    return IDs
+
+
+def _parse_ndjson(body: str):
+    """Parses one receipt per non-blank line. Lines that are not valid JSON
+    are kept as None placeholders so that indexes stay aligned."""
+    receipts, errors = [], {}
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            receipts.append(codec.loads(line))
+        except ValueError:
+            errors[len(receipts)] = {"error": "The receipt is not valid JSON"}
+            receipts.append(None)
+    return receipts, errors
+
+
 @app.route("/receipts/<string:ID>/points", methods=["GET"])
 def get_receipt_points(ID: str):
-    print("\nProcessing receipt query...")
-    if ID in receiptProcessor.receipts:
-        print("Valid receipt queried, returning points...")
-        return jsonify({"points": receiptProcessor.receipts[ID]}), 200
-    # Receipt not found
-    print("Invalid receipt queried")
-    return "No receipt found for that id", 404
+    if _sharded() and (owner := _remote_owner(ID)):
+        return _forward(owner)
+    log.debug("Processing receipt query", extra={"id": ID})
+    if (cached := pointsResponses.get(ID)) is None:
+        # Receipt not found
+        log.info("Unknown receipt queried", extra={"id": ID})
+        return "No receipt found for that id", 404
+    body, etag, hit = cached
+    log.info("Valid receipt queried", extra={"id": ID, **SAMPLED})
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": pointsResponses.cacheControl,
+    }
+    # If-None-Match uses the weak comparison (RFC 9110 13.1.2)
+    if request.if_none_match.contains_weak(etag):
+        POINTS_CACHE.inc("not_modified")
+        return Response(status=304, headers=headers)
+    POINTS_CACHE.inc("hit" if hit else "miss")
+    return Response(body, mimetype="application/json", headers=headers)
+
+
+# Ids looked up in the store at once by the bulk points lookup
+POINTS_BATCH_SIZE = 1000
+
+
+@app.route("/receipts/points:batch", methods=["POST"])
+def get_receipts_points():
+    """Looks up many ids at once. Takes a JSON array of ids, or a streamed
+    body with one id per line, and streams back one JSON line per id, in
+    order, with null points for unknown ids."""
+    if request.mimetype == "application/json":
+        IDs = request.get_json(silent=True)
+        if not isinstance(IDs, list) or not all(
+            isinstance(ID, str) for ID in IDs
+        ):
+            log.info("Invalid points lookup")
+            return "The id list is invalid", 400
+        batches = (
+            IDs[i:i + POINTS_BATCH_SIZE]
+            for i in range(0, len(IDs), POINTS_BATCH_SIZE)
+        )
+    else:
+        batches = _read_id_lines(request.stream)
+    get_many_points = receiptProcessor.get_many_points
+    if _sharded():
+        get_many_points = _get_many_points_sharded
+
+    def lookup():
+        dumps = codec.dumps
+        for batch in batches:
+            points = get_many_points(batch)
+            yield "".join(
+                dumps({"id": ID, "points": p}) + "\n"
+                for ID, p in zip(batch, points)
+            )
+
+    return Response(
+        stream_with_context(lookup()), mimetype="application/x-ndjson"
+    )
+
+
+def _get_many_points_sharded(IDs):
+    """get_many_points, with each id looked up on the node that owns it."""
+    found = {}
+    for owner, owned in cluster.owned_elsewhere(IDs).items():
+        status, _, body = cluster.forward(
+            owner,
+            "POST",
+            "/receipts/points:batch",
+            codec.dumps(owned).encode(),
+            {"Content-Type": "application/json"},
+        )
+        if status != 200:
+            raise NodeError(f"{owner} answered {status}")
+        for line in body.splitlines():
+            result = codec.loads(line)
+            found[result["id"]] = result["points"]
+    if not found:
+        return receiptProcessor.get_many_points(IDs)
+    local = [ID for ID in IDs if ID not in found]
+    found.update(zip(local, receiptProcessor.get_many_points(local)))
+    return [found[ID] for ID in IDs]
+
+
+def _read_id_lines(stream):
+    """Yields batches of the ids in a body with one id per line, as is or
+    as a JSON string, reading the body as it arrives."""
+    batch = []
+    for line in stream:
+        ID = line.strip().decode(errors="replace")
+        if not ID:
+            continue
+        if ID.startswith('"'):
+            try:
+                ID = codec.loads(ID)
+            except ValueError:
+                pass
+        batch.append(ID)
+        if len(batch) == POINTS_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sharded() -> bool:
+    """Whether requests are routed by id: in cluster mode, unless the
+    request was forwarded by another node."""
+    return cluster is not None and HOP_HEADER not in request.headers
+
+
+def _remote_owner(ID: str):
+    """The node that owns the id, or None if it is this one."""
+    owner = cluster.owner(ID)
+    return None if owner == cluster.selfURL else owner
+
+
+# Headers of a forwarded response that are passed on to the client
+FORWARDED_HEADERS = {"content-type", "etag", "cache-control"}
+
+
+def _forward(owner: str):
+    """Forwards the current request to the node that owns its id."""
+    headers = {"Content-Type": request.content_type or ""}
+    if ifNoneMatch := request.headers.get("If-None-Match"):
+        headers["If-None-Match"] = ifNoneMatch
+    status, responseHeaders, body = cluster.forward(
+        owner, request.method, request.path, request.get_data(), headers
+    )
+    return Response(
+        body,
+        status,
+        [
+            (name, value)
+            for name, value in responseHeaders
+            if name.lower() in FORWARDED_HEADERS
+        ],
+    )
+
+
+@app.errorhandler(NodeError)
+def node_unavailable(error):
+    log.error("Cluster node unavailable", extra={"error": str(error)})
+    return "The node that owns the receipt is unavailable", 503
+
+
+@app.route("/cluster/receipts", methods=["PUT"])
+def receive_receipts():
+    """Stores [id, points] pairs sent by another node while rebalancing.
+    Ids must be receipt ids, and points ones the store can hold."""
+    if cluster is None:
+        return "Not Found", 404
+    pairs = request.get_json(silent=True)
+    if not isinstance(pairs, list) or not all(
+        isinstance(pair, list)
+        and len(pair) == 2
+        and isinstance(pair[0], str)
+        and is_receipt_id(pair[0])
+        and type(pair[1]) is int
+        and receiptProcessor.check_points(pair[1]) is None
+        for pair in pairs
+    ):
+        return "The receipt list is invalid", 400
+    stored = receiptProcessor.store_scored(
+        [NewReceipt(ID, points) for ID, points in pairs]
+    )
+    return jsonify({"stored": stored}), 200
+
+
+@app.route("/cluster/nodes", methods=["GET", "PUT"])
+def cluster_nodes():
+    """Lists the cluster's nodes, whether receipts are being rebalanced and
+    how many the last rebalance moved. Or replaces the nodes with the
+    "nodes" of the request and answers 202 while the receipts this node no
+    longer owns are sent to their new owners in the background."""
+    if cluster is None:
+        return "Not Found", 404
+    if request.method == "PUT":
+        nodes = (request.get_json(silent=True) or {}).get("nodes")
+        if not isinstance(nodes, list) or not nodes or not all(
+            isinstance(node, str) for node in nodes
+        ):
+            return "The node list is invalid", 400
+        log.info("Cluster nodes changed", extra={"nodes": nodes})
+        cluster.set_nodes(nodes)
+        cluster.start_rebalance(receiptProcessor)
+        return jsonify({"nodes": cluster.nodes, "rebalancing": True}), 202
+    return (
+        jsonify(
+            {
+                "self": cluster.selfURL,
+                "nodes": cluster.nodes,
+                "rebalancing": cluster.rebalancing,
+                "moved": cluster.moved,
+            }
+        ),
+        200,
+    )
+
+
+@app.route("/analytics/daily", methods=["GET"])
+def daily_totals():
+    """Receipts and points per retailer and purchase date, by date."""
+    filters = _analytics_filters()
+    if filters is None:
+        return "The analytics filters are invalid", 400
+    rows = sorted(
+        receiptProcessor.aggregates(*filters),
+        key=lambda row: (row.purchaseDate, row.retailer),
+    )
+    return jsonify({
+        "days": [
+            {
+                "retailer": row.retailer,
+                "purchaseDate": row.purchaseDate,
+                "receipts": row.receipts,
+                "points": row.points,
+            }
+            for row in rows
+        ]
+    }), 200
+
+
+@app.route("/analytics/retailers", methods=["GET"])
+def top_retailer_totals():
+    """The retailers with the most points, most first, up to limit."""
+    filters = _analytics_filters()
+    limit = request.args.get("limit", "10")
+    if filters is None or not limit.isdigit() or not 0 < int(limit) <= 1000:
+        return "The analytics filters are invalid", 400
+    ranked = top_retailers(receiptProcessor.aggregates(*filters), int(limit))
+    return jsonify({
+        "retailers": [
+            {"retailer": retailer, "receipts": receipts, "points": points}
+            for retailer, receipts, points in ranked
+        ]
+    }), 200
+
+
+@app.route("/analytics/points", methods=["GET"])
+def points_distribution():
+    """How many receipts scored within each bucket of points."""
+    filters = _analytics_filters()
+    if filters is None:
+        return "The analytics filters are invalid", 400
+    histogram = points_histogram(receiptProcessor.aggregates(*filters))
+    maxima = [bound - 1 for bound in HISTOGRAM_BUCKETS[1:]] + [None]
+    return jsonify({
+        "receipts": sum(histogram),
+        "buckets": [
+            {"min": low, "max": high, "receipts": receipts}
+            for low, high, receipts in zip(
+                HISTOGRAM_BUCKETS, maxima, histogram
+            )
+        ],
+    }), 200
+
+
+def _analytics_filters():
+    """The retailer, start and end query parameters of the analytics
+    endpoints, each optional, or None if a date is not YYYY-MM-DD."""
+    start = request.args.get("start")
+    end = request.args.get("end")
+    for date in (start, end):
+        if date is not None and parse_date(date) is None:
+            return None
+    return request.args.get("retailer"), start, end
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Serves every metric in the Prometheus text format."""
+    return REGISTRY.render(), 200, {
+        "Content-Type": "text/plain; version=0.0.4"
+    }
 
 
 if __name__ == "__main__":
-    app.run(port=8000, debug=True, host="0.0.0.0")
+    # Flask's development server, for production use gunicorn.conf.py
+    app.run(
+        port=int(os.environ.get("PORT", "8000")),
+        debug=os.environ.get("FLASK_DEBUG") == "1",
+        host="0.0.0.0",
+    )
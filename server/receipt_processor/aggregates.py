@@ -0,0 +1,109 @@
+"""Running totals of the stored receipts by retailer and purchase date.
+
+Each new receipt adds to the counters of its (retailer, purchaseDate): the
+number of receipts, their points, and a histogram of their points over
+HISTOGRAM_BUCKETS, in constant time. Analytics read these counters rather
+than the receipts, so they cost as much as the retailers and days they
+cover, however many receipts there are. Receipts are only counted when
+their id is first stored, so duplicate uploads are never counted twice."""
+
+import threading
+from bisect import bisect_right
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+# Lower bounds of the points histogram's buckets, the last one open-ended
+HISTOGRAM_BUCKETS = (0, 10, 25, 50, 75, 100, 150, 200, 300, 500, 1000, 2000)
+
+
+def bucket_index(points: int) -> int:
+    """The index of the histogram bucket the points fall in."""
+    return max(bisect_right(HISTOGRAM_BUCKETS, points) - 1, 0)
+
+
+class AggregateRow(NamedTuple):
+    """The counters of one retailer on one purchase date."""
+
+    retailer: str
+    purchaseDate: str
+    receipts: int
+    points: int
+    # Receipts per bucket of HISTOGRAM_BUCKETS
+    histogram: Tuple[int, ...]
+
+
+class Aggregates:
+    """The counters of every (retailer, purchaseDate), in memory. Safe to
+    share between threads."""
+
+    def __init__(self) -> None:
+        # (retailer, purchaseDate) -> [receipts, points, *histogram]
+        self._counters: Dict[Tuple[str, str], List[int]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, retailer: str, purchaseDate: str, points: int) -> None:
+        """Counts a new receipt."""
+        with self._lock:
+            counters = self._counters.get((retailer, purchaseDate))
+            if counters is None:
+                counters = [0] * (2 + len(HISTOGRAM_BUCKETS))
+                self._counters[retailer, purchaseDate] = counters
+            counters[0] += 1
+            counters[1] += points
+            counters[2 + bucket_index(points)] += 1
+
+    def add_rows(self, rows: Iterable[AggregateRow]) -> None:
+        """Adds the counters of rows, e.g. from a snapshot."""
+        with self._lock:
+            for row in rows:
+                counters = self._counters.setdefault(
+                    (row.retailer, row.purchaseDate),
+                    [0] * (2 + len(HISTOGRAM_BUCKETS)),
+                )
+                counters[0] += row.receipts
+                counters[1] += row.points
+                for i, count in enumerate(row.histogram):
+                    counters[2 + i] += count
+
+    def rows(
+        self,
+        retailer: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> List[AggregateRow]:
+        """The counters of the retailer, or of every retailer, on each
+        purchase date from start to end, inclusive (YYYY-MM-DD)."""
+        with self._lock:
+            items = list(self._counters.items())
+        return [
+            AggregateRow(*key, counters[0], counters[1], tuple(counters[2:]))
+            for key, counters in items
+            if (retailer is None or key[0] == retailer)
+            and (start is None or key[1] >= start)
+            and (end is None or key[1] <= end)
+        ]
+
+
+def top_retailers(
+    rows: Iterable[AggregateRow], limit: int
+) -> List[Tuple[str, int, int]]:
+    """The (retailer, receipts, points) of the limit retailers with the
+    most points in rows, most first."""
+    totals: Dict[str, List[int]] = {}
+    for row in rows:
+        total = totals.setdefault(row.retailer, [0, 0])
+        total[0] += row.receipts
+        total[1] += row.points
+    ranked = sorted(totals.items(), key=lambda item: (-item[1][1], item[0]))
+    return [
+        (retailer, receipts, points)
+        for retailer, (receipts, points) in ranked[:limit]
+    ]
+
+
+def points_histogram(rows: Iterable[AggregateRow]) -> List[int]:
+    """Receipts per bucket of HISTOGRAM_BUCKETS, over all of rows."""
+    histogram = [0] * len(HISTOGRAM_BUCKETS)
+    for row in rows:
+        for i, count in enumerate(row.histogram):
+            histogram[i] += count
+    return histogram
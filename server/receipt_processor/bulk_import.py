@@ -0,0 +1,293 @@
+"""Streams a file of historical receipts into a receipt store.
+
+    python -m receipt_processor.bulk_import receipts.ndjson \\
+        --store sqlite:///receipts.db --rejects rejects.ndjson
+
+The file may be NDJSON (one receipt per line) or a single JSON array, of
+any size. Receipts are read in chunks, validated and scored by a pool of
+worker processes, and written by this process alone, so memory stays
+bounded by the number of chunks in flight. Invalid receipts are written to
+the reject file with their line (or array index) and the reasons. Points
+come from the rules file given by --rules or POINTS_RULES, if any, as the
+service scores them."""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import IO, Any, Iterator, List, Optional, Tuple
+
+from . import codec
+from .canonical import receipt_id
+from .pool import check_and_score
+from .processor import ReceiptProcessor
+from .rules import Rule, compile_rules, load_rules
+from .store import NewReceipt, open_store
+
+CHUNK_SIZE = 1000
+READ_SIZE = 1 << 16
+# Largest single element of a JSON array file, in characters
+MAX_ELEMENT_SIZE = 1 << 26
+
+# (line number or array index, raw NDJSON line or decoded receipt)
+Record = Tuple[int, Any]
+# (line number or array index, the receipt to store, reject reasons)
+Result = Tuple[int, Optional[NewReceipt], List[str]]
+
+def score_records(
+    records: List[Record], rules: Optional[List[Rule]] = None
+) -> List[Result]:
+    """Parses a chunk of records, then validates and scores them with
+    pool.check_and_score, as the service's scoring pool does. Runs in the
+    worker processes."""
+    decoded: List[Tuple[int, Any, Optional[List[str]]]] = []
+    for position, record in records:
+        if isinstance(record, str):
+            try:
+                record = codec.loads(record)
+            except ValueError as error:
+                decoded.append((position, None, [f"invalid JSON: {error}"]))
+                continue
+        decoded.append((position, record, None))
+    scored = iter(
+        check_and_score(
+            [record for _, record, reasons in decoded if reasons is None],
+            rules,
+        )
+    )
+    results = []
+    for position, record, reasons in decoded:
+        if reasons is not None:
+            results.append((position, None, reasons))
+            continue
+        points, violations = next(scored)
+        if violations:
+            results.append((position, None, [str(v) for v in violations]))
+            continue
+        receipt = NewReceipt(
+            receipt_id(record),
+            points,
+            record["retailer"],
+            record["purchaseDate"],
+        )
+        results.append((position, receipt, []))
+    return results
+
+
+def read_records(stream: IO[str]) -> Iterator[Record]:
+    """Yields the receipts of an NDJSON or JSON array stream. NDJSON lines
+    are yielded raw, numbered from 1, so that the workers parse them."""
+    number = 1
+    first = stream.read(1)
+    while first.isspace():
+        number += first == "\n"
+        first = stream.read(1)
+    if first == "[":
+        yield from _read_array(stream)
+        return
+
+    line = first + stream.readline()
+    while line:
+        if line.strip():
+            yield number, line
+        number += 1
+        line = stream.readline()
+
+
+def _read_array(stream: IO[str]) -> Iterator[Record]:
+    """Yields the elements of a JSON array whose opening bracket has already
+    been read, decoding one element at a time from a bounded buffer."""
+    decoder = json.JSONDecoder()
+    buffer, position, index, eof = "", 0, 0, False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = stream.read(READ_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+        return bool(chunk)
+
+    def skip_whitespace() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer) or not fill():
+                return buffer[position:position + 1]
+
+    if skip_whitespace() == "]":
+        return
+    while True:
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+            # A value that ends the buffer may continue in the next read
+            complete = end < len(buffer) or eof
+        except json.JSONDecodeError:
+            complete = False
+            if eof or len(buffer) - position > MAX_ELEMENT_SIZE:
+                raise ValueError(f"Malformed JSON array at element {index}")
+        if not complete:
+            fill()
+            continue
+        yield index, element
+        index += 1
+        position = end
+        separator = skip_whitespace()
+        position += 1
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Malformed JSON array after element {index}")
+        skip_whitespace()
+
+
+def _chunks(records: Iterator[Record], size: int) -> Iterator[List[Record]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_import(
+    stream: IO[str],
+    receiptProcessor: ReceiptProcessor,
+    rejects: Optional[IO[str]] = None,
+    workers: Optional[int] = None,
+    chunkSize: int = CHUNK_SIZE,
+    progress: Optional[IO[str]] = None,
+    rules: Optional[List[Rule]] = None,
+) -> Tuple[int, int, int]:
+    """Imports every receipt in the stream, scored by the given rules or
+    else the built-in ones. Returns the number of new, duplicate, and
+    rejected receipts."""
+    new = duplicate = rejected = 0
+    workers = workers or os.cpu_count() or 1
+    start = lastReport = time.monotonic()
+    # Started with forkserver, as pool.ScoringPool is, rather than forking
+    # a process that already holds an open store
+    with ProcessPoolExecutor(
+        workers, mp_context=get_context("forkserver")
+    ) as pool:
+        inFlight = deque()
+
+        def store_next() -> None:
+            nonlocal new, duplicate, rejected, lastReport
+            chunk, pending = inFlight.popleft()
+            results = pending.result()
+            for i, (position, receipt, _) in enumerate(results):
+                if receipt is None:
+                    continue
+                violation = receiptProcessor.check_points(receipt.points)
+                if violation is not None:
+                    results[i] = (position, None, [str(violation)])
+            scored = [receipt for _, receipt, _ in results if receipt]
+            added = receiptProcessor.store_scored(scored)
+            new += added
+            duplicate += len(scored) - added
+            for (position, record), (_, receipt, reasons) in zip(
+                chunk, results
+            ):
+                if receipt is None:
+                    rejected += 1
+                    if rejects is not None:
+                        if isinstance(record, str):
+                            record = record.rstrip("\n")
+                        reject = {
+                            "line": position,
+                            "errors": reasons,
+                            "receipt": record,
+                        }
+                        rejects.write(codec.dumps(reject) + "\n")
+            now = time.monotonic()
+            if progress is not None and now - lastReport >= 1:
+                lastReport = now
+                done = new + duplicate + rejected
+                progress.write(
+                    f"{done:,} receipts, {done / (now - start):,.0f}/s "
+                    f"({new:,} new, {duplicate:,} duplicate, "
+                    f"{rejected:,} rejected)\n"
+                )
+
+        for chunk in _chunks(read_records(stream), chunkSize):
+            # Bound memory by the number of chunks being worked on
+            if len(inFlight) >= workers * 2:
+                store_next()
+            inFlight.append(
+                (chunk, pool.submit(score_records, chunk, rules))
+            )
+        while inFlight:
+            store_next()
+    return new, duplicate, rejected
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Import historical receipts into a receipt store."
+    )
+    parser.add_argument("file", help="NDJSON or JSON array file, - for stdin")
+    parser.add_argument(
+        "--store",
+        default=os.environ.get("RECEIPT_STORE"),
+        help="store url, see store.open_store (default: $RECEIPT_STORE)",
+    )
+    parser.add_argument(
+        "--rules",
+        default=os.environ.get("POINTS_RULES"),
+        help="JSON file of point rules (default: $POINTS_RULES, else the "
+        "built-in rules)",
+    )
+    parser.add_argument("--rejects", help="write invalid receipts here")
+    parser.add_argument("--workers", type=int, help="default: cpu count")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args(argv)
+    if not args.store:
+        parser.error("--store or RECEIPT_STORE is required")
+    rules = None
+    if args.rules:
+        try:
+            rules = load_rules(args.rules)
+            # Fail here rather than in every worker
+            compile_rules(rules)
+        except (OSError, ValueError) as error:
+            parser.error(f"cannot load rules from {args.rules}: {error}")
+
+    receiptProcessor = ReceiptProcessor(open_store(args.store))
+    stream = sys.stdin if args.file == "-" else open(args.file)
+    rejects = open(args.rejects, "w") if args.rejects else None
+    start = time.monotonic()
+    try:
+        new, duplicate, rejected = run_import(
+            stream,
+            receiptProcessor,
+            rejects=rejects,
+            workers=args.workers,
+            chunkSize=args.chunk_size,
+            progress=sys.stderr,
+            rules=rules,
+        )
+    finally:
+        receiptProcessor.close()
+        stream.close()
+        if rejects is not None:
+            rejects.close()
+    elapsed = time.monotonic() - start
+    total = new + duplicate + rejected
+    sys.stderr.write(
+        f"Imported {total:,} receipts in {elapsed:.1f}s "
+        f"({total / max(elapsed, 1e-9):,.0f}/s): {new:,} new, "
+        f"{duplicate:,} duplicate, {rejected:,} rejected\n"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import re
+import uuid
+from json.encoder import encode_basestring_ascii
+from typing import Any, Dict, Iterator
+
+RECEIPT_FIELDS = {"items", "purchaseDate", "purchaseTime", "retailer", "total"}
+ITEM_FIELDS = {"price", "shortDescription"}
+
+# The form of every id receipt_id returns
+_RECEIPT_ID = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-5[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}"
+)
+
+# Items are encoded and hashed this many at a time, so that large receipts
+# never need their whole encoding in memory and small ones need one update
+ITEMS_PER_CHUNK = 256
+
+
+def receipt_id(receipt: Dict[str, Any]) -> str:
+    """Returns the id of a receipt: a uuid5, in the DNS namespace, of the
+    receipt's canonical JSON encoding (json.dumps with sorted keys).
+
+    Receipts shaped like the API contract are encoded field by field in
+    sorted order straight into the hash. Anything else falls back to
+    json.dumps, so ids are identical either way."""
+    sha = new_id_hash()
+    if _contract_shaped(receipt):
+        for chunk in _canonical_chunks(receipt):
+            sha.update(chunk.encode("ascii"))
+    else:
+        sha.update(json.dumps(receipt, sort_keys=True).encode("utf-8"))
+    return id_from_hash(sha)
+
+
+def new_id_hash() -> Any:
+    """The hash receipt_id feeds a receipt's canonical encoding to."""
+    return hashlib.sha1(uuid.NAMESPACE_DNS.bytes)
+
+
+def id_from_hash(sha: Any) -> str:
+    """The id of the receipt whose canonical encoding was fed to sha."""
+    # Same construction as uuid.uuid5
+    return str(uuid.UUID(bytes=sha.digest()[:16], version=5))
+
+
+def canonical_item(item: Any) -> str:
+    """json.dumps(item, sort_keys=True), the encoding of one item within
+    its receipt's canonical encoding."""
+    if (
+        type(item) is dict
+        and item.keys() == ITEM_FIELDS
+        and type(price := item["price"]) is str
+        and type(desc := item["shortDescription"]) is str
+    ):
+        return (
+            '{"price": '
+            + encode_basestring_ascii(price)
+            + ', "shortDescription": '
+            + encode_basestring_ascii(desc)
+            + "}"
+        )
+    return json.dumps(item, sort_keys=True)
+
+
+def is_receipt_id(ID: str) -> bool:
+    """Whether ID could have been returned by receipt_id: a lower-case
+    uuid5 string."""
+    return _RECEIPT_ID.fullmatch(ID) is not None
+
+
+def _contract_shaped(receipt: Any) -> bool:
+    """True if the receipt has exactly the contract's fields, all strings,
+    and its items exactly the contract's item fields, all strings."""
+    if type(receipt) is not dict or receipt.keys() != RECEIPT_FIELDS:
+        return False
+    items = receipt["items"]
+    if type(items) is not list:
+        return False
+    for field in RECEIPT_FIELDS - {"items"}:
+        if type(receipt[field]) is not str:
+            return False
+    for item in items:
+        if (
+            type(item) is not dict
+            or item.keys() != ITEM_FIELDS
+            or type(item["price"]) is not str
+            or type(item["shortDescription"]) is not str
+        ):
+            return False
+    return True
+
+
+def _canonical_chunks(receipt: Dict[str, Any]) -> Iterator[str]:
+    """Yields json.dumps(receipt, sort_keys=True) in pieces, for a receipt
+    that is contract shaped. Keys are written in their sorted order."""
+    encode = encode_basestring_ascii
+    items = receipt["items"]
+    yield '{"items": ['
+    for start in range(0, len(items), ITEMS_PER_CHUNK):
+        chunk = ", ".join(
+            [
+                '{"price": '
+                + encode(item["price"])
+                + ', "shortDescription": '
+                + encode(item["shortDescription"])
+                + "}"
+                for item in items[start:start + ITEMS_PER_CHUNK]
+            ]
+        )
+        yield (", " + chunk) if start else chunk
+    yield (
+        '], "purchaseDate": '
+        + encode(receipt["purchaseDate"])
+        + ', "purchaseTime": '
+        + encode(receipt["purchaseTime"])
+        + ', "retailer": '
+        + encode(receipt["retailer"])
+        + ', "total": '
+        + encode(receipt["total"])
+        + "}"
+    )
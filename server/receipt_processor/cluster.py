@@ -0,0 +1,239 @@
+"""Cluster mode: receipts sharded across service nodes by id.
+
+Ids are content hashes, so the node that owns an id is known from the id
+alone, both when the receipt is uploaded and whenever it is looked up.
+Nodes are placed on a consistent-hash ring at VNODES points each and own
+the ids that hash between their points and the previous ones. Any node
+accepts any request and forwards it to the owner when the id is not its
+own; forwarded requests carry HOP_HEADER and are always answered locally,
+so a request crosses at most one hop even while nodes disagree on the
+ring. Nodes prove to each other that they belong to the cluster with a
+shared secret, sent in SECRET_HEADER: hops and the /cluster routes are
+only honored with it.
+
+Adding or removing a node only changes the owner of the ids between its
+points and their predecessors, about 1/N of them. After the node list
+changes, each node sends the receipts it holds but no longer owns to their
+new owners (rebalance), in the background. A bounded store drops them once
+their owner has stored them. Other stores only ever add ids, so they keep
+their copies, which are never looked up again."""
+
+import hashlib
+import hmac
+import http.client
+import logging
+import threading
+from bisect import bisect
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from . import codec
+
+log = logging.getLogger(__name__)
+
+# Points per node on the ring, enough to keep the largest share within
+# about 10% of the average
+VNODES = 128
+HOP_HEADER = "X-Receipt-Cluster-Hop"
+SECRET_HEADER = "X-Receipt-Cluster-Secret"
+# Receipts sent to their new owner per request while rebalancing
+REBALANCE_BATCH_SIZE = 1000
+# Seconds to wait for another node before answering 503
+FORWARD_TIMEOUT = 10.0
+
+
+def ring_position(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), "big"
+    )
+
+
+class HashRing:
+    """Maps ids to the nodes (base urls) that own them."""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = VNODES) -> None:
+        self.nodes = sorted(set(nodes))
+        if not self.nodes:
+            raise ValueError("A cluster needs at least one node")
+        points = sorted(
+            (ring_position(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(vnodes)
+        )
+        self._positions = [position for position, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, ID: str) -> str:
+        index = bisect(self._positions, ring_position(ID))
+        return self._owners[index % len(self._owners)]
+
+
+class NodeError(Exception):
+    """Raised when another node cannot be reached."""
+
+
+class Cluster:
+    """This node's view of the cluster: the ring, the secret its nodes
+    share, and keep-alive connections to the other nodes, one per node and
+    thread."""
+
+    def __init__(
+        self, selfURL: str, nodes: Iterable[str], secret: str
+    ) -> None:
+        if not secret:
+            raise ValueError("A cluster needs a shared secret")
+        self.selfURL = selfURL.rstrip("/")
+        self.ring = HashRing(node.rstrip("/") for node in nodes)
+        if self.selfURL not in self.ring.nodes:
+            raise ValueError(f"{self.selfURL} is not a cluster node")
+        self.secret = secret
+        # Receipts sent by the last rebalance to finish
+        self.moved = 0
+        self._local = threading.local()
+        self._rebalancing = threading.Lock()
+        self._rebalancer: Optional[threading.Thread] = None
+
+    @property
+    def nodes(self) -> List[str]:
+        return self.ring.nodes
+
+    def owner(self, ID: str) -> str:
+        return self.ring.owner(ID)
+
+    def is_local(self, ID: str) -> bool:
+        return self.ring.owner(ID) == self.selfURL
+
+    def is_peer(self, secret: Optional[str]) -> bool:
+        """Whether a request's SECRET_HEADER shows it comes from a node of
+        the cluster."""
+        return secret is not None and hmac.compare_digest(
+            secret.encode(), self.secret.encode()
+        )
+
+    def set_nodes(self, nodes: Iterable[str]) -> None:
+        """Replaces the ring. The ring is swapped as a whole, so requests
+        routed meanwhile use either the old or the new one. A ring without
+        this node is allowed, for a node that is leaving: it owns nothing,
+        so rebalancing hands all of its receipts over."""
+        self.ring = HashRing(node.rstrip("/") for node in nodes)
+
+    def forward(
+        self,
+        node: str,
+        method: str,
+        path: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """Sends a request to another node, as a hop, and returns its
+        status, headers and body. Raises NodeError if the node cannot be
+        reached."""
+        headers = {
+            **(headers or {}),
+            HOP_HEADER: self.selfURL,
+            SECRET_HEADER: self.secret,
+        }
+        # A connection the other node closed is retried once on a new one
+        for attempt in range(2):
+            connection = self._connection(node, fresh=attempt > 0)
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                return (
+                    response.status,
+                    response.getheaders(),
+                    response.read(),
+                )
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                failure = error
+        raise NodeError(f"{node} is unavailable: {failure}")
+
+    def owned_elsewhere(self, IDs: Iterable[str]) -> Dict[str, List[str]]:
+        """Groups the ids this node does not own by owner."""
+        groups = defaultdict(list)
+        for ID in IDs:
+            owner = self.ring.owner(ID)
+            if owner != self.selfURL:
+                groups[owner].append(ID)
+        return groups
+
+    def rebalance(self, receiptProcessor) -> int:
+        """Sends the receipts this node holds but does not own to their
+        owners. Returns how many were sent. Concurrent calls wait for the
+        one in progress."""
+        with self._rebalancing:
+            moved = 0
+            batch: List[str] = []
+            for ID in receiptProcessor.receipts.ids():
+                if not self.is_local(ID):
+                    batch.append(ID)
+                if len(batch) == REBALANCE_BATCH_SIZE:
+                    moved += self._send(receiptProcessor, batch)
+                    batch = []
+            moved += self._send(receiptProcessor, batch)
+            self.moved = moved
+        log.info(
+            "Receipts rebalanced",
+            extra={"moved": moved, "nodes": len(self.nodes)},
+        )
+        return moved
+
+    def start_rebalance(self, receiptProcessor) -> threading.Thread:
+        """Rebalances in a background thread, after any rebalance already
+        in progress. Failures are logged."""
+
+        def rebalance() -> None:
+            try:
+                self.rebalance(receiptProcessor)
+            except NodeError as error:
+                log.error(
+                    "Receipts not rebalanced", extra={"error": str(error)}
+                )
+
+        thread = threading.Thread(
+            target=rebalance, name="rebalance", daemon=True
+        )
+        self._rebalancer = thread
+        thread.start()
+        return thread
+
+    @property
+    def rebalancing(self) -> bool:
+        """Whether the last rebalance started is still running."""
+        return self._rebalancer is not None and self._rebalancer.is_alive()
+
+    def _send(self, receiptProcessor, IDs: List[str]) -> int:
+        """Sends the receipts to their owners, and returns how many were
+        sent. Ids the store dropped since they were listed are skipped."""
+        store = receiptProcessor.receipts
+        found = dict(zip(IDs, store.get_many(IDs)))
+        sent = 0
+        for owner, owned in self.owned_elsewhere(IDs).items():
+            pairs = [[ID, found[ID]] for ID in owned if found[ID] is not None]
+            if not pairs:
+                continue
+            status, _, body = self.forward(
+                owner,
+                "PUT",
+                "/cluster/receipts",
+                codec.dumps(pairs).encode(),
+                {"Content-Type": "application/json"},
+            )
+            if status != 200:
+                raise NodeError(f"{owner} refused receipts: {body!r}")
+            store.forget(ID for ID, _ in pairs)
+            sent += len(pairs)
+        return sent
+
+    def _connection(
+        self, node: str, fresh: bool = False
+    ) -> http.client.HTTPConnection:
+        connections = self._local.__dict__.setdefault("connections", {})
+        if fresh or node not in connections:
+            url = urlsplit(node)
+            connections[node] = http.client.HTTPConnection(
+                url.hostname, url.port or 80, timeout=FORWARD_TIMEOUT
+            )
+        return connections[node]
@@ -0,0 +1,84 @@
+"""JSON decoding and encoding for everything the service reads or writes.
+
+Uses orjson when it is installed and the standard library otherwise, set
+JSON_BACKEND=json to force the latter. Output is byte-identical either
+way: compact, with sorted keys and non-ASCII characters escaped, as
+Flask's jsonify writes it. orjson writes UTF-8 and leaves DEL as is, so
+the rare document with such text, or with values orjson does not handle
+(integers over 64 bits, non-string keys), is encoded by the standard
+library instead. Likewise, documents orjson refuses (NaN, lone
+surrogates) are decoded by the standard library, so both backends accept
+the same documents.
+
+Two differences remain, neither of which reaches a response: orjson
+writes floats in its own shortest form (1e-7 where json writes 1e-07),
+and the service emits none, and it reads integers over 64 bits as
+floats, which the contract only allows where strings are required.
+Scanning every body for such integers would cost more than orjson
+saves.
+
+Receipt ids do not go through here: they hash json.dumps' default,
+spaced encoding, see canonical.py."""
+
+import json
+import os
+from typing import Any, Callable, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+Default = Optional[Callable[[Any], Any]]
+
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    return json.loads(data)
+
+
+def _json_dumps(obj: Any, default: Default = None) -> str:
+    return json.dumps(
+        obj, sort_keys=True, separators=(",", ":"), default=default
+    )
+
+
+def _orjson_loads(data: Union[str, bytes]) -> Any:
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+
+
+def _orjson_dumps(obj: Any, default: Default = None) -> str:
+    try:
+        data = orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS)
+    except TypeError:
+        return _json_dumps(obj, default)
+    # json escapes non-ASCII characters and DEL, orjson writes them as is
+    if not data.isascii() or b"\x7f" in data:
+        return _json_dumps(obj, default)
+    return data.decode("ascii")
+
+
+BACKENDS = {"json": (_json_loads, _json_dumps)}
+if orjson is not None:
+    BACKENDS["orjson"] = (_orjson_loads, _orjson_dumps)
+
+BACKEND = ""
+loads: Callable[[Union[str, bytes]], Any]
+dumps: Callable[..., str]
+
+
+def use_backend(name: Optional[str] = None) -> None:
+    """Switches the module's loads and dumps to the named backend, by
+    default the fastest one installed."""
+    global BACKEND, loads, dumps
+    if name is None:
+        name = "orjson" if "orjson" in BACKENDS else "json"
+    if name not in BACKENDS:
+        raise ValueError(f"Unavailable JSON backend: {name!r}")
+    BACKEND = name
+    loads, dumps = BACKENDS[name]
+
+
+use_backend(os.environ.get("JSON_BACKEND") or None)
@@ -5,3 +5,6 @@ PAIR_OF_ITEMS_POINTS = 5
 DESC_MULTIPLIER = 0.2
 ODD_PURCHASE_DATE_POINTS = 6
 PURCHASE_TIME_POINTS = 10
+# Purchases made strictly between these times (HH:MM) earn PURCHASE_TIME_POINTS
+PURCHASE_TIME_START = "14:00"
+PURCHASE_TIME_END = "16:00"
@@ -0,0 +1,92 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, TextIO
+
+# Pass as extra= on high-volume success messages so that they are sampled
+SAMPLED = {"sampled": True}
+
+# Attributes every LogRecord has, anything else was passed through extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message"}
+
+_listener: Optional[QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON, including any fields
+    passed through extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != "sampled":
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction (rate) of the records logged with SAMPLED.
+    Every other record passes."""
+
+    def __init__(self, rate: float) -> None:
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    sampleRate: Optional[float] = None,
+    stream: Optional[TextIO] = None,
+) -> None:
+    """Sends the service's logs, as JSON lines, to stream (stdout by
+    default) through a background thread, so that request threads only ever
+    put records on a queue. Defaults come from LOG_LEVEL (INFO) and
+    LOG_SAMPLE_RATE (1.0). Calling it again replaces the previous
+    configuration."""
+    global _listener
+    level = level or os.environ.get("LOG_LEVEL", "INFO")
+    if sampleRate is None:
+        sampleRate = float(os.environ.get("LOG_SAMPLE_RATE", "1.0"))
+
+    shutdown_logging()
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, writer)
+    _listener.start()
+
+    handler = QueueHandler(records)
+    # Sample before the record is queued, dropped records cost nothing more
+    handler.addFilter(SamplingFilter(sampleRate))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+
+@atexit.register
+def shutdown_logging() -> None:
+    """Writes out any queued records and stops the background writer."""
+    global _listener
+    root = logging.getLogger()
+    for handler in [h for h in root.handlers if isinstance(h, QueueHandler)]:
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,345 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from 10us to 5s
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0,
+)
+
+
+class Metric(ABC):
+    """Base class for metrics with optional labels, rendered in the
+    Prometheus text exposition format."""
+
+    kind = ""
+    # Whether Registry.share adds up the metric across processes
+    shared = False
+
+    def __init__(
+        self, name: str, description: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ] + self._samples()
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Returns the metric's sample lines."""
+
+    def _labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [
+            f'{name}="{value}"' for name, value in zip(self.labelnames, values)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class SharedMetric(Metric):
+    """Base class for metrics that Registry.share adds up across
+    processes."""
+
+    shared = True
+
+    @abstractmethod
+    def snapshot(self) -> List[Any]:
+        """The metric's values as JSON, to add up with other processes'
+        in Registry.render."""
+
+    @abstractmethod
+    def merged(self, snapshots: List[List[Any]]) -> "Metric":
+        """A copy of the metric holding the sum of the snapshots."""
+
+
+class Counter(SharedMetric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def snapshot(self) -> List[Any]:
+        with self._lock:
+            return [
+                [list(labels), value] for labels, value in self._values.items()
+            ]
+
+    def merged(self, snapshots: List[List[Any]]) -> "Counter":
+        total = Counter(self.name, self.description, self.labelnames)
+        for snapshot in snapshots:
+            for labels, value in snapshot:
+                total.inc(*labels, amount=value)
+        return total
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{self._labels(labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Metric):
+    """A value read from a callback when the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, description: str, read: Callable[[], float]
+    ) -> None:
+        super().__init__(name, description)
+        self.read = read
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {self.read()}"]
+
+
+class Histogram(SharedMetric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: a count per bucket (plus +Inf), and the sum
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            if labels not in self._counts:
+                self._counts[labels] = [0] * (len(self.buckets) + 1)
+                self._sums[labels] = 0.0
+            self._counts[labels][index] += 1
+            self._sums[labels] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(self._counts.get(labels, ()))
+
+    def snapshot(self) -> List[Any]:
+        with self._lock:
+            return [
+                [list(labels), list(counts), self._sums[labels]]
+                for labels, counts in self._counts.items()
+            ]
+
+    def merged(self, snapshots: List[List[Any]]) -> "Histogram":
+        total = Histogram(
+            self.name, self.description, self.labelnames, self.buckets
+        )
+        for snapshot in snapshots:
+            for labels, counts, value in snapshot:
+                labels = tuple(labels)
+                if labels not in total._counts:
+                    total._counts[labels] = [0] * len(counts)
+                    total._sums[labels] = 0.0
+                for i, count in enumerate(counts):
+                    total._counts[labels][i] += count
+                total._sums[labels] += value
+        return total
+
+    def _samples(self) -> List[str]:
+        samples = []
+        with self._lock:
+            series = sorted(
+                (labels, list(counts), self._sums[labels])
+                for labels, counts in self._counts.items()
+            )
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket = self._labels(labels, f'le="{bound}"')
+                samples.append(f"{self.name}_bucket{bucket} {cumulative}")
+            samples.append(f"{self.name}_sum{self._labels(labels)} {total}")
+            samples.append(
+                f"{self.name}_count{self._labels(labels)} {cumulative}"
+            )
+        return samples
+
+
+class Registry:
+    """Holds every metric of the service for rendering on /metrics.
+
+    Each server process has its own registry. Once share is called, the
+    process writes its counters and histograms to a file of its own in a
+    directory shared by every process, every interval seconds and on every
+    render, and render adds up the files of every process, live or exited,
+    so that totals never go backwards whichever process is scraped. Gauges
+    are read by the rendering process alone."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self.directory: Optional[str] = None
+        self._path = ""
+        self._writeLock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Adds the metric, replacing any earlier metric with its name."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def share(
+        self,
+        directory: str,
+        name: Optional[str] = None,
+        interval: float = 1.0,
+    ) -> None:
+        """Adds this process's metrics, in a file named after it (its pid
+        by default), to the totals rendered from directory."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._path = os.path.join(
+            directory, f"{name or os.getpid()}.json"
+        )
+        self.write_snapshot()
+        threading.Thread(
+            target=self._write_periodically, args=(interval,), daemon=True
+        ).start()
+
+    def write_snapshot(self) -> None:
+        """Writes this process's metrics to its file in the directory."""
+        if self.directory is None:
+            return
+        snapshot = {
+            name: metric.snapshot()
+            for name, metric in self._metrics.items()
+            if metric.shared
+        }
+        with self._writeLock:
+            with open(self._path + ".tmp", "w") as file:
+                json.dump(snapshot, file)
+            os.replace(self._path + ".tmp", self._path)
+
+    def render(self) -> str:
+        metrics = list(self._metrics.values())
+        if self.directory is not None:
+            self.write_snapshot()
+            snapshots = self._read_snapshots()
+            metrics = [
+                metric
+                if not metric.shared
+                else metric.merged(
+                    [
+                        snapshot[metric.name]
+                        for snapshot in snapshots
+                        if metric.name in snapshot
+                    ]
+                )
+                for metric in metrics
+            ]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _read_snapshots(self) -> List[Dict[str, List[Any]]]:
+        snapshots = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json"):
+                with open(entry.path) as file:
+                    snapshots.append(json.load(file))
+        return snapshots
+
+    def _write_periodically(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            self.write_snapshot()
+
+
+class Timing:
+    """Optional per-stage and per-rule timers. Instrumented code checks
+    enabled once per stage, so timers cost a single attribute lookup and
+    branch while they are disabled."""
+
+    def __init__(self, histogram: Histogram) -> None:
+        self.enabled = False
+        self.histogram = histogram
+
+    def record(self, stage: str, start: float) -> float:
+        """Observes the time since start for the stage and returns the
+        current time, to be used as the start of the next stage."""
+        now = time.perf_counter()
+        self.histogram.observe(now - start, stage)
+        return now
+
+
+REGISTRY = Registry()
+
+RECEIPTS = REGISTRY.register(
+    Counter(
+        "receipts_processed_total",
+        "Receipts processed, by result (new, duplicate or invalid).",
+        ["result"],
+    )
+)
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "receipt_stage_seconds",
+        "Time spent in each processing stage and point rule.",
+        ["stage"],
+    )
+)
+TIMING = Timing(STAGE_SECONDS)
+REQUESTS = REGISTRY.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests, by route and status code.",
+        ["route", "status"],
+    )
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "http_request_seconds", "HTTP request latency, by route.", ["route"]
+    )
+)
+POINTS_CACHE = REGISTRY.register(
+    Counter(
+        "points_cache_requests_total",
+        "Points lookups, by cache result (hit, miss or not_modified).",
+        ["result"],
+    )
+)
+STORE_EVICTIONS = REGISTRY.register(
+    Counter(
+        "receipt_store_evictions_total",
+        "Receipts dropped from a bounded store, by reason (expired, entries "
+        "or bytes).",
+        ["reason"],
+    )
+)
+ID_LOOKUPS = REGISTRY.register(
+    Counter(
+        "receipt_id_lookups_total",
+        "Points lookups answered without the store, because the id is "
+        "malformed or filtered out, and filter false positives.",
+        ["result"],
+    )
+)
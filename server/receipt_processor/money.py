@@ -0,0 +1,22 @@
+from fractions import Fraction
+from typing import Tuple
+
+
+def parse_cents(amount: str) -> int:
+    """Converts a valid amount string (e.g. "12.25") into integer cents.
+    Assumes the amount matches the API contract's total/price pattern."""
+    # The contract requires exactly two decimal places
+    return int(amount.replace(".", "", 1))
+
+
+def exact_ratio(multiplier: float) -> Tuple[int, int]:
+    """Returns the (numerator, denominator) of a configured multiplier as
+    written, e.g. 0.2 -> (1, 5), rather than of its binary float value."""
+    ratio = Fraction(repr(multiplier))
+    return ratio.numerator, ratio.denominator
+
+
+def ceil_cents_multiple(cents: int, numerator: int, denominator: int) -> int:
+    """Returns ceil(cents / 100 * numerator / denominator) using integer
+    arithmetic only."""
+    return -(-cents * numerator // (denominator * 100))
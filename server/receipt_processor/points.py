@@ -1,5 +1,4 @@
-import math
-from datetime import datetime
+import time
 from typing import Any, Dict, List
 
 from .configuration import (
@@ -8,9 +7,36 @@ from .configuration import (
     MULTIPLE_TOTAL_POINTS,
     ODD_PURCHASE_DATE_POINTS,
     PAIR_OF_ITEMS_POINTS,
+    PURCHASE_TIME_END,
     PURCHASE_TIME_POINTS,
+    PURCHASE_TIME_START,
     ROUND_TOTAL_POINTS,
 )
+from .metrics import TIMING
+from .money import ceil_cents_multiple, exact_ratio, parse_cents
+from .validator import ParsedReceipt, parse_time
+
+
+def minute_of_day(purchaseTime: str) -> int:
+    """Converts a valid HH:MM time into minutes since midnight."""
+    return int(purchaseTime[:2]) * 60 + int(purchaseTime[3:5])
+
+
+def day_of_month(purchaseDate: str) -> int:
+    """Extracts the day from a valid YYYY-MM-DD date."""
+    return int(purchaseDate[8:10])
+
+
+def _configured_minute(purchaseTime: str) -> int:
+    if parse_time(purchaseTime) is None:
+        raise ValueError(f"Invalid purchase time bound: {purchaseTime!r}")
+    return minute_of_day(purchaseTime)
+
+
+# Window bounds are converted once, at import, rather than per receipt
+PURCHASE_TIME_START_MINUTE = _configured_minute(PURCHASE_TIME_START)
+PURCHASE_TIME_END_MINUTE = _configured_minute(PURCHASE_TIME_END)
+DESC_NUMERATOR, DESC_DENOMINATOR = exact_ratio(DESC_MULTIPLIER)
 
 
 def calculate_receipt_points(receipt: Dict[str, Any]) -> int:
@@ -40,17 +66,76 @@ def calculate_receipt_points(receipt: Dict[str, Any]) -> int:
     return points
 
 
+def calculate_parsed_points(receipt: ParsedReceipt) -> int:
+    """Scores a receipt that has already been validated and parsed by
+    ReceiptValidator.check. Gives the same result as
+    calculate_receipt_points on the original receipt."""
+    if TIMING.enabled:
+        return _calculate_parsed_points_timed(receipt)
+    points = (
+        calculate_retailer_points(receipt.retailer)
+        + total_cents_points(receipt.total)
+        + (len(receipt.items) // 2) * PAIR_OF_ITEMS_POINTS
+        + purchase_day_points(receipt.day)
+        + purchase_minute_points(receipt.minute)
+    )
+    for desc, price in receipt.items:
+        points += item_desc_cents_points(desc, price)
+    return points
+
+
+def _calculate_parsed_points_timed(receipt: ParsedReceipt) -> int:
+    """calculate_parsed_points, timing each rule separately."""
+    start = time.perf_counter()
+    points = calculate_retailer_points(receipt.retailer)
+    start = TIMING.record("rule_retailer", start)
+    points += total_cents_points(receipt.total)
+    start = TIMING.record("rule_total", start)
+    points += (len(receipt.items) // 2) * PAIR_OF_ITEMS_POINTS
+    start = TIMING.record("rule_item_pairs", start)
+    for desc, price in receipt.items:
+        points += item_desc_cents_points(desc, price)
+    start = TIMING.record("rule_item_desc", start)
+    points += purchase_day_points(receipt.day)
+    start = TIMING.record("rule_purchase_date", start)
+    points += purchase_minute_points(receipt.minute)
+    TIMING.record("rule_purchase_time", start)
+    return points
+
+
+def calculate_batch_points(receipts: List[ParsedReceipt]) -> List[int]:
+    """Takes in a list of parsed receipts and returns the points for each,
+    in the same order. Equivalent to calling calculate_parsed_points on
+    every receipt, but scores each distinct retailer once per batch: its
+    per-character count is the costliest rule, and batches repeat
+    retailers far more than anything else. The other rules cost less than
+    a lookup of their earlier result (see benchmarks/bench_batch.py)."""
+    retailerPoints: Dict[str, int] = {}
+    batchPoints = []
+    for receipt in receipts:
+        retailer = receipt.retailer
+        if (points := retailerPoints.get(retailer)) is None:
+            points = retailerPoints[retailer] = calculate_retailer_points(
+                retailer
+            )
+        points += (
+            total_cents_points(receipt.total)
+            + (len(receipt.items) // 2) * PAIR_OF_ITEMS_POINTS
+            + purchase_day_points(receipt.day)
+            + purchase_minute_points(receipt.minute)
+        )
+        for desc, price in receipt.items:
+            points += item_desc_cents_points(desc, price)
+        batchPoints.append(points)
+    return batchPoints
+
+
 def calculate_retailer_points(retailer: str) -> int:
     return sum(ALPHANUMERIC_POINTS for char in retailer if char.isalnum())
 
 
 def calculate_total_points(total: str) -> int:
-    points = 0
-    if int(total.split(".")[1]) == 0:
-        points += ROUND_TOTAL_POINTS
-    if float(total) % 0.25 == 0:
-        points += MULTIPLE_TOTAL_POINTS
-    return points
+    return total_cents_points(parse_cents(total))
 
 
 def calculate_item_pairs_points(items: List[Dict[str, str]]) -> int:
@@ -58,23 +143,46 @@ def calculate_item_pairs_points(items: List[Dict[str, str]]) -> int:
 
 
 def calculate_item_desc_points(item: Dict[str, str]) -> int:
-    if len(item["shortDescription"].strip()) % 3 == 0:
-        return math.ceil(float(item["price"]) * DESC_MULTIPLIER)
-    return 0
+    return item_desc_cents_points(
+        item["shortDescription"], parse_cents(item["price"])
+    )
 
 
 def calculate_purchase_date_points(purchaseDate: str) -> int:
-    return (
-        ODD_PURCHASE_DATE_POINTS if int(purchaseDate.split("-")[-1]) % 2 else 0
-    )
+    return purchase_day_points(day_of_month(purchaseDate))
 
 
 def calculate_purchase_time_points(purchaseTime: str) -> int:
-    minTime = datetime.strptime("14:00", "%H:%M").time()
-    maxTime = datetime.strptime("16:00", "%H:%M").time()
-    formattedPurchaseTime = datetime.strptime(purchaseTime, "%H:%M").time()
+    return purchase_minute_points(minute_of_day(purchaseTime))
+
+
+def purchase_day_points(day: int) -> int:
+    """Points for a purchase made on the given day of the month."""
+    return ODD_PURCHASE_DATE_POINTS if day % 2 else 0
+
+
+def purchase_minute_points(minute: int) -> int:
+    """Points for a purchase made at the given minute of the day."""
     return (
         PURCHASE_TIME_POINTS
-        if minTime < formattedPurchaseTime < maxTime
+        if PURCHASE_TIME_START_MINUTE < minute < PURCHASE_TIME_END_MINUTE
         else 0
     )
+
+
+def total_cents_points(total: int) -> int:
+    """Points for a total given in integer cents."""
+    points = 0
+    if total % 100 == 0:
+        points += ROUND_TOTAL_POINTS
+    if total % 25 == 0:
+        points += MULTIPLE_TOTAL_POINTS
+    return points
+
+
+def item_desc_cents_points(desc: str, price: int) -> int:
+    """Points for an item whose price is given in integer cents. Rounds up
+    exactly, without the representation error of float(price) * 0.2."""
+    if len(desc.strip()) % 3 == 0:
+        return ceil_cents_multiple(price, DESC_NUMERATOR, DESC_DENOMINATOR)
+    return 0
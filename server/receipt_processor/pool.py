@@ -0,0 +1,84 @@
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional, Tuple
+
+from .points import calculate_parsed_points
+from .rules import Rule, Scorer, compile_rules
+from .validator import ReceiptValidator, Violation
+
+# Most receipts sent to a worker in one task. Larger chunks amortize the
+# pickling and the round trip, smaller ones spread a batch across workers.
+CHUNK_SIZE = 256
+
+# (points, or None if the receipt is invalid, violations)
+Scored = Tuple[Optional[int], List[Violation]]
+
+_validator: Optional[ReceiptValidator] = None
+# Compiled rule sets, by their JSON encoding
+_scorers: Dict[str, Scorer] = {}
+
+
+def check_and_score(
+    receipts: List[Any], rules: Optional[List[Rule]] = None
+) -> List[Scored]:
+    """Validates and scores a chunk of receipts, with the given rules or
+    else calculate_parsed_points. Runs in the workers."""
+    global _validator
+    if _validator is None:
+        _validator = ReceiptValidator()
+    score = calculate_parsed_points
+    if rules is not None:
+        key = json.dumps(rules, sort_keys=True)
+        if key not in _scorers:
+            _scorers.clear()
+            _scorers[key] = compile_rules(rules)
+        score = _scorers[key]
+    results = []
+    for receipt in receipts:
+        parsed, violations = _validator.check(receipt)
+        if violations:
+            results.append((None, violations))
+        else:
+            results.append((score(parsed), []))
+    return results
+
+
+class ScoringPool:
+    """Validates and scores receipts in worker processes, so that this CPU
+    work runs on every core instead of contending for the GIL. Receipts are
+    sent in chunks to amortize pickling.
+
+    Workers are started with forkserver rather than fork, since the pool is
+    usually created by a process that already runs server threads."""
+
+    def __init__(self, workers: int, chunkSize: int = CHUNK_SIZE) -> None:
+        self.workers = workers
+        self.chunkSize = chunkSize
+        self._executor = ProcessPoolExecutor(
+            workers, mp_context=get_context("forkserver")
+        )
+
+    def score(
+        self, receipts: List[Any], rules: Optional[List[Rule]] = None
+    ) -> List[Scored]:
+        """Returns the points and violations of each receipt, in order.
+        Points come from the given rules, if any, as compiled by
+        rules.compile_rules."""
+        if not receipts:
+            return []
+        size = min(self.chunkSize, math.ceil(len(receipts) / self.workers))
+        chunks = [
+            receipts[i:i + size] for i in range(0, len(receipts), size)
+        ]
+        results = []
+        for chunk in self._executor.map(
+            check_and_score, chunks, repeat(rules)
+        ):
+            results.extend(chunk)
+        return results
+
+    def close(self) -> None:
+        self._executor.shutdown()
@@ -1,133 +1,398 @@
-import json
-import re
-import uuid
-from datetime import datetime
-from typing import Any, Dict, List
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
 
-from .points import calculate_receipt_points
+from .aggregates import AggregateRow
+from .canonical import is_receipt_id, receipt_id
+from .logs import SAMPLED
+from .metrics import ID_LOOKUPS, RECEIPTS, TIMING
+from .points import calculate_batch_points, calculate_parsed_points
+from .pool import ScoringPool
+from .rules import RuleSet
+from .store import MemoryStore, NewReceipt, ReceiptStore
+from .streaming import (
+    MAX_BODY_BYTES,
+    MAX_ITEMS,
+    ReceiptTooLargeError,
+    read_receipt,
+)
+from .validator import ParsedReceipt, ReceiptValidator, Violation
 
-REGEX = {
-    "retailer": "^[\\w\\s\\-&]+$",
-    "total": "^\\d+\\.\\d{2}$",
-    "desc": "^[\\w\\s\\-]+$",
-    "price": "^\\d+\\.\\d{2}$",
-}
+log = logging.getLogger(__name__)
+
+# Fewest items, in a receipt or across a batch, worth sending to the pool.
+# See benchmarks/bench_pool.py for the crossover.
+INLINE_ITEMS = 500
+
+
+class InvalidReceiptError(ValueError):
+    """Raised when a receipt breaks the API contract. Carries every
+    violation that was found."""
+
+    def __init__(self, violations: List[Violation]) -> None:
+        super().__init__("Invalid receipt")
+        self.violations = violations
 
 
 class ReceiptProcessor:
     """Responsible for processing receipts, including receipt validation,
-    generating ids, calculating points, and storing ids/points."""
+    generating ids, calculating points, and storing ids/points.
+
+    Safe to share between threads. A new id is stored under one of a fixed
+    set of striped locks, picked by the id's hash, so that concurrent
+    uploads of the same receipt store it exactly once while uploads of
+    distinct receipts almost never wait on each other. Receipts and batches
+    are validated and scored before their locks are taken, which are only
+    held to re-check for the id and store it, so scoring a large receipt
+    never holds up uploads that share its stripe. Concurrent uploads of the
+    same new receipt may therefore each score it, though only one stores
+    it.
+
+    With workers, receipts and batches of at least inlineItems items are
+    validated and scored in a pool of that many processes; smaller ones
+    stay inline, where the round trip to a worker would cost more than it
+    saves.
 
-    def __init__(self) -> None:
-        # Dictionary mapping IDs to points, intended to persist in memory only
-        self.receipts = {}
+    Points come from the compiled rules of a RuleSet when one is given, and
+    from points.calculate_parsed_points otherwise."""
+
+    def __init__(
+        self,
+        store: Optional[ReceiptStore] = None,
+        lockStripes: int = 256,
+        workers: int = 0,
+        inlineItems: int = INLINE_ITEMS,
+        rules: Optional[RuleSet] = None,
+    ) -> None:
+        # Maps IDs to points, kept in memory only unless a store is given
+        self.receipts = store if store is not None else MemoryStore()
+        self.validator = ReceiptValidator()
+        self.inlineItems = inlineItems
+        self.rules = rules
+        self._locks = [threading.Lock() for _ in range(lockStripes)]
+        self._pool = ScoringPool(workers) if workers else None
 
     def process_receipt(self, receipt: List[Dict[str, Any]]) -> str:
         """Processes receipt by validating, generating an id, calculating
-        points, persisting the (id, points) in memory, then returning the id.
+        points, persisting the (id, points) in the store, then returning the
+        id.
         """
+        if timed := TIMING.enabled:
+            start = time.perf_counter()
+
         # Check if the receipt has been uploaded before, avoid revalidation
-        if (ID := self._generate_id(receipt)) in self.receipts:
-            print("Duplicate receipt uploaded. Returning previous id...")
+        ID = self._generate_id(receipt)
+        if timed:
+            start = TIMING.record("generate_id", start)
+        if ID in self.receipts:
+            RECEIPTS.inc("duplicate")
+            log.info("Duplicate receipt uploaded", extra={"id": ID, **SAMPLED})
             return ID
 
-        if not self._valid_receipt(receipt):
-            raise ValueError("Invalid receipt")
+        points = None
+        if self._pooled(_item_count(receipt)):
+            points, violations = self._pool.score(
+                [receipt], self._pool_rules()
+            )[0]
+        else:
+            parsed, violations = self.validator.check(receipt)
+        if timed:
+            start = TIMING.record("validate", start)
+        if violations:
+            RECEIPTS.inc("invalid")
+            raise InvalidReceiptError(violations)
+        if points is None:
+            points = self._score(parsed)
+        if timed:
+            start = TIMING.record("score", start)
+        if (violation := self.check_points(points)) is not None:
+            RECEIPTS.inc("invalid")
+            raise InvalidReceiptError([violation])
 
-        ID = self._generate_id(receipt)
-        self.receipts[ID] = calculate_receipt_points(receipt)
-        print(f"New receipt stored: id: {ID} points: {self.receipts[ID]}")
+        with self._locks[self._stripe(ID)]:
+            # Another thread may have stored the same receipt meanwhile
+            if ID in self.receipts:
+                RECEIPTS.inc("duplicate")
+                log.info(
+                    "Duplicate receipt uploaded", extra={"id": ID, **SAMPLED}
+                )
+                return ID
+            self.receipts.put_receipt(
+                NewReceipt(
+                    ID, points, receipt["retailer"], receipt["purchaseDate"]
+                )
+            )
+            if timed:
+                TIMING.record("store", start)
+        RECEIPTS.inc("new")
+        log.info(
+            "New receipt stored",
+            extra={"id": ID, "points": points, **SAMPLED},
+        )
         return ID
 
-    def _generate_id(self, receipt: Dict[str, Any]) -> str:
-        """Generates a unique id based on the hash of the receipt. Identical
-        receipts will produce the same id."""
-        # Convert JSON object to a string, sort keys for consistency
-        receiptStr = json.dumps(receipt, sort_keys=True)
-        # Generate a unique id based on the hash of the receipt
-        return str(uuid.uuid5(uuid.NAMESPACE_DNS, receiptStr))
+    def process_stream(
+        self,
+        stream: IO[bytes],
+        maxBytes: int = MAX_BODY_BYTES,
+        maxItems: int = MAX_ITEMS,
+    ) -> str:
+        """Processes a receipt read from a binary stream of its JSON, as
+        streaming.read_receipt reads it, without holding the body or the
+        parsed receipt in memory unless it must be parsed whole. Returns
+        the id, as process_receipt does. Raises InvalidReceiptError with
+        the first violation found (every one, for a receipt parsed whole),
+        and ReceiptTooLargeError past maxBytes bytes or maxItems items.
 
-    def _valid_receipt(self, receipt: Dict[str, Any]) -> bool:
-        """Validates the receipt based on the provided API contract."""
-        return (
-            self._validate_retailer(receipt)
-            and self._validate_purchase_date(receipt)
-            and self._validate_purchase_time(receipt)
-            and self._validate_items(receipt)
-            and self._validate_total(receipt)
+        Items are scored as they are read, so never in the pool, and
+        duplicates are only recognised once the whole body has been read."""
+        score = self.rules.score if self.rules is not None else (
+            calculate_parsed_points
         )
+        try:
+            streamed = read_receipt(
+                stream, self.validator, score, maxBytes, maxItems
+            )
+        except ReceiptTooLargeError:
+            RECEIPTS.inc("invalid")
+            raise
+        violations = streamed.violations
+        if not violations and (
+            violation := self.check_points(streamed.points)
+        ):
+            violations = [violation]
+        if violations:
+            RECEIPTS.inc("invalid")
+            raise InvalidReceiptError(violations)
 
-    def _validate_retailer(self, receipt: Dict[str, Any]) -> bool:
-        """Validate the retailer field."""
-        return (
-            "retailer" in receipt
-            and isinstance(receipt["retailer"], str)
-            and re.match(REGEX["retailer"], receipt["retailer"])
+        ID, points = streamed.ID, streamed.points
+        with self._locks[self._stripe(ID)]:
+            if ID in self.receipts:
+                RECEIPTS.inc("duplicate")
+                log.info(
+                    "Duplicate receipt uploaded", extra={"id": ID, **SAMPLED}
+                )
+                return ID
+            self.receipts.put_receipt(
+                NewReceipt(
+                    ID, points, streamed.retailer, streamed.purchaseDate
+                )
+            )
+        RECEIPTS.inc("new")
+        log.info(
+            "New receipt stored",
+            extra={"id": ID, "points": points, **SAMPLED},
         )
+        return ID
 
-    def _validate_purchase_date(self, receipt: Dict[str, Any]) -> bool:
-        """Validate the purchase date field. Must conform to the
-        ISO 8601 standard for dates."""
-        if "purchaseDate" not in receipt or not isinstance(
-            receipt["purchaseDate"], str
-        ):
-            return False
-        try:
-            datetime.strptime(receipt["purchaseDate"], "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
-
-    def _validate_purchase_time(self, receipt: Dict[str, Any]) -> bool:
-        """Validate the purchase time field. Must conform to the
-        ISO 8601 standard for time."""
-        if "purchaseTime" not in receipt or not isinstance(
-            receipt["purchaseTime"], str
-        ):
-            return False
-        try:
-            datetime.strptime(receipt["purchaseTime"], "%H:%M")
-            return True
-        except ValueError:
-            return False
-
-    def _validate_items(self, receipt: Dict[str, Any]) -> bool:
-        """Validate the items list and each item's description and price."""
-        if (
-            "items" not in receipt
-            or not isinstance(receipt["items"], list)
-            or len(receipt["items"]) < 1
+    def process_receipts(
+        self, receipts: List[Dict[str, Any]]
+    ) -> Tuple[List[Optional[str]], Dict[int, List[Violation]]]:
+        """Processes a batch of receipts in one pass. Returns a list aligned
+        with the input holding each receipt's id, or None where the receipt
+        is invalid, and the violations found for each invalid index.
+        Duplicates, both of stored receipts and within the batch, are only
+        scored once, and values repeated across receipts are only checked
+        and scored once (see ReceiptValidator.check_many)."""
+        ids = [None] * len(receipts)
+        invalid = {}
+        # Indexes of each id that is not stored yet, first upload first
+        unstored: Dict[str, List[int]] = {}
+        for i, receipt in enumerate(receipts):
+            if not isinstance(receipt, dict):
+                invalid[i] = self.validator.validate(receipt)
+                continue
+            ID = self._generate_id(receipt)
+            if ID in self.receipts:
+                ids[i] = ID
+            elif ID in unstored:
+                unstored[ID].append(i)
+            else:
+                unstored[ID] = [i]
+
+        # One receipt per id is validated, and its result shared by copies
+        unique = [receipts[indexes[0]] for indexes in unstored.values()]
+        if self._pooled(sum(map(_item_count, unique))):
+            checked = [
+                (None, points, violations)
+                for points, violations in self._pool.score(
+                    unique, self._pool_rules()
+                )
+            ]
+        else:
+            checked = [
+                (parsed, None, violations)
+                for parsed, violations in self.validator.check_many(unique)
+            ]
+        scored = []
+        unscored = []
+        for (ID, indexes), (parsed, points, violations) in zip(
+            unstored.items(), checked
         ):
-            return False
-
-        for item in receipt["items"]:
-            if not (
-                self._validate_item_description(item)
-                and self._validate_item_price(item)
-            ):
-                return False
-        return True
-
-    def _validate_item_description(self, item: Dict[str, Any]) -> bool:
-        """Validate the short description of an item."""
-        return (
-            "shortDescription" in item
-            and isinstance(item["shortDescription"], str)
-            and re.match(REGEX["desc"], item["shortDescription"])
-        )
+            for i in indexes:
+                if violations:
+                    invalid[i] = violations
+                else:
+                    ids[i] = ID
+            if not violations:
+                scored.append([ID, points, receipts[indexes[0]]])
+                if points is None:
+                    unscored.append((len(scored) - 1, parsed))
+        # Scored before the locks are taken, since a batch's new ids cover
+        # most stripes and would hold up every upload meanwhile
+        batchPoints = self._score_batch([parsed for _, parsed in unscored])
+        for (i, _), points in zip(unscored, batchPoints):
+            scored[i][1] = points
+        newReceipts = []
+        for ID, points, receipt in scored:
+            if (violation := self.check_points(points)) is not None:
+                for i in unstored[ID]:
+                    ids[i] = None
+                    invalid[i] = [violation]
+                continue
+            newReceipts.append(
+                NewReceipt(
+                    ID, points, receipt["retailer"], receipt["purchaseDate"]
+                )
+            )
 
-    def _validate_item_price(self, item: Dict[str, Any]) -> bool:
-        """Validate the price of an item."""
-        return (
-            "price" in item
-            and isinstance(item["price"], str)
-            and re.match(REGEX["price"], item["price"])
+        with self._locked([receipt.ID for receipt in newReceipts]):
+            # Drop ids that another thread stored meanwhile
+            stored = [
+                receipt
+                for receipt in newReceipts
+                if receipt.ID not in self.receipts
+            ]
+            self.receipts.put_receipts(stored)
+        newIDs = [receipt.ID for receipt in stored]
+        RECEIPTS.inc("new", amount=len(newIDs))
+        RECEIPTS.inc("invalid", amount=len(invalid))
+        RECEIPTS.inc(
+            "duplicate", amount=len(receipts) - len(newIDs) - len(invalid)
+        )
+        log.info(
+            "Batch processed",
+            extra={
+                "receipts": len(receipts),
+                "new": len(newIDs),
+                "invalid": len(invalid),
+            },
         )
+        return ids, invalid
+
+    def store_scored(self, scored: List[NewReceipt]) -> int:
+        """Stores receipts that were validated and scored elsewhere, e.g. in
+        worker processes, skipping ids that are already stored. Returns how
+        many ids were new. Receipts whose points the store cannot hold are
+        skipped as well, see check_points."""
+        IDs = [receipt.ID for receipt in scored]
+        holds = self.receipts.holds
+        with self._locked(IDs):
+            new = {
+                receipt.ID: receipt
+                for receipt in scored
+                if receipt.ID not in self.receipts and holds(receipt.points)
+            }
+            self.receipts.put_receipts(new.values())
+        unheld = sum(not holds(receipt.points) for receipt in scored)
+        RECEIPTS.inc("new", amount=len(new))
+        RECEIPTS.inc("invalid", amount=unheld)
+        RECEIPTS.inc("duplicate", amount=len(scored) - len(new) - unheld)
+        return len(new)
 
-    def _validate_total(self, receipt: Dict[str, Any]) -> bool:
-        """Validate the total field."""
-        return (
-            "total" in receipt
-            and isinstance(receipt["total"], str)
-            and re.match(REGEX["total"], receipt["total"])
+    def check_points(self, points: int) -> Optional[Violation]:
+        """The violation of a receipt that scores points the store cannot
+        hold, e.g. past SQLite's 64-bit integers for prices in the
+        quintillions, or None if it can."""
+        if self.receipts.holds(points):
+            return None
+        return Violation(
+            "$", f"scores {points} points, which cannot be stored"
         )
+
+    def get_points(self, ID: str) -> Optional[int]:
+        """Returns the points stored for the id, or None if it is unknown.
+        Ids that receipt_id cannot have returned are not looked up."""
+        if not is_receipt_id(ID):
+            ID_LOOKUPS.inc("malformed")
+            return None
+        return self.receipts.get(ID)
+
+    def get_many_points(self, IDs: List[str]) -> List[Optional[int]]:
+        """Returns the points stored for each id, None where it is
+        unknown, looked up in one batch."""
+        wellFormed = [ID for ID in IDs if is_receipt_id(ID)]
+        if len(wellFormed) == len(IDs):
+            return self.receipts.get_many(IDs)
+        ID_LOOKUPS.inc("malformed", amount=len(IDs) - len(wellFormed))
+        found = dict(zip(wellFormed, self.receipts.get_many(wellFormed)))
+        return [found.get(ID) for ID in IDs]
+
+    def aggregates(
+        self,
+        retailer: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> List[AggregateRow]:
+        """The receipts and points of the retailer, or of every retailer, on
+        each purchase date from start to end, inclusive (YYYY-MM-DD), read
+        from the counters the store keeps up to date."""
+        return self.receipts.aggregate_rows(retailer, start, end)
+
+    def close(self) -> None:
+        """Flushes and closes the underlying store, and stops the pool."""
+        if self._pool is not None:
+            self._pool.close()
+        self.receipts.close()
+
+    def _score(self, parsed: ParsedReceipt) -> int:
+        if self.rules is not None:
+            return self.rules.score(parsed)
+        return calculate_parsed_points(parsed)
+
+    def _score_batch(self, parsedReceipts: List[ParsedReceipt]) -> List[int]:
+        if self.rules is not None:
+            return list(map(self.rules.score, parsedReceipts))
+        return calculate_batch_points(parsedReceipts)
+
+    def uses_pool(self, receipt: Any) -> bool:
+        """Whether process_receipt validates and scores the receipt in the
+        pool rather than inline."""
+        return self._pooled(_item_count(receipt))
+
+    def _pool_rules(self) -> Optional[List[Dict[str, Any]]]:
+        """The rule definitions for the workers to compile, if any."""
+        return self.rules.rules if self.rules is not None else None
+
+    def _pooled(self, itemCount: int) -> bool:
+        """Whether receipts with this many items in total go to the pool."""
+        return self._pool is not None and itemCount >= self.inlineItems
+
+    def _stripe(self, ID: str) -> int:
+        """Returns the index of the lock that guards the id."""
+        return hash(ID) % len(self._locks)
+
+    @contextmanager
+    def _locked(self, IDs: List[str]) -> Iterator[None]:
+        """Holds the locks of every id. Stripes are taken in index order so
+        that threads locking overlapping sets cannot deadlock."""
+        with ExitStack() as stack:
+            for stripe in sorted({self._stripe(ID) for ID in IDs}):
+                stack.enter_context(self._locks[stripe])
+            yield
+
+    def _generate_id(self, receipt: Dict[str, Any]) -> str:
+        """Generates a unique id based on the hash of the receipt. Identical
+        receipts will produce the same id."""
+        return receipt_id(receipt)
+
+    def _valid_receipt(self, receipt: Dict[str, Any]) -> bool:
+        """Validates the receipt based on the provided API contract."""
+        return self.validator.is_valid(receipt)
+
+
+def _item_count(receipt: Any) -> int:
+    items = receipt.get("items") if isinstance(receipt, dict) else None
+    return len(items) if isinstance(items, list) else 0
@@ -0,0 +1,321 @@
+"""Point rules defined as data and compiled into one scoring function.
+
+A rule names the receipt field it looks at, an optional predicate ("when")
+and an award, each a single-key object:
+
+    {"name": "round_total", "field": "total",
+     "when": {"multiple_of": "1.00"}, "award": {"points": 50}}
+
+Fields, with the predicates and awards each supports besides
+{"points": n}:
+
+    retailer      award per_alphanumeric: n
+    total         when multiple_of: "d.dd"
+    items         award per_pair: n
+    item          when description_length_multiple_of: n,
+                  award price_multiplier: x (rounded up to a whole point)
+    purchaseDate  when odd: true | false
+    purchaseTime  when between: ["HH:MM", "HH:MM"] (exclusive)
+
+compile_rules turns a rule list into Python source with every constant
+inlined and every item rule in a single loop, then execs it once, so the
+number of rules adds no interpretation overhead per receipt. Print the
+default rules, to start a rules file from, with
+
+    python -m receipt_processor.rules"""
+
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from .configuration import (
+    ALPHANUMERIC_POINTS,
+    DESC_MULTIPLIER,
+    MULTIPLE_TOTAL_POINTS,
+    ODD_PURCHASE_DATE_POINTS,
+    PAIR_OF_ITEMS_POINTS,
+    PURCHASE_TIME_END,
+    PURCHASE_TIME_POINTS,
+    PURCHASE_TIME_START,
+    ROUND_TOTAL_POINTS,
+)
+from .money import exact_ratio, parse_cents
+from .validator import REGEX, ParsedReceipt, parse_time
+
+log = logging.getLogger(__name__)
+
+Rule = Dict[str, Any]
+Scorer = Callable[[ParsedReceipt], int]
+
+# The rules of calculate_receipt_points, from the configured constants
+DEFAULT_RULES: List[Rule] = [
+    {
+        "name": "retailer_alphanumeric",
+        "field": "retailer",
+        "award": {"per_alphanumeric": ALPHANUMERIC_POINTS},
+    },
+    {
+        "name": "round_total",
+        "field": "total",
+        "when": {"multiple_of": "1.00"},
+        "award": {"points": ROUND_TOTAL_POINTS},
+    },
+    {
+        "name": "quarter_total",
+        "field": "total",
+        "when": {"multiple_of": "0.25"},
+        "award": {"points": MULTIPLE_TOTAL_POINTS},
+    },
+    {
+        "name": "item_pairs",
+        "field": "items",
+        "award": {"per_pair": PAIR_OF_ITEMS_POINTS},
+    },
+    {
+        "name": "item_description",
+        "field": "item",
+        "when": {"description_length_multiple_of": 3},
+        "award": {"price_multiplier": DESC_MULTIPLIER},
+    },
+    {
+        "name": "odd_purchase_day",
+        "field": "purchaseDate",
+        "when": {"odd": True},
+        "award": {"points": ODD_PURCHASE_DATE_POINTS},
+    },
+    {
+        "name": "purchase_time_window",
+        "field": "purchaseTime",
+        "when": {"between": [PURCHASE_TIME_START, PURCHASE_TIME_END]},
+        "award": {"points": PURCHASE_TIME_POINTS},
+    },
+]
+
+_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_MONEY = re.compile(REGEX["total"])
+
+
+class RuleError(ValueError):
+    """Raised when a rule definition cannot be compiled."""
+
+
+def _integer(value: Any, what: str, minimum: Optional[int] = None) -> int:
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise RuleError(f"{what} must be an integer")
+    if minimum is not None and value < minimum:
+        raise RuleError(f"{what} must be at least {minimum}")
+    return value
+
+
+def _multiple_of(value: Any) -> str:
+    if not isinstance(value, str) or not _MONEY.match(value):
+        raise RuleError("multiple_of must be an amount like '0.25'")
+    cents = parse_cents(value)
+    if cents == 0:
+        raise RuleError("multiple_of must not be 0.00")
+    return f"total % {cents} == 0"
+
+
+def _odd(value: Any) -> str:
+    if not isinstance(value, bool):
+        raise RuleError("odd must be true or false")
+    return "day % 2 == 1" if value else "day % 2 == 0"
+
+
+def _between(value: Any) -> str:
+    if (
+        not isinstance(value, list)
+        or len(value) != 2
+        or not all(isinstance(bound, str) for bound in value)
+    ):
+        raise RuleError("between must be two HH:MM times")
+    minutes = []
+    for bound in value:
+        parsed = parse_time(bound)
+        if parsed is None:
+            raise RuleError(f"between has an invalid time: {bound!r}")
+        minutes.append(parsed[0] * 60 + parsed[1])
+    return f"{minutes[0]} < minute < {minutes[1]}"
+
+
+def _description_length(value: Any) -> str:
+    n = _integer(value, "description_length_multiple_of", minimum=1)
+    return f"len(desc.strip()) % {n} == 0"
+
+
+def _price_multiplier(value: Any) -> str:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise RuleError("price_multiplier must be a number")
+    if value < 0:
+        raise RuleError("price_multiplier must not be negative")
+    numerator, denominator = exact_ratio(value)
+    # ceil_cents_multiple, inlined
+    return f"-(-price * {numerator} // {denominator * 100})"
+
+
+# (field, predicate) -> expression builder
+PREDICATES: Dict[tuple, Callable[[Any], str]] = {
+    ("total", "multiple_of"): _multiple_of,
+    ("item", "description_length_multiple_of"): _description_length,
+    ("purchaseDate", "odd"): _odd,
+    ("purchaseTime", "between"): _between,
+}
+# (field, award) -> expression builder
+AWARDS: Dict[tuple, Callable[[Any], str]] = {
+    ("retailer", "per_alphanumeric"): lambda n: (
+        f"{_integer(n, 'per_alphanumeric')} * sum(map(str.isalnum, retailer))"
+    ),
+    ("items", "per_pair"): lambda n: (
+        f"(len(items) // 2) * {_integer(n, 'per_pair')}"
+    ),
+    ("item", "price_multiplier"): _price_multiplier,
+}
+FIELDS = ["retailer", "total", "items", "item", "purchaseDate", "purchaseTime"]
+
+
+def _single(rule: Rule, key: str) -> tuple:
+    value = rule.get(key)
+    if not isinstance(value, dict) or len(value) != 1:
+        raise RuleError(f"{key} must be an object with one key")
+    return next(iter(value.items()))
+
+
+def _compile_rule(rule: Any) -> tuple:
+    """Returns the field and the source lines of one rule."""
+    if not isinstance(rule, dict):
+        raise RuleError("Every rule must be an object")
+    name = rule.get("name")
+    if not isinstance(name, str) or not _NAME.match(name):
+        raise RuleError(f"Invalid rule name: {name!r}")
+    try:
+        return _compile_named_rule(name, rule)
+    except RuleError as error:
+        raise RuleError(f"Rule {name}: {error}") from None
+
+
+def _compile_named_rule(name: str, rule: Rule) -> tuple:
+    field = rule.get("field")
+    if field not in FIELDS:
+        raise RuleError(f"unknown field {field!r}")
+    unknown = set(rule) - {"name", "field", "when", "award"}
+    if unknown:
+        raise RuleError(f"unknown keys {sorted(unknown)}")
+
+    awardName, awardValue = _single(rule, "award")
+    if awardName == "points":
+        award = str(_integer(awardValue, "points"))
+    elif (field, awardName) in AWARDS:
+        award = AWARDS[field, awardName](awardValue)
+    else:
+        raise RuleError(f"unknown award {awardName!r} for {field}")
+
+    lines = [f"# {name}"]
+    if "when" in rule:
+        whenName, whenValue = _single(rule, "when")
+        if (field, whenName) not in PREDICATES:
+            raise RuleError(f"unknown predicate {whenName!r} for {field}")
+        lines.append(f"if {PREDICATES[field, whenName](whenValue)}:")
+        lines.append(f"    points += {award}")
+    else:
+        lines.append(f"points += {award}")
+    return field, lines
+
+
+def rules_source(rules: List[Rule]) -> str:
+    """Returns the source of the scoring function for the rules."""
+    if not isinstance(rules, list):
+        raise RuleError("Rules must be a list")
+    receiptLines = []
+    itemLines = []
+    for rule in rules:
+        field, lines = _compile_rule(rule)
+        (itemLines if field == "item" else receiptLines).extend(lines)
+
+    body = [f"{', '.join(ParsedReceipt._fields)} = receipt", "points = 0"]
+    body += receiptLines
+    if itemLines:
+        body.append("for desc, price in items:")
+        body += ["    " + line for line in itemLines]
+    body.append("return points")
+    return "def score(receipt):\n" + "".join(
+        f"    {line}\n" for line in body
+    )
+
+
+def compile_rules(rules: List[Rule]) -> Scorer:
+    """Compiles the rules into a function that scores a ParsedReceipt. The
+    function keeps its rules and source in .rules and .source."""
+    source = rules_source(rules)
+    namespace: Dict[str, Any] = {}
+    exec(compile(source, "<points rules>", "exec"), namespace)
+    score = namespace["score"]
+    score.rules = rules
+    score.source = source
+    return score
+
+
+def load_rules(path: str) -> List[Rule]:
+    """Reads a JSON list of rules from a file."""
+    with open(path) as file:
+        return json.load(file)
+
+
+class RuleSet:
+    """The compiled rules in use, optionally loaded from a JSON file that
+    is reloaded when it changes. score is swapped as a whole, so threads
+    scoring during a reload use either the old or the new rules."""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.score = compile_rules(DEFAULT_RULES)
+        self._mtime: Optional[float] = None
+        self._stop = threading.Event()
+        if path is not None:
+            self.score = compile_rules(load_rules(path))
+            self._mtime = os.stat(path).st_mtime
+
+    @property
+    def rules(self) -> List[Rule]:
+        return self.score.rules
+
+    def reload(self) -> bool:
+        """Recompiles the rules file if it changed since it was loaded.
+        Keeps the current rules if the new ones fail to load. Returns
+        whether the rules were replaced."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            self.score = compile_rules(load_rules(self.path))
+        except (OSError, ValueError) as error:
+            log.error(
+                "Points rules not reloaded",
+                extra={"path": self.path, "error": str(error)},
+            )
+            return False
+        log.info(
+            "Points rules reloaded",
+            extra={"path": self.path, "rules": len(self.rules)},
+        )
+        return True
+
+    def watch(self, interval: float = 1.0) -> None:
+        """Checks the rules file for changes every interval seconds, in a
+        background thread, until close is called."""
+
+        def run() -> None:
+            while not self._stop.wait(interval):
+                self.reload()
+
+        threading.Thread(target=run, name="rules-watcher", daemon=True).start()
+
+    def close(self) -> None:
+        self._stop.set()
+
+
+if __name__ == "__main__":
+    print(json.dumps(DEFAULT_RULES, indent=2))
@@ -0,0 +1,115 @@
+"""Pieces shared by the web servers, host.py (Flask) and async_host.py."""
+
+import hashlib
+import os
+from typing import Optional, Tuple
+
+from . import codec
+from .cache import LRUCache
+from .cluster import Cluster
+from .processor import ReceiptProcessor
+from .rules import RuleSet
+from .store import FilteredStore, open_store
+
+POINTS_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# For stores that may forget an id: clients keep the response but check
+# with its ETag that the id is still held
+POINTS_REVALIDATE_CACHE_CONTROL = "public, no-cache"
+# Receipt bodies of at least this many bytes are read as a stream rather
+# than parsed whole, see streaming.read_receipt
+STREAM_BODY_BYTES = int(os.environ.get("STREAM_BODY_BYTES", 256 * 1024))
+
+
+def processor_from_environment() -> ReceiptProcessor:
+    """Builds the service's ReceiptProcessor from the environment.
+
+    RECEIPT_STORE selects where (id, points) pairs live, see
+    store.open_store. SCORING_WORKERS > 0 validates and scores large
+    receipts and batches in a pool of that many processes. POINTS_RULES
+    names a JSON file of point rules, reloaded when it changes. Unless
+    ID_FILTER_ERROR_RATE is 0, a store that is neither in memory nor shared
+    is put behind a FilteredStore with that error rate (0.01 by
+    default)."""
+    rulesPath = os.environ.get("POINTS_RULES")
+    rules = RuleSet(rulesPath) if rulesPath else None
+    if rules is not None:
+        rules.watch()
+    store = open_store(os.environ.get("RECEIPT_STORE", "memory"))
+    errorRate = float(os.environ.get("ID_FILTER_ERROR_RATE", "0.01"))
+    if errorRate > 0 and not store.shared and not store.inMemory:
+        store = FilteredStore(store, errorRate)
+    return ReceiptProcessor(
+        store,
+        workers=int(os.environ.get("SCORING_WORKERS", "0")),
+        rules=rules,
+    )
+
+
+def cluster_from_environment() -> Optional[Cluster]:
+    """Returns this node's Cluster when CLUSTER_NODES lists the base urls of
+    the cluster's nodes, comma separated, and CLUSTER_SELF names this one,
+    and None otherwise. CLUSTER_SECRET, which every node must share, is
+    then required."""
+    nodes = os.environ.get("CLUSTER_NODES")
+    if not nodes:
+        return None
+    secret = os.environ.get("CLUSTER_SECRET")
+    if not secret:
+        raise ValueError("CLUSTER_SECRET is required in cluster mode")
+    return Cluster(os.environ["CLUSTER_SELF"], nodes.split(","), secret)
+
+
+class PointsResponses:
+    """Builds the body and ETag of a points response once per id, and keeps
+    them for the most recently polled ids (POINTS_CACHE_SIZE by default).
+    Points of an id never change, since ids are content hashes.
+
+    A store that forgets ids, like BoundedStore, is still asked on every
+    hit, which refreshes the id there and drops it here once the store has
+    dropped it. Responses then carry POINTS_REVALIDATE_CACHE_CONTROL rather
+    than POINTS_CACHE_CONTROL."""
+
+    def __init__(
+        self,
+        receiptProcessor: ReceiptProcessor,
+        maxEntries: Optional[int] = None,
+    ) -> None:
+        if maxEntries is None:
+            maxEntries = int(os.environ.get("POINTS_CACHE_SIZE", "100000"))
+        self.receiptProcessor = receiptProcessor
+        self.cache = LRUCache(maxEntries)
+        self.cacheControl = (
+            POINTS_REVALIDATE_CACHE_CONTROL
+            if receiptProcessor.receipts.forgets
+            else POINTS_CACHE_CONTROL
+        )
+
+    def get(self, ID: str) -> Optional[Tuple[str, str, bool]]:
+        """Returns the body, the ETag (unquoted) and whether they came from
+        the cache, or None for an unknown id. Unknown ids are not cached,
+        since they may be uploaded later."""
+        if (cached := self.cache.get(ID)) is not None:
+            if not self.receiptProcessor.receipts.forgets:
+                return (*cached, True)
+            if self.receiptProcessor.get_points(ID) is not None:
+                return (*cached, True)
+            self.cache.discard(ID)
+            return None
+        if (points := self.receiptProcessor.get_points(ID)) is None:
+            return None
+        body = codec.dumps({"points": points}) + "\n"
+        etag = hashlib.sha1(body.encode()).hexdigest()[:20]
+        self.cache.put(ID, (body, etag))
+        return body, etag, False
+
+
+def etag_matches(ifNoneMatch: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches the unquoted ETag, using
+    the weak comparison (RFC 9110 13.1.2)."""
+    if not ifNoneMatch:
+        return False
+    for tag in ifNoneMatch.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == f'"{etag}"':
+            return True
+    return False
@@ -0,0 +1,1183 @@
+import json
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from urllib.parse import parse_qs
+
+from .aggregates import (
+    HISTOGRAM_BUCKETS,
+    AggregateRow,
+    Aggregates,
+    bucket_index,
+)
+from .bloom import GrowingBloomFilter
+from .metrics import ID_LOOKUPS, STORE_EVICTIONS
+
+log = logging.getLogger(__name__)
+
+
+class NewReceipt(NamedTuple):
+    """A receipt to store: its id and points, and the fields the aggregates
+    are keyed by. Receipts without them, such as those moved from another
+    cluster node, are stored but not counted."""
+
+    ID: str
+    points: int
+    retailer: Optional[str] = None
+    purchaseDate: Optional[str] = None
+
+
+class ReceiptStore(ABC):
+    """Storage for (id, points) pairs behind ReceiptProcessor. Ids are only
+    ever added, and the points for an id never change.
+
+    Receipts stored with put_receipt(s) are also counted in aggregates.
+    Stores kept in memory count them in an Aggregates of their own; stores
+    that persist receipts persist the counts with them, and override
+    put_receipt(s) and aggregate_rows."""
+
+    # True if other processes see a write as soon as put returns
+    shared = False
+    # True if lookups are probes of an in-memory table, which FilteredStore
+    # cannot make any cheaper
+    inMemory = False
+    # The points the store can hold, None if it holds any int
+    pointsRange: Optional[range] = None
+    # True if receipts may be dropped after they were stored, so that only
+    # a lookup tells whether an id is still held
+    forgets = False
+
+    def __init__(self) -> None:
+        self.aggregates = Aggregates()
+
+    @abstractmethod
+    def get(self, ID: str) -> Optional[int]:
+        """Returns the points stored for the id, or None if it is unknown."""
+
+    @abstractmethod
+    def put(self, ID: str, points: int) -> None:
+        """Stores the points for a new id."""
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Returns the number of stored ids."""
+
+    @abstractmethod
+    def ids(self) -> Iterator[str]:
+        """Yields every stored id, in no particular order."""
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        """Returns the points stored for each id, None where it is
+        unknown, in the same order."""
+        return [self.get(ID) for ID in IDs]
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        """Stores several (id, points) pairs at once."""
+        for ID, points in pairs:
+            self.put(ID, points)
+
+    def put_receipt(self, receipt: NewReceipt) -> None:
+        """Stores a new receipt and counts it in the aggregates. Callers
+        store each id once, as ReceiptProcessor does under its locks."""
+        self.put(receipt.ID, receipt.points)
+        if receipt.retailer is not None:
+            self.aggregates.add(
+                receipt.retailer, receipt.purchaseDate, receipt.points
+            )
+
+    def put_receipts(self, receipts: Iterable[NewReceipt]) -> None:
+        """Stores several new receipts at once, see put_receipt."""
+        receipts = list(receipts)
+        self.put_many((receipt.ID, receipt.points) for receipt in receipts)
+        for receipt in receipts:
+            if receipt.retailer is not None:
+                self.aggregates.add(
+                    receipt.retailer, receipt.purchaseDate, receipt.points
+                )
+
+    def aggregate_rows(
+        self,
+        retailer: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> List[AggregateRow]:
+        """The aggregates of the retailer, or of every retailer, on each
+        purchase date from start to end, inclusive."""
+        return self.aggregates.rows(retailer, start, end)
+
+    def forget(self, IDs: Iterable[str]) -> None:
+        """Drops ids this store no longer has to hold, such as receipts
+        handed to another cluster node, if it drops ids at all (see
+        forgets). Other stores keep them."""
+
+    def holds(self, points: int) -> bool:
+        """Whether the store can hold points. Callers must not put points
+        it cannot, see ReceiptProcessor."""
+        return self.pointsRange is None or points in self.pointsRange
+
+    def __contains__(self, ID: str) -> bool:
+        return self.get(ID) is not None
+
+    def _check_points(self, points: Iterable[int]) -> None:
+        """Raises ValueError if any of points is outside pointsRange."""
+        for value in points:
+            if not self.holds(value):
+                raise ValueError(f"Points out of range: {value}")
+
+    def flush(self) -> None:
+        """Makes every write so far durable. A no-op for in-memory stores."""
+
+    def close(self) -> None:
+        """Flushes and releases any resources held by the store."""
+        self.flush()
+
+
+class MemoryStore(ReceiptStore):
+    """Keeps receipts in a dictionary, intended to persist in memory only."""
+
+    inMemory = True
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._receipts: Dict[str, int] = {}
+
+    def get(self, ID: str) -> Optional[int]:
+        return self._receipts.get(ID)
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        return list(map(self._receipts.get, IDs))
+
+    def put(self, ID: str, points: int) -> None:
+        self._receipts[ID] = points
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        self._receipts.update(pairs)
+
+    def __contains__(self, ID: str) -> bool:
+        return ID in self._receipts
+
+    def __len__(self) -> int:
+        return len(self._receipts)
+
+    def ids(self) -> Iterator[str]:
+        return iter(list(self._receipts))
+
+
+# Bytes an entry of BoundedStore costs besides its id string: the ordered
+# dict's slot and links, and the (points, last used) tuple with its float
+ENTRY_BYTES = 190
+
+
+class BoundedStore(ReceiptStore):
+    """Keeps receipts in memory within limits on the number of entries
+    (maxEntries), their estimated size (maxBytes) and the time since each
+    was last uploaded or looked up (ttl, in seconds). A limit of 0 is no
+    limit.
+
+    Entries are kept in least recently used order, which is also the order
+    in which they expire, so evicting for any limit pops from the front of
+    one ordered dict: O(1) amortized per write. An expired entry found by a
+    lookup is dropped there, the others at the next write. evictions counts
+    the entries dropped by reason (expired, entries or bytes).
+
+    Evicted receipts stay counted in the aggregates, and like any receipt
+    the store does not hold, are counted again if they are uploaded
+    again."""
+
+    inMemory = True
+    forgets = True
+
+    def __init__(
+        self,
+        maxEntries: int = 0,
+        maxBytes: int = 0,
+        ttl: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__()
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.clock = clock
+        self.nbytes = 0
+        self.evictions = {"expired": 0, "entries": 0, "bytes": 0}
+        # ID -> (points, time last used)
+        self._items: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ID: str) -> Optional[int]:
+        with self._lock:
+            return self._touch(ID, self.clock())
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        with self._lock:
+            now = self.clock()
+            return [self._touch(ID, now) for ID in IDs]
+
+    def put(self, ID: str, points: int) -> None:
+        with self._lock:
+            now = self.clock()
+            self._add(ID, points, now)
+            self._evict(now)
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        with self._lock:
+            now = self.clock()
+            for ID, points in pairs:
+                self._add(ID, points, now)
+            self._evict(now)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict(self.clock())
+            return len(self._items)
+
+    def ids(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._items))
+
+    def _touch(self, ID: str, now: float) -> Optional[int]:
+        """Returns the points of a live entry and marks it as just used.
+        Must be called with the lock held."""
+        entry = self._items.get(ID)
+        if entry is None:
+            return None
+        if self.ttl and now - entry[1] >= self.ttl:
+            self._remove(ID, "expired")
+            return None
+        self._items[ID] = (entry[0], now)
+        self._items.move_to_end(ID)
+        return entry[0]
+
+    def _add(self, ID: str, points: int, now: float) -> None:
+        """Must be called with the lock held."""
+        if ID not in self._items:
+            self.nbytes += sys.getsizeof(ID) + ENTRY_BYTES
+        self._items[ID] = (points, now)
+        self._items.move_to_end(ID)
+
+    def forget(self, IDs: Iterable[str]) -> None:
+        """Drops the ids, without counting them as evictions."""
+        with self._lock:
+            for ID in IDs:
+                if ID in self._items:
+                    self._drop(ID)
+
+    def _remove(self, ID: str, reason: str) -> None:
+        """Must be called with the lock held."""
+        self._drop(ID)
+        self.evictions[reason] += 1
+        STORE_EVICTIONS.inc(reason)
+
+    def _drop(self, ID: str) -> None:
+        """Must be called with the lock held."""
+        del self._items[ID]
+        self.nbytes -= sys.getsizeof(ID) + ENTRY_BYTES
+
+    def _evict(self, now: float) -> None:
+        """Drops expired entries, then the least recently used ones until
+        the store is within its limits. Must be called with the lock
+        held."""
+        items = self._items
+        if self.ttl:
+            while items:
+                ID = next(iter(items))
+                if now - items[ID][1] < self.ttl:
+                    break
+                self._remove(ID, "expired")
+        while self.maxEntries and len(items) > self.maxEntries:
+            self._remove(next(iter(items)), "entries")
+        while self.maxBytes and self.nbytes > self.maxBytes and items:
+            self._remove(next(iter(items)), "bytes")
+
+
+def _select_in(count: int) -> str:
+    """Returns a query for the (id, points) rows of count ids."""
+    placeholders = ", ".join(["?"] * count)
+    return f"SELECT id, points FROM receipts WHERE id IN ({placeholders})"
+
+
+class SQLiteStore(ReceiptStore):
+    """Persists receipts to a SQLite database in WAL mode.
+
+    Writes are group-committed: they are buffered in memory, where reads can
+    already see them, and written in a single transaction once batchSize
+    writes are pending or commitInterval seconds have passed. A crash loses
+    at most that window of writes, which is safe to replay because the same
+    receipt always produces the same id and points.
+
+    When the database is shared with other processes (e.g. server workers),
+    a write must be visible to them before its id is handed out. With
+    shared=True every put waits until its write is committed. Writes from
+    concurrent threads are still committed together, by the background
+    committer, in one transaction per group.
+
+    Aggregates are kept in the receipt_aggregates table, one row per
+    retailer, purchase date and histogram bucket, and updated in the
+    transaction that inserts the receipts. A receipt is only counted if its
+    id is not in the database yet, so a receipt uploaded to several
+    processes at once is counted once.
+
+    Points outside pointsRange, SQLite's 64-bit INTEGER, are refused by
+    put with a ValueError. A group that still fails to commit for any other
+    reason than a busy or failing database is committed a receipt at a
+    time, dropping (and logging) the receipts that fail, so that one bad
+    row never holds back the writes around it."""
+
+    pointsRange = range(-(2**63), 2**63)
+
+    # Statements are kept constant so that sqlite3 reuses them prepared
+    _CREATE = (
+        "CREATE TABLE IF NOT EXISTS receipts "
+        "(id TEXT PRIMARY KEY, points INTEGER NOT NULL) WITHOUT ROWID"
+    )
+    _SELECT = "SELECT points FROM receipts WHERE id = ?"
+    _INSERT = "INSERT OR IGNORE INTO receipts (id, points) VALUES (?, ?)"
+    _COUNT = "SELECT COUNT(*) FROM receipts"
+    _IDS = "SELECT id FROM receipts WHERE id > ? ORDER BY id LIMIT 10000"
+    _CREATE_AGGREGATES = (
+        "CREATE TABLE IF NOT EXISTS receipt_aggregates "
+        "(retailer TEXT NOT NULL, purchase_date TEXT NOT NULL, "
+        "bucket INTEGER NOT NULL, receipts INTEGER NOT NULL, "
+        "points INTEGER NOT NULL, "
+        "PRIMARY KEY (retailer, purchase_date, bucket)) WITHOUT ROWID"
+    )
+    # Runs before the receipts are inserted, so that ids already in the
+    # database are not counted again
+    _ADD_TO_AGGREGATES = (
+        "INSERT INTO receipt_aggregates "
+        "(retailer, purchase_date, bucket, receipts, points) "
+        "SELECT ?, ?, ?, 1, ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM receipts WHERE id = ?) "
+        "ON CONFLICT (retailer, purchase_date, bucket) DO UPDATE SET "
+        "receipts = receipts + 1, points = points + excluded.points"
+    )
+    _AGGREGATES = (
+        "SELECT retailer, purchase_date, bucket, receipts, points "
+        "FROM receipt_aggregates "
+        "WHERE (?1 IS NULL OR retailer = ?1) "
+        "AND purchase_date >= ?2 AND purchase_date <= ?3"
+    )
+    # Ids looked up per statement, below SQLite's default variable limit
+    _SELECT_MANY_SIZE = 500
+    _SELECT_MANY = _select_in(_SELECT_MANY_SIZE)
+
+    def __init__(
+        self,
+        path: str,
+        batchSize: int = 1000,
+        commitInterval: float = 0.05,
+        shared: bool = False,
+    ) -> None:
+        self.batchSize = batchSize
+        self.commitInterval = commitInterval
+        self.shared = shared
+        self._pending: Dict[str, int] = {}
+        # _ADD_TO_AGGREGATES parameters of the pending receipts
+        self._pendingCounts: List[Tuple[str, str, int, int, str]] = []
+        # Count of puts so far and of puts known to be committed
+        self._writes = 0
+        self._committed = 0
+        self._closing = False
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        # WAL mode only needs to sync at checkpoints to stay consistent
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        # Wait for writers in other processes instead of failing
+        self._connection.execute("PRAGMA busy_timeout=5000")
+        self._connection.execute(self._CREATE)
+        self._connection.execute(self._CREATE_AGGREGATES)
+
+        self._committer = threading.Thread(
+            target=self._commit_periodically, daemon=True
+        )
+        self._committer.start()
+
+    def get(self, ID: str) -> Optional[int]:
+        with self._lock:
+            if (points := self._pending.get(ID)) is not None:
+                return points
+            row = self._connection.execute(self._SELECT, (ID,)).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        found = {}
+        with self._lock:
+            pending = self._pending
+            unknown = [ID for ID in IDs if ID not in pending]
+            size = self._SELECT_MANY_SIZE
+            for start in range(0, len(unknown), size):
+                chunk = unknown[start:start + size]
+                query = self._SELECT_MANY
+                if len(chunk) < size:
+                    query = _select_in(len(chunk))
+                found.update(self._connection.execute(query, chunk))
+        return [pending.get(ID, found.get(ID)) for ID in IDs]
+
+    def put(self, ID: str, points: int) -> None:
+        self._check_points([points])
+        with self._lock:
+            self._pending[ID] = points
+            self._after_write()
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        pairs = list(pairs)
+        self._check_points(points for _, points in pairs)
+        with self._lock:
+            self._pending.update(pairs)
+            self._after_write()
+
+    def put_receipt(self, receipt: NewReceipt) -> None:
+        self.put_receipts([receipt])
+
+    def put_receipts(self, receipts: Iterable[NewReceipt]) -> None:
+        receipts = list(receipts)
+        self._check_points(receipt.points for receipt in receipts)
+        with self._lock:
+            for receipt in receipts:
+                if receipt.retailer is not None and (
+                    receipt.ID not in self._pending
+                ):
+                    self._pendingCounts.append(self._count_row(receipt))
+                self._pending[receipt.ID] = receipt.points
+            self._after_write()
+
+    def aggregate_rows(
+        self,
+        retailer: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> List[AggregateRow]:
+        with self._lock:
+            self._commit()
+            found = self._connection.execute(
+                self._AGGREGATES,
+                (retailer, start or "", end or "\uffff"),
+            ).fetchall()
+        # (retailer, purchase date) -> [receipts, points, histogram]
+        rows: Dict[Tuple[str, str], list] = {}
+        for rowRetailer, purchaseDate, bucket, receipts, points in found:
+            row = rows.setdefault(
+                (rowRetailer, purchaseDate),
+                [0, 0, [0] * len(HISTOGRAM_BUCKETS)],
+            )
+            row[0] += receipts
+            row[1] += points
+            row[2][bucket_index(bucket)] += receipts
+        return [
+            AggregateRow(*key, receipts, points, tuple(histogram))
+            for key, (receipts, points, histogram) in rows.items()
+        ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._commit()
+            return self._connection.execute(self._COUNT).fetchone()[0]
+
+    def ids(self) -> Iterator[str]:
+        # Pages through the ids so that writes go on between pages
+        last = ""
+        while True:
+            with self._lock:
+                self._commit()
+                rows = self._connection.execute(self._IDS, (last,)).fetchall()
+            if not rows:
+                return
+            for (ID,) in rows:
+                yield ID
+            last = rows[-1][0]
+
+    def flush(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._committer.join()
+        self._connection.close()
+
+    def _after_write(self) -> None:
+        """Commits, or waits for the committer, as the write mode requires.
+        Must be called with the lock held."""
+        self._writes += 1
+        if self.shared:
+            ticket = self._writes
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: self._committed >= ticket)
+        elif len(self._pending) >= self.batchSize:
+            self._commit()
+
+    def _commit(self) -> None:
+        """Writes every pending receipt in one transaction. Must be called
+        with the lock held. Raises sqlite3.OperationalError, keeping the
+        receipts pending, if the database is busy or failing."""
+        if self._pending:
+            try:
+                self._write(self._pending.items(), self._pendingCounts)
+            except sqlite3.OperationalError:
+                raise
+            except (sqlite3.Error, ValueError, OverflowError) as error:
+                log.error(
+                    "Receipt group failed to commit, committing one by one",
+                    extra={"error": str(error)},
+                )
+                self._write_each()
+            self._pending = {}
+            self._pendingCounts = []
+        self._committed = self._writes
+        self._condition.notify_all()
+
+    def _write(
+        self,
+        pairs: Iterable[Tuple[str, int]],
+        counts: Sequence[Tuple[str, str, int, int, str]],
+    ) -> None:
+        """Inserts receipts, and their counts, in one transaction."""
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.executemany(self._ADD_TO_AGGREGATES, counts)
+            self._connection.executemany(self._INSERT, pairs)
+
+    def _write_each(self) -> None:
+        """Commits the pending receipts one transaction each, dropping those
+        that fail."""
+        counts = {row[4]: row for row in self._pendingCounts}
+        for ID, points in self._pending.items():
+            count = [counts[ID]] if ID in counts else []
+            try:
+                self._write([(ID, points)], count)
+            except sqlite3.OperationalError:
+                raise
+            except (sqlite3.Error, ValueError, OverflowError) as error:
+                log.error(
+                    "Receipt dropped, it cannot be stored",
+                    extra={"id": ID, "points": points, "error": str(error)},
+                )
+
+    @staticmethod
+    def _count_row(receipt: NewReceipt) -> Tuple[str, str, int, int, str]:
+        """The _ADD_TO_AGGREGATES parameters of a receipt, counted in the row
+        of the lower bound of its histogram bucket."""
+        bucket = HISTOGRAM_BUCKETS[bucket_index(receipt.points)]
+        return (
+            receipt.retailer,
+            receipt.purchaseDate,
+            bucket,
+            receipt.points,
+            receipt.ID,
+        )
+
+    def _commit_periodically(self) -> None:
+        with self._lock:
+            while not self._closing:
+                # Shared stores commit as soon as anything is pending
+                self._condition.wait_for(
+                    lambda: self._closing or (self.shared and self._pending),
+                    timeout=self.commitInterval,
+                )
+                try:
+                    self._commit()
+                except sqlite3.Error as error:
+                    # Pending receipts stay pending, and are retried after
+                    # a pause
+                    log.error(
+                        "Receipts failed to commit",
+                        extra={"error": str(error)},
+                    )
+                    self._condition.wait(self.commitInterval)
+
+
+class CompactStore(ReceiptStore):
+    """Keeps receipts in memory in an open-addressing hash table backed by
+    flat arrays. Each slot holds the id as two 64-bit halves of its 128-bit
+    value and the points as a 32-bit unsigned int, 20 bytes in total,
+    instead of a 36 character string key and a boxed int in a dict.
+
+    Ids are uuids, so their bits are already uniformly distributed and are
+    used directly as the hash. A slot is empty when its high half is zero,
+    which no versioned uuid can have. Reads take no lock; writes are
+    serialized and publish a slot by setting its high half last.
+
+    Points must fit the 32-bit slots: put raises ValueError for any outside
+    pointsRange, before storing anything, and ReceiptProcessor refuses
+    receipts that score them."""
+
+    inMemory = True
+    pointsRange = range(2**32)
+
+    def __init__(self, capacity: int = 1024, maxLoad: float = 0.7) -> None:
+        super().__init__()
+        self.maxLoad = maxLoad
+        self._lock = threading.Lock()
+        self._count = 0
+        size = 8
+        while size * maxLoad < capacity:
+            size *= 2
+        self._table = self._empty_table(size)
+
+    def get(self, ID: str) -> Optional[int]:
+        try:
+            key = self._key(ID)
+        except ValueError:
+            return None
+        his, los, points, mask = self._table
+        hi, lo = key >> 64, key & 0xFFFFFFFFFFFFFFFF
+        i = (hi ^ lo) & mask
+        while slotHi := his[i]:
+            if slotHi == hi and los[i] == lo:
+                return points[i]
+            i = (i + 1) & mask
+        return None
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        # One snapshot of the table for the whole lookup
+        his, los, points, mask = self._table
+        results = []
+        for ID in IDs:
+            try:
+                key = self._key(ID)
+            except ValueError:
+                results.append(None)
+                continue
+            hi, lo = key >> 64, key & 0xFFFFFFFFFFFFFFFF
+            i = (hi ^ lo) & mask
+            found = None
+            while slotHi := his[i]:
+                if slotHi == hi and los[i] == lo:
+                    found = points[i]
+                    break
+                i = (i + 1) & mask
+            results.append(found)
+        return results
+
+    def put(self, ID: str, points: int) -> None:
+        key = self._key(ID)
+        self._check_points([points])
+        with self._lock:
+            self._put_key(key, points)
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        keys = [(self._key(ID), points) for ID, points in pairs]
+        self._check_points(points for _, points in keys)
+        with self._lock:
+            for key, points in keys:
+                self._put_key(key, points)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def ids(self) -> Iterator[str]:
+        his, los, _, mask = self._table
+        for i in range(mask + 1):
+            if hi := his[i]:
+                yield str(uuid.UUID(int=(hi << 64) | los[i]))
+
+    def nbytes(self) -> int:
+        """Returns the bytes held by the table's arrays."""
+        his, los, points, _ = self._table
+        return sum(a.itemsize * len(a) for a in (his, los, points))
+
+    def bytes_per_entry(self) -> float:
+        """Returns the table's bytes divided by the number of stored ids."""
+        return self.nbytes() / max(self._count, 1)
+
+    @staticmethod
+    def _key(ID: str) -> int:
+        """Parses a canonical uuid string into its 128-bit value."""
+        if len(ID) != 36 or ID[8] + ID[13] + ID[18] + ID[23] != "----":
+            raise ValueError(f"Not a uuid: {ID!r}")
+        return int(ID[:8] + ID[9:13] + ID[14:18] + ID[19:23] + ID[24:], 16)
+
+    def _put_key(self, key: int, points: int) -> bool:
+        """Stores the points for a 128-bit id, returns False if it was
+        already present. Must be called with the lock held."""
+        if not key >> 64:
+            raise ValueError(f"Not a versioned uuid: {key:032x}")
+        if (self._count + 1) > self.maxLoad * (self._table[3] + 1):
+            self._resize()
+        if self._insert(self._table, key >> 64, key, points):
+            self._count += 1
+            return True
+        return False
+
+    @staticmethod
+    def _empty_table(size: int) -> Tuple[array, array, array, int]:
+        return (
+            array("Q", bytes(8 * size)),
+            array("Q", bytes(8 * size)),
+            array("I", bytes(4 * size)),
+            size - 1,
+        )
+
+    @staticmethod
+    def _insert(table, hi: int, key: int, points: int) -> bool:
+        """Places the pair in the table, returns False if the id was
+        already present."""
+        his, los, pointsArray, mask = table
+        lo = key & 0xFFFFFFFFFFFFFFFF
+        i = (hi ^ lo) & mask
+        while slotHi := his[i]:
+            if slotHi == hi and los[i] == lo:
+                return False
+            i = (i + 1) & mask
+        los[i] = lo
+        pointsArray[i] = points
+        his[i] = hi
+        return True
+
+    def _resize(self) -> None:
+        """Doubles the table. Must be called with the lock held."""
+        his, los, points, mask = self._table
+        table = self._empty_table((mask + 1) * 2)
+        for i in range(mask + 1):
+            if hi := his[i]:
+                self._insert(table, hi, (hi << 64) | los[i], points[i])
+        self._table = table
+
+
+# A log record: the id's 16 uuid bytes and its points, which fit in 32 bits
+# like CompactStore's
+LOG_RECORD = struct.Struct("<16sI")
+# The id of a record that holds the length of a receipt's aggregate fields,
+# which follow it, and then the receipt's own record. No versioned uuid is
+# zero.
+FIELDS_RECORD_ID = bytes(16)
+# A snapshot header: magic, the generation of the first log it does not
+# cover, the number of ids and the number of slots in the table
+SNAPSHOT_HEADER = struct.Struct("<8sQQQ")
+# Snapshots with the table's arrays followed by the aggregates as JSON, and
+# older ones with the arrays alone
+SNAPSHOT_MAGIC = b"RCPTSNP2"
+SNAPSHOT_MAGIC_V1 = b"RCPTSNP1"
+_LOG_NAME = re.compile(r"^receipts\.(\d+)\.log$")
+
+
+class LogStore(CompactStore):
+    """A CompactStore made durable by an append-only log in a directory.
+
+    Every new (id, points) pair is appended to the current log as a 20 byte
+    LOG_RECORD. Records are buffered and written with a single fsync every
+    syncInterval seconds, or once batchSize are pending. As with SQLiteStore,
+    a crash loses at most that window, which is safe to replay because the
+    same receipt always produces the same id and points.
+
+    Once snapshotRecords records have been logged, the table is written as
+    a snapshot: its arrays as they are in memory, behind a SNAPSHOT_HEADER.
+    Logs are numbered by generation. A snapshot records the generation it
+    was taken at, and every log before that generation is deleted once the
+    snapshot is in place. On startup, the latest snapshot is memory-mapped
+    copy-on-write and used as the table directly, so it costs no more than
+    the pages lookups touch. Only the logs from its generation on are
+    replayed, and a record torn by a crash is cut off.
+
+    A receipt stored with put_receipt is logged after a record of the
+    fields it is counted under in the aggregates, and cut off with them if
+    they were torn. Snapshots hold the aggregates after the table."""
+
+    def __init__(
+        self,
+        directory: str,
+        syncInterval: float = 0.05,
+        batchSize: int = 1000,
+        snapshotRecords: int = 1_000_000,
+    ) -> None:
+        super().__init__()
+        self.directory = directory
+        self.syncInterval = syncInterval
+        self.batchSize = batchSize
+        self.snapshotRecords = snapshotRecords
+        self._pending = bytearray()
+        # Records written to the current log
+        self._logged = 0
+        self._closing = False
+        self._condition = threading.Condition(self._lock)
+        # Serializes writes to the log and snapshots
+        self._fileLock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._generation = self._recover()
+        self._log = open(self._log_path(self._generation), "ab")
+
+        self._syncer = threading.Thread(
+            target=self._sync_periodically, daemon=True
+        )
+        self._syncer.start()
+
+    def put(self, ID: str, points: int) -> None:
+        key = self._key(ID)
+        self._check_points([points])
+        with self._lock:
+            if self._put_key(key, points):
+                self._pending += LOG_RECORD.pack(
+                    key.to_bytes(16, "big"), points
+                )
+                self._after_write()
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        keys = [(self._key(ID), points) for ID, points in pairs]
+        self._check_points(points for _, points in keys)
+        with self._lock:
+            for key, points in keys:
+                if self._put_key(key, points):
+                    self._pending += LOG_RECORD.pack(
+                        key.to_bytes(16, "big"), points
+                    )
+            self._after_write()
+
+    def put_receipt(self, receipt: NewReceipt) -> None:
+        self.put_receipts([receipt])
+
+    def put_receipts(self, receipts: Iterable[NewReceipt]) -> None:
+        keys = [(self._key(receipt.ID), receipt) for receipt in receipts]
+        self._check_points(receipt.points for _, receipt in keys)
+        with self._lock:
+            for key, receipt in keys:
+                if not self._put_key(key, receipt.points):
+                    continue
+                if receipt.retailer is not None:
+                    fields = json.dumps(
+                        [receipt.retailer, receipt.purchaseDate]
+                    ).encode()
+                    self._pending += LOG_RECORD.pack(
+                        FIELDS_RECORD_ID, len(fields)
+                    )
+                    self._pending += fields
+                    self.aggregates.add(
+                        receipt.retailer, receipt.purchaseDate, receipt.points
+                    )
+                self._pending += LOG_RECORD.pack(
+                    key.to_bytes(16, "big"), receipt.points
+                )
+            self._after_write()
+
+    def flush(self) -> None:
+        self._sync()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            self._condition.notify_all()
+        self._syncer.join()
+        self._sync()
+        self._log.close()
+
+    def snapshot(self) -> None:
+        """Writes a snapshot of the table and deletes the logs it covers.
+        Writes wait only while the table is copied."""
+        with self._fileLock:
+            with self._lock:
+                data, self._pending = self._pending, bytearray()
+                his, los, points, mask = self._table
+                arrays = [his.tobytes(), los.tobytes(), points.tobytes()]
+                count = self._count
+                aggregates = json.dumps(self.aggregates.rows()).encode()
+            self._write_log(data)
+            self._log.close()
+            self._generation += 1
+            self._logged = 0
+            self._log = open(self._log_path(self._generation), "ab")
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC, self._generation, count, mask + 1
+        )
+        path = self._snapshot_path()
+        with open(path + ".tmp", "wb") as file:
+            file.write(header)
+            for part in arrays:
+                file.write(part)
+            file.write(aggregates)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        self._sync_directory()
+        for generation in self._log_generations():
+            if generation < self._generation:
+                os.remove(self._log_path(generation))
+
+    def _after_write(self) -> None:
+        """Wakes the syncer once a batch is pending. Must be called with the
+        lock held."""
+        if len(self._pending) >= self.batchSize * LOG_RECORD.size:
+            self._condition.notify_all()
+
+    def _sync(self) -> None:
+        """Writes and fsyncs every pending record."""
+        with self._fileLock:
+            with self._lock:
+                data, self._pending = self._pending, bytearray()
+            self._write_log(data)
+
+    def _write_log(self, data: bytes) -> None:
+        """Must be called with the file lock held."""
+        if data:
+            self._log.write(data)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            self._logged += len(data) // LOG_RECORD.size
+
+    def _sync_periodically(self) -> None:
+        while True:
+            with self._lock:
+                self._condition.wait_for(
+                    lambda: self._closing
+                    or len(self._pending)
+                    >= self.batchSize * LOG_RECORD.size,
+                    timeout=self.syncInterval,
+                )
+                if self._closing:
+                    return
+            self._sync()
+            if self._logged >= self.snapshotRecords:
+                self.snapshot()
+
+    def _recover(self) -> int:
+        """Loads the latest snapshot and replays the logs after it. Returns
+        the generation of the log to append to."""
+        generation = 0
+        path = self._snapshot_path()
+        if os.path.exists(path):
+            generation = self._load_snapshot(path)
+        for logGeneration in self._log_generations():
+            if logGeneration < generation:
+                # Left over by a crash before the snapshot's cleanup
+                os.remove(self._log_path(logGeneration))
+            else:
+                self._replay(self._log_path(logGeneration))
+                generation = logGeneration
+        return generation
+
+    def _load_snapshot(self, path: str) -> int:
+        with open(path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, generation, count, size = SNAPSHOT_HEADER.unpack_from(data)
+        if magic not in (SNAPSHOT_MAGIC, SNAPSHOT_MAGIC_V1) or (
+            size & (size - 1)
+        ):
+            raise ValueError(f"Not a receipts snapshot: {path}")
+        start = SNAPSHOT_HEADER.size
+        end = start + 20 * size
+        if len(data) < end or magic == SNAPSHOT_MAGIC_V1 and (
+            len(data) != end
+        ):
+            raise ValueError(f"Truncated receipts snapshot: {path}")
+        view = memoryview(data)
+        his = view[start:start + 8 * size].cast("Q")
+        los = view[start + 8 * size:start + 16 * size].cast("Q")
+        points = view[start + 16 * size:end].cast("I")
+        self._table = (his, los, points, size - 1)
+        self._count = count
+        if magic == SNAPSHOT_MAGIC:
+            self.aggregates.add_rows(
+                AggregateRow(*row[:4], tuple(row[4]))
+                for row in json.loads(bytes(view[end:]))
+            )
+        return generation
+
+    def _replay(self, path: str) -> None:
+        with open(path, "r+b") as file:
+            data = file.read()
+            whole = self._replay_records(data)
+            if whole != len(data):
+                # The last receipt was torn by a crash and is lost
+                file.truncate(whole)
+
+    def _replay_records(self, data: bytes) -> int:
+        """Stores the receipts logged in data, and counts those logged with
+        their fields. Returns the length of the receipts that are whole."""
+        size = LOG_RECORD.size
+        unpack = LOG_RECORD.unpack_from
+        position = 0
+        while position + size <= len(data):
+            ID, points = unpack(data, position)
+            end = position + size
+            fields = None
+            if ID == FIELDS_RECORD_ID:
+                # points is the length of the fields
+                fields = data[end:end + points]
+                end += points + size
+                if end > len(data):
+                    break
+                ID, points = unpack(data, end - size)
+            new = self._put_key(int.from_bytes(ID, "big"), points)
+            if new and fields is not None:
+                retailer, purchaseDate = json.loads(fields)
+                self.aggregates.add(retailer, purchaseDate, points)
+            position = end
+        return position
+
+    def _log_generations(self) -> List[int]:
+        return sorted(
+            int(match.group(1))
+            for name in os.listdir(self.directory)
+            if (match := _LOG_NAME.match(name))
+        )
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"receipts.{generation}.log")
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, "receipts.snapshot")
+
+    def _sync_directory(self) -> None:
+        """Makes the snapshot's rename durable."""
+        descriptor = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(descriptor)
+        finally:
+            os.close(descriptor)
+
+
+class FilteredStore(ReceiptStore):
+    """Puts a Bloom filter of the stored ids in front of another store, so
+    that lookups of unknown ids are answered in constant time without
+    touching it, except for the errorRate of them that are false
+    positives. Every write must go through this object, so shared stores,
+    written to by other processes as well, cannot be filtered.
+
+    The filter is filled from the store's ids when it is opened, and grows
+    with it (see GrowingBloomFilter). Filtered lookups and false positives
+    are counted in the receipt_id_lookups_total metric."""
+
+    def __init__(
+        self,
+        store: ReceiptStore,
+        errorRate: float = 0.01,
+        capacity: int = 1 << 20,
+    ) -> None:
+        if store.shared:
+            raise ValueError("A shared store cannot be filtered")
+        self.store = store
+        self.pointsRange = store.pointsRange
+        self.forgets = store.forgets
+        self.filter = GrowingBloomFilter(
+            max(capacity, 2 * len(store)), errorRate
+        )
+        for ID in store.ids():
+            self.filter.add(ID)
+
+    def get(self, ID: str) -> Optional[int]:
+        if not self._maybe_stored(ID):
+            return None
+        points = self.store.get(ID)
+        if points is None:
+            ID_LOOKUPS.inc("false_positive")
+        return points
+
+    def get_many(self, IDs: Sequence[str]) -> List[Optional[int]]:
+        candidates = [ID for ID in IDs if self._maybe_stored(ID)]
+        found = dict(zip(candidates, self.store.get_many(candidates)))
+        falsePositives = sum(points is None for points in found.values())
+        if falsePositives:
+            ID_LOOKUPS.inc("false_positive", amount=falsePositives)
+        return [found.get(ID) for ID in IDs]
+
+    def put(self, ID: str, points: int) -> None:
+        # The filter first, so that a lookup never misses a stored id
+        self.filter.add(ID)
+        self.store.put(ID, points)
+
+    def put_many(self, pairs: Iterable[Tuple[str, int]]) -> None:
+        pairs = list(pairs)
+        for ID, _ in pairs:
+            self.filter.add(ID)
+        self.store.put_many(pairs)
+
+    def put_receipt(self, receipt: NewReceipt) -> None:
+        self.filter.add(receipt.ID)
+        self.store.put_receipt(receipt)
+
+    def put_receipts(self, receipts: Iterable[NewReceipt]) -> None:
+        receipts = list(receipts)
+        for receipt in receipts:
+            self.filter.add(receipt.ID)
+        self.store.put_receipts(receipts)
+
+    def aggregate_rows(
+        self,
+        retailer: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+    ) -> List[AggregateRow]:
+        return self.store.aggregate_rows(retailer, start, end)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def ids(self) -> Iterator[str]:
+        return self.store.ids()
+
+    def flush(self) -> None:
+        self.store.flush()
+
+    def close(self) -> None:
+        self.store.close()
+
+    def false_positive_rate(self) -> float:
+        """The estimated share of unknown ids that reach the store."""
+        return self.filter.false_positive_rate()
+
+    def _maybe_stored(self, ID: str) -> bool:
+        if ID in self.filter:
+            return True
+        ID_LOOKUPS.inc("filtered")
+        return False
+
+
+def open_store(url: str) -> ReceiptStore:
+    """Opens a store from a url: "memory" for an in-memory store, "compact"
+    for a memory-compact in-memory store, or "sqlite:///path/to/receipts.db"
+    for a SQLite store, or "log:///path/to/directory" for a LogStore. Append
+    "?shared=1" to a SQLite url when several processes use the same
+    database. A memory url with any of max_entries,
+    max_bytes or ttl (seconds), e.g. "memory?max_entries=1000000&ttl=86400",
+    opens a BoundedStore."""
+    if url == "memory":
+        return MemoryStore()
+    if url.startswith("memory?"):
+        query = parse_qs(url[len("memory?"):], strict_parsing=True)
+        unknown = set(query) - {"max_entries", "max_bytes", "ttl"}
+        if unknown:
+            raise ValueError(f"Unknown receipt store options: {url!r}")
+        return BoundedStore(
+            maxEntries=int(query.get("max_entries", ["0"])[0]),
+            maxBytes=int(query.get("max_bytes", ["0"])[0]),
+            ttl=float(query.get("ttl", ["0"])[0]),
+        )
+    if url == "compact":
+        return CompactStore()
+    if url.startswith("log:///"):
+        return LogStore(url[len("log:///"):])
+    if url.startswith("sqlite:///"):
+        path, _, query = url[len("sqlite:///"):].partition("?")
+        shared = parse_qs(query).get("shared") == ["1"]
+        return SQLiteStore(path, shared=shared)
+    raise ValueError(f"Unknown receipt store: {url!r}")
@@ -0,0 +1,410 @@
+"""Reads a single receipt from a stream of its JSON, for bodies too large
+to buffer and parse whole.
+
+read_receipt reads the body a chunk at a time and checks each field, and
+each item, as soon as it has been decoded. Items are scored and fed to the
+id's hash ITEMS_PER_CHUNK at a time and then dropped, so memory is bounded
+by the largest single value rather than by the receipt. After the first
+violation of the API contract the rest of the body is only read through,
+not checked, since a repeated field may still replace the one at fault.
+Ids, points and the receipts accepted are the ones
+ReceiptProcessor.process_receipt gives for the parsed receipt.
+
+The id hashes the receipt's fields in sorted order, in which items come
+first among the contract's fields. Two receipts cannot be hashed as they
+are read: one with a repeated field, which json.loads resolves to the
+last value, and one with a field outside the contract whose name sorts
+before "items" but comes after it. The body is kept in a spooled file as
+it is read, in memory up to SPOOL_BYTES and on disk beyond, so that these
+are parsed whole from it instead."""
+
+import codecs
+import json
+import os
+import re
+import tempfile
+from json.encoder import encode_basestring_ascii
+from typing import (
+    IO,
+    Any,
+    Callable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from .canonical import ITEMS_PER_CHUNK, canonical_item, id_from_hash
+from .canonical import new_id_hash, receipt_id
+from .validator import ParsedReceipt, ReceiptValidator, Violation
+
+READ_SIZE = 1 << 16
+# Largest copy of a body kept in memory for parsing it whole, see _Unhashable
+SPOOL_BYTES = 1 << 20
+# Limits of a streamed receipt, past which it is refused as too large
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 16 * 1024 * 1024))
+MAX_ITEMS = int(os.environ.get("MAX_RECEIPT_ITEMS", 100_000))
+
+# The contract's fields other than items
+SCALAR_FIELDS = ("retailer", "purchaseDate", "purchaseTime", "total")
+WHITESPACE = " \t\n\r"
+# The separator after an array element, and the whitespace around it
+_SEPARATOR = re.compile(r"[ \t\n\r]*([,\]])[ \t\n\r]*")
+
+# A receipt with no items and no receipt-level points, that item chunks
+# are scored on, see _item_points
+_NO_ITEMS = ParsedReceipt("", 0, 0, 0, [])
+
+
+class ReceiptTooLargeError(ValueError):
+    """Raised when a streamed receipt goes past the body or item limit."""
+
+
+class _Unhashable(Exception):
+    """Raised when a receipt's fields come in an order its id cannot be
+    hashed in as they are read."""
+
+
+class StreamedReceipt(NamedTuple):
+    """The outcome of read_receipt: the id, points and aggregate fields of
+    a valid receipt, or the violation that stopped the read."""
+
+    ID: Optional[str]
+    points: Optional[int]
+    violations: List[Violation]
+    retailer: Optional[str] = None
+    purchaseDate: Optional[str] = None
+
+
+class _JSONReader:
+    """Decodes JSON values one at a time from a binary stream, keeping only
+    the unread part of the body in memory. Every byte read is also written
+    to spool."""
+
+    def __init__(
+        self, stream: IO[bytes], maxBytes: int, spool: IO[bytes]
+    ) -> None:
+        self._stream = stream
+        self._spool = spool
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+        self._decoder = json.JSONDecoder()
+        self.maxBytes = maxBytes
+        self.bytesRead = 0
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self, size: int = READ_SIZE) -> bool:
+        """Reads up to size more bytes. Returns False at the end of the
+        stream."""
+        if self.eof:
+            return False
+        chunk = self._read(size)
+        text = self._decode(chunk, final=self.eof)
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return not self.eof
+
+    def drain(self) -> None:
+        """Reads the rest of the stream into the spool, undecoded."""
+        while not self.eof:
+            self._read(READ_SIZE)
+
+    def _read(self, size: int) -> bytes:
+        chunk = self._stream.read(size)
+        self.bytesRead += len(chunk)
+        if self.bytesRead > self.maxBytes:
+            raise ReceiptTooLargeError(
+                f"The receipt is larger than {self.maxBytes} bytes"
+            )
+        self._spool.write(chunk)
+        self.eof = not chunk
+        return chunk
+
+    def peek(self) -> str:
+        """Skips whitespace and returns the next character, or "" at the
+        end of the stream."""
+        while True:
+            buffer, position = self.buffer, self.position
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            self.position = position
+            if position < len(buffer):
+                return buffer[position]
+            if not self.fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        """Consumes the next character, which must be one of characters,
+        and returns it."""
+        character = self.peek()
+        if not character or character not in characters:
+            raise self.error(f"Expecting one of {characters!r}")
+        self.position += 1
+        return character
+
+    def error(self, message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, self.buffer, self.position)
+
+    def value(self) -> Any:
+        """Decodes the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self.buffer, self.position
+                )
+                # A value that ends the buffer may continue in the next read
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Reading as much again as is pending keeps long values to a
+            # logarithmic number of attempts
+            self.fill(max(READ_SIZE, len(self.buffer) - self.position))
+
+    def elements(self) -> Iterator[Tuple[Any, bool]]:
+        """Yields each element of the non-empty array whose "[" was just
+        consumed, and whether it is the last one.
+
+        Elements that lie whole in the buffer with their separator are
+        decoded without the checks of value and expect, which only run
+        where the buffer ends."""
+        scan = self._decoder.scan_once
+        separator = _SEPARATOR.match
+        self.peek()
+        while True:
+            try:
+                value, end = scan(self.buffer, self.position)
+                match = separator(self.buffer, end)
+            except (StopIteration, json.JSONDecodeError):
+                match = None
+            if match is None:
+                value = self.value()
+                last = self.expect(",]") == "]"
+                self.peek()
+            else:
+                self.position = match.end()
+                last = match.group(1) == "]"
+            yield value, last
+            if last:
+                return
+
+
+def read_receipt(
+    stream: IO[bytes],
+    validator: ReceiptValidator,
+    score: Callable[[ParsedReceipt], int],
+    maxBytes: int = MAX_BODY_BYTES,
+    maxItems: int = MAX_ITEMS,
+) -> StreamedReceipt:
+    """Reads, checks and scores the receipt whose JSON the stream holds,
+    with score. Returns its id and points, or the first violation found,
+    and raises ReceiptTooLargeError once more than maxBytes bytes or
+    maxItems items have been read."""
+    with tempfile.SpooledTemporaryFile(SPOOL_BYTES) as spool:
+        reader = _JSONReader(stream, maxBytes, spool)
+        try:
+            return _read_object(reader, validator, score, maxItems)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return _invalid("$", "must be valid JSON")
+        except _Unhashable:
+            reader.drain()
+        spool.seek(0)
+        return _read_whole(spool.read(), validator, score, maxItems)
+
+
+def _read_whole(
+    body: bytes,
+    validator: ReceiptValidator,
+    score: Callable[[ParsedReceipt], int],
+    maxItems: int,
+) -> StreamedReceipt:
+    """Parses, checks and scores a receipt's whole body, as
+    ReceiptProcessor.process_receipt does."""
+    try:
+        receipt = json.loads(body)
+    except ValueError:
+        return _invalid("$", "must be valid JSON")
+    items = receipt.get("items") if isinstance(receipt, dict) else None
+    if isinstance(items, list) and len(items) > maxItems:
+        raise ReceiptTooLargeError(
+            f"The receipt has more than {maxItems} items"
+        )
+    parsed, violations = validator.check(receipt)
+    if violations:
+        return StreamedReceipt(None, None, violations)
+    return StreamedReceipt(
+        receipt_id(receipt),
+        score(parsed),
+        [],
+        receipt["retailer"],
+        receipt["purchaseDate"],
+    )
+
+
+def _invalid(path: str, message: str) -> StreamedReceipt:
+    return StreamedReceipt(None, None, [Violation(path, message)])
+
+
+def _read_object(
+    reader: _JSONReader,
+    validator: ReceiptValidator,
+    score: Callable[[ParsedReceipt], int],
+    maxItems: int,
+) -> StreamedReceipt:
+    encode = encode_basestring_ascii
+    if reader.peek() != "{":
+        return _invalid("$", "must be an object")
+    reader.position += 1
+
+    parsed = {}
+    purchaseDate = None
+    # (name, "name": value) of the fields to hash before and after items
+    before: List[Tuple[str, str]] = []
+    after: List[Tuple[str, str]] = []
+    seen = set()
+    sha = None
+    points = 0
+    # The first violation found; the fields after it are only read
+    violation = None
+    if reader.peek() == "}":
+        reader.position += 1
+    else:
+        while True:
+            if reader.peek() != '"':
+                raise reader.error("Expecting property name")
+            name = reader.value()
+            reader.expect(":")
+            if name in seen:
+                raise _Unhashable(name)
+            seen.add(name)
+            if violation is not None:
+                _skip_value(reader)
+            elif name == "items":
+                sha = new_id_hash()
+                sha.update(
+                    "".join(
+                        ["{"] + [field + ", " for _, field in sorted(before)]
+                    ).encode("ascii")
+                )
+                itemPoints, violation = _read_items(
+                    reader, validator, score, maxItems, sha
+                )
+                points += itemPoints
+            else:
+                value = reader.value()
+                if name in SCALAR_FIELDS:
+                    parsed[name], violation = validator.check_field(
+                        name, value
+                    )
+                    if name == "purchaseDate":
+                        purchaseDate = value
+                field = encode(name) + ": " + json.dumps(value, sort_keys=True)
+                if name > "items":
+                    after.append((name, field))
+                elif sha is None:
+                    before.append((name, field))
+                else:
+                    raise _Unhashable(name)
+            if reader.expect(",}") == "}":
+                break
+    if reader.peek():
+        raise reader.error("Extra data")
+    if violation is not None:
+        return StreamedReceipt(None, None, [violation])
+
+    for name in SCALAR_FIELDS:
+        if name not in parsed:
+            return _invalid(f"$.{name}", "is required")
+    if sha is None:
+        return _invalid("$.items", "must be a non-empty array")
+
+    sha.update(
+        ("]" + "".join(", " + field for _, field in sorted(after)) + "}")
+        .encode("ascii")
+    )
+    points += score(
+        ParsedReceipt(
+            parsed["retailer"],
+            parsed["purchaseDate"],
+            parsed["purchaseTime"],
+            parsed["total"],
+            [],
+        )
+    )
+    return StreamedReceipt(
+        id_from_hash(sha), points, [], parsed["retailer"], purchaseDate
+    )
+
+
+def _skip_value(reader: _JSONReader) -> None:
+    """Reads past the next value. Arrays are read an element at a time, so
+    that skipping items takes no more memory than checking them."""
+    if reader.peek() != "[":
+        reader.value()
+        return
+    reader.position += 1
+    if reader.peek() == "]":
+        reader.position += 1
+        return
+    for _ in reader.elements():
+        pass
+
+
+def _read_items(
+    reader: _JSONReader,
+    validator: ReceiptValidator,
+    score: Callable[[ParsedReceipt], int],
+    maxItems: int,
+    sha: Any,
+) -> Tuple[int, Optional[Violation]]:
+    """Reads the items array, hashing its canonical encoding into sha.
+    Returns the points the items add, or the first violation found, after
+    which the array is only read through."""
+    if reader.peek() != "[":
+        reader.value()
+        return 0, Violation("$.items", "must be a non-empty array")
+    reader.position += 1
+    if reader.peek() == "]":
+        reader.position += 1
+        return 0, Violation("$.items", "must be a non-empty array")
+    sha.update(b'"items": [')
+
+    points = 0
+    violation = None
+    chunk: List[Tuple[str, int]] = []
+    encoded: List[str] = []
+    checkItem = validator.check_item
+    for index, (item, last) in enumerate(reader.elements()):
+        if index == maxItems:
+            raise ReceiptTooLargeError(
+                f"The receipt has more than {maxItems} items"
+            )
+        if violation is not None:
+            continue
+        parsedItem, violation = checkItem(item, index)
+        if violation is not None:
+            continue
+        chunk.append(parsedItem)
+        encoded.append(canonical_item(item))
+        if len(chunk) == ITEMS_PER_CHUNK or last:
+            separator = ", " if index >= len(chunk) else ""
+            sha.update((separator + ", ".join(encoded)).encode("ascii"))
+            points += _item_points(score, chunk)
+            chunk, encoded = [], []
+    if violation is not None:
+        return 0, violation
+    return points, None
+
+
+def _item_points(
+    score: Callable[[ParsedReceipt], int], items: List[Tuple[str, int]]
+) -> int:
+    """The points a run of items adds to a receipt. Item rules only look at
+    the items, so that is what they add to a receipt with none; runs are
+    ITEMS_PER_CHUNK long, an even number, so pairs never straddle two."""
+    return score(_NO_ITEMS._replace(items=items)) - score(_NO_ITEMS)
@@ -0,0 +1,346 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .money import parse_cents
+
+REGEX = {
+    "retailer": "^[\\w\\s\\-&]+$",
+    "total": "^\\d+\\.\\d{2}$",
+    "desc": "^[\\w\\s\\-]+$",
+    "price": "^\\d+\\.\\d{2}$",
+}
+
+# Days in each month of a non-leap year, index 0 is unused
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class Violation(NamedTuple):
+    """A single breach of the API contract, located by its JSON path."""
+
+    path: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path}: {self.message}"
+
+
+class ParsedReceipt(NamedTuple):
+    """The fields of a valid receipt, converted once during validation into
+    the values the point rules work on."""
+
+    retailer: str
+    # Day of the month of purchaseDate
+    day: int
+    # Minutes since midnight of purchaseTime
+    minute: int
+    # Total in integer cents
+    total: int
+    # (shortDescription, price in integer cents) for every item
+    items: List[Tuple[str, int]]
+
+
+def parse_date(value: str) -> Optional[Tuple[int, int, int]]:
+    """Parses a fixed-width ISO 8601 date (YYYY-MM-DD) into a
+    (year, month, day) tuple. Returns None if the date is malformed or
+    does not exist."""
+    if len(value) != 10 or value[4] != "-" or value[7] != "-":
+        return None
+    digits = value[:4] + value[5:7] + value[8:]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    year, month, day = int(digits[:4]), int(digits[4:6]), int(digits[6:])
+    if year < 1 or not 1 <= month <= 12 or day < 1:
+        return None
+    if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return (year, month, day) if day <= 29 else None
+    return (year, month, day) if day <= DAYS_IN_MONTH[month] else None
+
+
+def parse_time(value: str) -> Optional[Tuple[int, int]]:
+    """Parses a fixed-width ISO 8601 time (HH:MM) into an (hour, minute)
+    tuple. Returns None if the time is malformed or out of range."""
+    if len(value) != 5 or value[2] != ":":
+        return None
+    digits = value[:2] + value[3:]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    hour, minute = int(digits[:2]), int(digits[2:])
+    if hour > 23 or minute > 59:
+        return None
+    return (hour, minute)
+
+
+class ReceiptValidator:
+    """Validates receipts against the provided API contract. Patterns are
+    compiled once, when the validator is built, and a receipt is checked in
+    a single walk that collects every violation rather than stopping at the
+    first one."""
+
+    def __init__(self, regex: Dict[str, str] = REGEX) -> None:
+        self._patterns = {
+            field: re.compile(pattern) for field, pattern in regex.items()
+        }
+        self._retailer = self._patterns["retailer"].match
+        self._total = self._patterns["total"].match
+        self._desc = self._patterns["desc"].match
+        self._price = self._patterns["price"].match
+
+    def is_valid(self, receipt: Any) -> bool:
+        """Returns True if the receipt satisfies the API contract."""
+        return not self.check(receipt)[1]
+
+    def validate(self, receipt: Any) -> List[Violation]:
+        """Returns every violation of the API contract found in the receipt.
+        An empty list means the receipt is valid."""
+        return self.check(receipt)[1]
+
+    def check(
+        self, receipt: Any
+    ) -> Tuple[Optional[ParsedReceipt], List[Violation]]:
+        """Validates the receipt and, in the same walk, parses it. Returns
+        the parsed receipt (None if there were violations) and every
+        violation of the API contract that was found."""
+        if not isinstance(receipt, dict):
+            return None, [Violation("$", "must be an object")]
+
+        violations = []
+        get = receipt.get
+
+        retailer = get("retailer")
+        if not isinstance(retailer, str):
+            violations.append(self._type_violation("$.retailer", retailer))
+        elif not self._retailer(retailer):
+            violations.append(
+                self._pattern_violation("retailer", "$.retailer")
+            )
+
+        purchaseDate = get("purchaseDate")
+        if not isinstance(purchaseDate, str):
+            violations.append(
+                self._type_violation("$.purchaseDate", purchaseDate)
+            )
+        elif (date := parse_date(purchaseDate)) is None:
+            violations.append(
+                Violation("$.purchaseDate", "must be a valid YYYY-MM-DD date")
+            )
+
+        purchaseTime = get("purchaseTime")
+        if not isinstance(purchaseTime, str):
+            violations.append(
+                self._type_violation("$.purchaseTime", purchaseTime)
+            )
+        elif (time := parse_time(purchaseTime)) is None:
+            violations.append(
+                Violation("$.purchaseTime", "must be a valid HH:MM time")
+            )
+
+        items = get("items")
+        parsedItems = []
+        if not isinstance(items, list) or not items:
+            violations.append(
+                Violation("$.items", "must be a non-empty array")
+            )
+        else:
+            descMatch, priceMatch = self._desc, self._price
+            append = parsedItems.append
+            for i, item in enumerate(items):
+                # Fast path for well-formed items, paths are only built for
+                # items that break the contract
+                if (
+                    isinstance(item, dict)
+                    and isinstance(desc := item.get("shortDescription"), str)
+                    and isinstance(price := item.get("price"), str)
+                    and descMatch(desc)
+                    and priceMatch(price)
+                ):
+                    append((desc, parse_cents(price)))
+                    continue
+                self._validate_item(item, f"$.items[{i}]", violations)
+
+        total = get("total")
+        if not isinstance(total, str):
+            violations.append(self._type_violation("$.total", total))
+        elif not self._total(total):
+            violations.append(self._pattern_violation("total", "$.total"))
+
+        if violations:
+            return None, violations
+        return (
+            ParsedReceipt(
+                retailer,
+                date[2],
+                time[0] * 60 + time[1],
+                parse_cents(total),
+                parsedItems,
+            ),
+            violations,
+        )
+
+    def check_many(
+        self, receipts: List[Any]
+    ) -> List[Tuple[Optional[ParsedReceipt], List[Violation]]]:
+        """check for every receipt of a batch. Each distinct retailer,
+        date, time, amount and description is checked and parsed once per
+        batch, since batches repeat them far more than they repeat whole
+        receipts. Receipts with a violation are checked again by check, to
+        report all of them."""
+        retailers: Dict[str, bool] = {}
+        days: Dict[str, Optional[int]] = {}
+        minutes: Dict[str, Optional[int]] = {}
+        cents: Dict[str, Optional[int]] = {}
+        descs: Dict[str, bool] = {}
+        results = []
+        for receipt in receipts:
+            parsed = None
+            if type(receipt) is dict:
+                parsed = self._parse_memoized(
+                    receipt, retailers, days, minutes, cents, descs
+                )
+            results.append(
+                (parsed, []) if parsed is not None else self.check(receipt)
+            )
+        return results
+
+    def _parse_memoized(
+        self,
+        receipt: Dict[str, Any],
+        retailers: Dict[str, bool],
+        days: Dict[str, Optional[int]],
+        minutes: Dict[str, Optional[int]],
+        cents: Dict[str, Optional[int]],
+        descs: Dict[str, bool],
+    ) -> Optional[ParsedReceipt]:
+        """The parsed receipt, or None if it breaks the contract, with each
+        field's outcome looked up in, or added to, the batch's memos."""
+        get = receipt.get
+        retailer = get("retailer")
+        purchaseDate = get("purchaseDate")
+        purchaseTime = get("purchaseTime")
+        total = get("total")
+        items = get("items")
+        if (
+            type(retailer) is not str
+            or type(purchaseDate) is not str
+            or type(purchaseTime) is not str
+            or type(total) is not str
+            or type(items) is not list
+            or not items
+        ):
+            return None
+
+        if (valid := retailers.get(retailer)) is None:
+            valid = retailers[retailer] = bool(self._retailer(retailer))
+        if (day := days.get(purchaseDate, False)) is False:
+            date = parse_date(purchaseDate)
+            day = days[purchaseDate] = date[2] if date else None
+        if (minute := minutes.get(purchaseTime, False)) is False:
+            time = parse_time(purchaseTime)
+            minute = minutes[purchaseTime] = (
+                time[0] * 60 + time[1] if time else None
+            )
+        if (totalCents := cents.get(total, False)) is False:
+            totalCents = cents[total] = (
+                parse_cents(total) if self._total(total) else None
+            )
+        if not valid or day is None or minute is None or totalCents is None:
+            return None
+
+        parsedItems = []
+        append = parsedItems.append
+        descMatch, priceMatch = self._desc, self._price
+        for item in items:
+            if (
+                type(item) is not dict
+                or type(desc := item.get("shortDescription")) is not str
+                or type(price := item.get("price")) is not str
+            ):
+                return None
+            if (validDesc := descs.get(desc)) is None:
+                validDesc = descs[desc] = bool(descMatch(desc))
+            if (priceCents := cents.get(price, False)) is False:
+                priceCents = cents[price] = (
+                    parse_cents(price) if priceMatch(price) else None
+                )
+            if not validDesc or priceCents is None:
+                return None
+            append((desc, priceCents))
+        return ParsedReceipt(retailer, day, minute, totalCents, parsedItems)
+
+    def check_field(
+        self, field: str, value: Any
+    ) -> Tuple[Any, Optional[Violation]]:
+        """Checks one of the receipt's string fields (retailer, total,
+        purchaseDate or purchaseTime) on its own, for receipts read a field
+        at a time. Returns the field's value as ParsedReceipt holds it, or
+        the violation it breaks."""
+        path = f"$.{field}"
+        if not isinstance(value, str):
+            return None, self._type_violation(path, value)
+        if field == "retailer":
+            if self._retailer(value):
+                return value, None
+            return None, self._pattern_violation("retailer", path)
+        if field == "total":
+            if self._total(value):
+                return parse_cents(value), None
+            return None, self._pattern_violation("total", path)
+        if field == "purchaseDate":
+            if (date := parse_date(value)) is not None:
+                return date[2], None
+            return None, Violation(path, "must be a valid YYYY-MM-DD date")
+        if (time := parse_time(value)) is not None:
+            return time[0] * 60 + time[1], None
+        return None, Violation(path, "must be a valid HH:MM time")
+
+    def check_item(
+        self, item: Any, index: int
+    ) -> Tuple[Optional[Tuple[str, int]], Optional[Violation]]:
+        """Checks the item at index on its own. Returns it as ParsedReceipt
+        holds it, or the first violation it breaks."""
+        if (
+            isinstance(item, dict)
+            and isinstance(desc := item.get("shortDescription"), str)
+            and isinstance(price := item.get("price"), str)
+            and self._desc(desc)
+            and self._price(price)
+        ):
+            return (desc, parse_cents(price)), None
+        violations: List[Violation] = []
+        self._validate_item(item, f"$.items[{index}]", violations)
+        return None, violations[0]
+
+    def _validate_item(
+        self, item: Any, path: str, violations: List[Violation]
+    ) -> None:
+        """Appends the violations found in a single item."""
+        if not isinstance(item, dict):
+            violations.append(Violation(path, "must be an object"))
+            return
+
+        desc = item.get("shortDescription")
+        if not isinstance(desc, str):
+            violations.append(
+                self._type_violation(f"{path}.shortDescription", desc)
+            )
+        elif not self._desc(desc):
+            violations.append(
+                self._pattern_violation("desc", f"{path}.shortDescription")
+            )
+
+        price = item.get("price")
+        if not isinstance(price, str):
+            violations.append(self._type_violation(f"{path}.price", price))
+        elif not self._price(price):
+            violations.append(
+                self._pattern_violation("price", f"{path}.price")
+            )
+
+    def _type_violation(self, path: str, value: Any) -> Violation:
+        if value is None:
+            return Violation(path, "is required")
+        return Violation(path, "must be a string")
+
+    def _pattern_violation(self, field: str, path: str) -> Violation:
+        return Violation(
+            path, f"must match {self._patterns[field].pattern}"
+        )
@@ -0,0 +1,129 @@
+"""Tests the points aggregates kept as receipts are stored."""
+
+import io
+import json
+
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.aggregates import (
+    HISTOGRAM_BUCKETS,
+    AggregateRow,
+    Aggregates,
+    bucket_index,
+    points_histogram,
+    top_retailers,
+)
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [{"shortDescription": "Pepsi - 12-oz", "price": "1.25"}],
+    "total": "1.25",
+}
+
+
+def receipt(retailer="Target", purchaseDate="2022-01-01", total="1.25"):
+    return {
+        **RECEIPT,
+        "retailer": retailer,
+        "purchaseDate": purchaseDate,
+        "total": total,
+    }
+
+
+@pytest.mark.parametrize(
+    "points, index",
+    [
+        pytest.param(0, 0, id="zero"),
+        pytest.param(9, 0, id="below second bound"),
+        pytest.param(10, 1, id="second bound"),
+        pytest.param(1999, len(HISTOGRAM_BUCKETS) - 2, id="below last"),
+        pytest.param(10**9, len(HISTOGRAM_BUCKETS) - 1, id="open-ended"),
+        pytest.param(-5, 0, id="negative"),
+    ],
+)
+def test_bucket_index(points, index):
+    assert bucket_index(points) == index
+
+
+def test_aggregates_add_and_filter():
+    aggregates = Aggregates()
+    aggregates.add("Target", "2022-01-01", 12)
+    aggregates.add("Target", "2022-01-01", 30)
+    aggregates.add("Target", "2022-01-02", 5)
+    aggregates.add("Walgreens", "2022-01-01", 300)
+    rows = {
+        (row.retailer, row.purchaseDate): row for row in aggregates.rows()
+    }
+    target = rows["Target", "2022-01-01"]
+    assert (target.receipts, target.points) == (2, 42)
+    assert target.histogram[bucket_index(12)] == 1
+    assert target.histogram[bucket_index(30)] == 1
+    assert sum(target.histogram) == 2
+
+    assert len(aggregates.rows(retailer="Target")) == 2
+    later = aggregates.rows(start="2022-01-02")
+    assert [row.purchaseDate for row in later] == ["2022-01-02"]
+    assert len(aggregates.rows(end="2022-01-01")) == 2
+    assert aggregates.rows(retailer="Target", end="2021-12-31") == []
+
+
+def test_aggregates_add_rows():
+    aggregates = Aggregates()
+    aggregates.add("Target", "2022-01-01", 12)
+    aggregates.add_rows(aggregates.rows())
+    [row] = aggregates.rows()
+    assert (row.receipts, row.points, sum(row.histogram)) == (2, 24, 2)
+
+
+def test_top_retailers_and_histogram():
+    empty = (0,) * len(HISTOGRAM_BUCKETS)
+    rows = [
+        AggregateRow("Target", "2022-01-01", 2, 40, empty),
+        AggregateRow("Target", "2022-01-02", 1, 20, empty),
+        AggregateRow("Walgreens", "2022-01-01", 5, 60, empty),
+        AggregateRow("Aldi", "2022-01-01", 1, 60, (1,) + empty[1:]),
+    ]
+    assert top_retailers(rows, 2) == [
+        ("Aldi", 1, 60),
+        ("Target", 3, 60),
+    ]
+    assert top_retailers(rows, 10)[-1] == ("Walgreens", 5, 60)
+    assert points_histogram(rows) == [1] + [0] * (len(HISTOGRAM_BUCKETS) - 1)
+
+
+def totals(processor, **filters):
+    return {
+        (row.retailer, row.purchaseDate): (row.receipts, row.points)
+        for row in processor.aggregates(**filters)
+    }
+
+
+def test_processor_counts_new_receipts_once():
+    processor = ReceiptProcessor()
+    ID = processor.process_receipt(receipt())
+    points = processor.get_points(ID)
+    processor.process_receipt(receipt())
+    processor.process_receipts([receipt(), receipt(), receipt("Aldi")])
+    aldi = processor.get_points(processor.process_receipt(receipt("Aldi")))
+    assert totals(processor) == {
+        ("Target", "2022-01-01"): (1, points),
+        ("Aldi", "2022-01-01"): (1, aldi),
+    }
+    assert totals(processor, retailer="Aldi") == {
+        ("Aldi", "2022-01-01"): (1, aldi)
+    }
+
+
+def test_processor_counts_batches_and_streams():
+    processor = ReceiptProcessor()
+    IDs, _ = processor.process_receipts(
+        [receipt(purchaseDate=f"2022-01-0{day}") for day in (1, 2, 2)]
+    )
+    processor.process_stream(
+        io.BytesIO(json.dumps(receipt(total="2.00")).encode())
+    )
+    counts = totals(processor)
+    assert counts["Target", "2022-01-01"][0] == 2
+    assert counts["Target", "2022-01-02"] == (1, processor.get_points(IDs[1]))
@@ -0,0 +1,295 @@
+"""Tests the asyncio server against the responses of the Flask app."""
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import async_host
+import pytest
+from async_host import AsyncReceiptServer
+from host import app
+from receipt_processor import ReceiptProcessor
+from receipt_processor.store import open_store
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [{"shortDescription": "Mountain Dew 12PK", "price": "6.49"}],
+    "total": "6.49",
+}
+
+
+def request(method, path, body=b"", headers=None, close=False):
+    headers = {
+        "Host": "test",
+        "Content-Length": str(len(body)),
+        **({"Content-Type": "application/json"} if body else {}),
+        **(headers or {}),
+    }
+    if close:
+        headers["Connection"] = "close"
+    head = f"{method} {path} HTTP/1.1\r\n" + "".join(
+        f"{name}: {value}\r\n" for name, value in headers.items()
+    )
+    return head.encode() + b"\r\n" + body
+
+
+async def read_response(reader):
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    statusLine, *lines = head.strip().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines)
+    body = await reader.readexactly(int(headers.get("Content-Length", 0)))
+    return int(statusLine.split()[1]), headers, body
+
+
+def run(scenario, receiptProcessor=None, **kwargs):
+    """Runs scenario(reader, writer) against a server on a free port."""
+
+    async def main():
+        server = AsyncReceiptServer(
+            receiptProcessor or ReceiptProcessor(), **kwargs
+        )
+        listener = await server.serve("127.0.0.1", 0)
+        port = listener.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            return await scenario(reader, writer)
+        finally:
+            writer.close()
+            listener.close()
+            await listener.wait_closed()
+            server.close()
+
+    return asyncio.run(main())
+
+
+async def exchange(reader, writer, *args, **kwargs):
+    writer.write(request(*args, **kwargs))
+    return await read_response(reader)
+
+
+@pytest.mark.parametrize("inlineBodyBytes", [1 << 20, 0])
+def test_upload_and_points_on_one_connection(inlineBodyBytes):
+    body = json.dumps(RECEIPT).encode()
+
+    async def scenario(reader, writer):
+        status, _, upload = await exchange(
+            reader, writer, "POST", "/receipts/process", body
+        )
+        assert status == 200
+        ID = json.loads(upload)["id"]
+        status, headers, points = await exchange(
+            reader, writer, "GET", f"/receipts/{ID}/points"
+        )
+        assert status == 200
+        status, _, notModified = await exchange(
+            reader,
+            writer,
+            "GET",
+            f"/receipts/{ID}/points",
+            headers={"If-None-Match": headers["ETag"]},
+        )
+        assert (status, notModified) == (304, b"")
+        return upload, headers, points
+
+    upload, headers, points = run(scenario, inlineBodyBytes=inlineBodyBytes)
+    with app.test_client() as server:
+        flaskUpload = server.post("/receipts/process", json=RECEIPT)
+        ID = flaskUpload.get_json()["id"]
+        flaskPoints = server.get(f"/receipts/{ID}/points")
+    assert upload == flaskUpload.data
+    assert points == flaskPoints.data
+    assert headers["ETag"] == flaskPoints.headers["ETag"]
+    assert headers["Cache-Control"] == flaskPoints.headers["Cache-Control"]
+
+
+@pytest.mark.parametrize(
+    "method, path, body, expected",
+    [
+        pytest.param(
+            "POST",
+            "/receipts/process",
+            json.dumps({**RECEIPT, "total": "1"}).encode(),
+            (400, b"The receipt is invalid"),
+            id="invalid receipt",
+        ),
+        pytest.param(
+            "POST",
+            "/receipts/process",
+            b"{not json",
+            (400, b"The receipt is invalid"),
+            id="invalid JSON",
+        ),
+        pytest.param(
+            "GET",
+            "/receipts/2c37898a-dc27-56ac-b9d4-cb755b426579/points",
+            b"",
+            (404, b"No receipt found for that id"),
+            id="unknown id",
+        ),
+        pytest.param(
+            "GET", "/receipts/process", b"", (405, None), id="wrong method"
+        ),
+        pytest.param("GET", "/unknown", b"", (404, None), id="unknown path"),
+    ],
+)
+def test_errors(method, path, body, expected):
+    async def scenario(reader, writer):
+        status, _, data = await exchange(reader, writer, method, path, body)
+        return status, data
+
+    status, data = run(scenario)
+    assert status == expected[0]
+    if expected[1] is not None:
+        assert data == expected[1]
+
+
+@pytest.mark.parametrize(
+    "receipt, expected",
+    [
+        pytest.param(RECEIPT, 200, id="valid receipt"),
+        pytest.param({**RECEIPT, "total": "1"}, 400, id="invalid receipt"),
+    ],
+)
+def test_streamed_upload(receipt, expected, monkeypatch):
+    monkeypatch.setattr(async_host, "STREAM_BODY_BYTES", 0)
+
+    async def scenario(reader, writer):
+        status, _, data = await exchange(
+            reader,
+            writer,
+            "POST",
+            "/receipts/process",
+            json.dumps(receipt).encode(),
+        )
+        return status, data
+
+    status, data = run(scenario)
+    with app.test_client() as server:
+        response = server.post("/receipts/process", json=receipt)
+    assert status == response.status_code == expected
+    assert data == response.data
+
+
+def test_connection_close():
+    async def scenario(reader, writer):
+        status, headers, _ = await exchange(
+            reader, writer, "GET", "/unknown", close=True
+        )
+        assert headers["Connection"] == "close"
+        return await reader.read()
+
+    assert run(scenario) == b""
+
+
+def test_chunked_body_is_refused():
+    async def scenario(reader, writer):
+        writer.write(
+            b"POST /receipts/process HTTP/1.1\r\n"
+            b"Transfer-Encoding: chunked\r\n\r\n"
+        )
+        return await read_response(reader)
+
+    status, headers, _ = run(scenario)
+    assert status == 411
+    assert headers["Connection"] == "close"
+
+
+@pytest.mark.parametrize(
+    "length",
+    [
+        pytest.param("-1", id="negative"),
+        pytest.param("+5", id="signed"),
+        pytest.param("ten", id="not a number"),
+    ],
+)
+def test_malformed_content_length_is_refused(length):
+    async def scenario(reader, writer):
+        writer.write(
+            b"POST /receipts/process HTTP/1.1\r\n"
+            b"Content-Length: " + length.encode() + b"\r\n\r\n"
+        )
+        return await read_response(reader)
+
+    status, headers, body = run(scenario)
+    assert (status, body) == (400, b"Malformed Content-Length")
+    assert headers["Connection"] == "close"
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        super().__init__()
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+@pytest.mark.parametrize(
+    "processor, expected",
+    [
+        pytest.param(lambda path: ReceiptProcessor(), 0, id="in memory"),
+        pytest.param(
+            lambda path: ReceiptProcessor(workers=1, inlineItems=1),
+            1,
+            id="pooled receipt",
+        ),
+        pytest.param(
+            lambda path: ReceiptProcessor(
+                open_store(f"sqlite:///{path / 'receipts.db'}?shared=1")
+            ),
+            2,
+            id="shared store",
+        ),
+    ],
+)
+def test_blocking_work_runs_in_executor(tmp_path, processor, expected):
+    """Small bodies are still processed off the loop when processing waits
+    on the scoring pool or the store."""
+    executor = CountingExecutor()
+
+    async def scenario(reader, writer):
+        status, _, upload = await exchange(
+            reader,
+            writer,
+            "POST",
+            "/receipts/process",
+            json.dumps(RECEIPT).encode(),
+        )
+        assert status == 200
+        ID = json.loads(upload)["id"]
+        status, _, _ = await exchange(
+            reader, writer, "GET", f"/receipts/{ID}/points"
+        )
+        assert status == 200
+
+    run(scenario, processor(tmp_path), executor=executor)
+    assert executor.submitted == expected
+
+
+def test_streamed_upload_is_spooled(monkeypatch):
+    """Large bodies are spooled to disk, and receipts the stream cannot hash
+    as they arrive are read whole from the spool."""
+    monkeypatch.setattr(async_host, "STREAM_BODY_BYTES", 1)
+    monkeypatch.setattr(async_host, "SPOOL_BYTES", 1024)
+    monkeypatch.setattr(async_host, "READ_SIZE", 1000)
+    items = [
+        {"shortDescription": f"Item {i:03}", "price": "1.25"}
+        for i in range(200)
+    ]
+    receipt = {**RECEIPT, "items": items, "total": "250.00"}
+    body = json.dumps(receipt)[:-1] + ', "total": "250.00"}'
+
+    async def scenario(reader, writer):
+        return await exchange(
+            reader, writer, "POST", "/receipts/process", body.encode()
+        )
+
+    status, headers, data = run(scenario)
+    assert headers["Connection"] == "keep-alive"
+    with app.test_client() as server:
+        response = server.post("/receipts/process", json=receipt)
+    assert (status, data) == (response.status_code, response.data)
+    assert status == 200
@@ -0,0 +1,38 @@
+import uuid
+
+import pytest
+from receipt_processor.bloom import BloomFilter, GrowingBloomFilter
+
+
+def random_keys(count: int):
+    return [str(uuid.uuid4()) for _ in range(count)]
+
+
+@pytest.mark.parametrize(
+    "bloom",
+    [
+        pytest.param(BloomFilter(10_000, 0.01), id="fixed"),
+        pytest.param(GrowingBloomFilter(1000, 0.01), id="growing"),
+    ],
+)
+def test_false_positive_rate(bloom):
+    keys = random_keys(10_000)
+    for key in keys:
+        bloom.add(key)
+    # No false negatives
+    assert all(key in bloom for key in keys)
+    absent = random_keys(100_000)
+    observed = sum(key in bloom for key in absent) / len(absent)
+    assert observed < 0.012
+    assert bloom.false_positive_rate() < 0.012
+    assert bloom.false_positive_rate() == pytest.approx(observed, abs=0.003)
+
+
+def test_growing_filter_adds_filters():
+    bloom = GrowingBloomFilter(100, 0.01)
+    for key in random_keys(700):
+        bloom.add(key)
+    # 100, 200 and 400 keys
+    assert [b.capacity for b in bloom._filters] == [100, 200, 400]
+    assert len(bloom) == 700
+    assert bloom.nbytes() == sum(b.nbytes() for b in bloom._filters)
@@ -0,0 +1,147 @@
+"""Tests the streaming bulk import of NDJSON and JSON array files."""
+
+import io
+import json
+
+import pytest
+from receipt_processor import ReceiptProcessor, bulk_import
+from receipt_processor.bulk_import import read_records, run_import
+from receipt_processor.canonical import receipt_id
+from receipt_processor.points import calculate_receipt_points
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [
+        {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+    ],
+    "total": "18.74",
+}
+OTHER = {**RECEIPT, "retailer": "Walgreens"}
+INVALID = {**RECEIPT, "total": "18"}
+
+
+def ndjson(*receipts):
+    return "\n".join(json.dumps(receipt) for receipt in receipts) + "\n"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        pytest.param(
+            ndjson(RECEIPT, OTHER),
+            [RECEIPT, OTHER],
+            id="ndjson",
+        ),
+        pytest.param(
+            json.dumps([RECEIPT, OTHER], indent=2),
+            [RECEIPT, OTHER],
+            id="array",
+        ),
+        pytest.param("  [ ]  ", [], id="empty array"),
+        pytest.param("", [], id="empty file"),
+    ],
+)
+def test_read_records(text, expected, monkeypatch):
+    # Small reads split elements across the buffer boundary
+    monkeypatch.setattr(bulk_import, "READ_SIZE", 7)
+    records = [
+        json.loads(record) if isinstance(record, str) else record
+        for _, record in read_records(io.StringIO(text))
+    ]
+    assert records == expected
+
+
+def test_read_records_numbers_ndjson_lines():
+    text = "\n" + json.dumps(RECEIPT) + "\n\n" + json.dumps(OTHER) + "\n"
+    positions = [position for position, _ in read_records(io.StringIO(text))]
+    assert positions == [2, 4]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        pytest.param("[{}, {", id="truncated"),
+        pytest.param("[{} {}]", id="missing comma"),
+    ],
+)
+def test_read_records_malformed_array(text):
+    with pytest.raises(ValueError):
+        list(read_records(io.StringIO(text)))
+
+
+def test_run_import_counts_and_rejects():
+    text = ndjson(RECEIPT, INVALID, RECEIPT, OTHER) + "{not json\n"
+    receiptProcessor = ReceiptProcessor()
+    rejects = io.StringIO()
+    counts = run_import(
+        io.StringIO(text),
+        receiptProcessor,
+        rejects=rejects,
+        workers=2,
+        chunkSize=2,
+    )
+    assert counts == (2, 1, 2)
+    assert len(receiptProcessor.receipts) == 2
+    ID = receiptProcessor.process_receipt(RECEIPT)
+    assert receiptProcessor.get_points(ID) == calculate_receipt_points(RECEIPT)
+
+    lines = [json.loads(line) for line in rejects.getvalue().splitlines()]
+    assert [reject["line"] for reject in lines] == [2, 5]
+    assert lines[0]["errors"] == ["$.total: must match ^\\d+\\.\\d{2}$"]
+    assert json.loads(lines[0]["receipt"]) == INVALID
+    assert lines[1]["errors"][0].startswith("invalid JSON")
+
+
+def test_main_imports_array_file(tmp_path, capsys):
+    path = tmp_path / "receipts.json"
+    path.write_text(json.dumps([RECEIPT, OTHER, RECEIPT]))
+    store = f"sqlite:///{tmp_path / 'receipts.db'}"
+    assert bulk_import.main([str(path), "--store", store, "--workers", "1"]) == 0
+    assert "2 new, 1 duplicate, 0 rejected" in capsys.readouterr().err
+
+    receiptProcessor = ReceiptProcessor(bulk_import.open_store(store))
+    assert len(receiptProcessor.receipts) == 2
+    receiptProcessor.close()
+
+
+# Scores every receipt 7 points for each of its items
+PER_ITEM_RULES = [{"name": "items", "field": "item", "award": {"points": 7}}]
+
+
+@pytest.mark.parametrize(
+    "useEnvironment",
+    [
+        pytest.param(False, id="option"),
+        pytest.param(True, id="environment"),
+    ],
+)
+def test_main_scores_with_rules(tmp_path, monkeypatch, useEnvironment):
+    rulesPath = tmp_path / "rules.json"
+    rulesPath.write_text(json.dumps(PER_ITEM_RULES))
+    path = tmp_path / "receipts.ndjson"
+    path.write_text(ndjson(RECEIPT))
+    store = f"sqlite:///{tmp_path / 'receipts.db'}"
+    argv = [str(path), "--store", store, "--workers", "1"]
+    if useEnvironment:
+        monkeypatch.setenv("POINTS_RULES", str(rulesPath))
+    else:
+        argv += ["--rules", str(rulesPath)]
+    assert bulk_import.main(argv) == 0
+
+    receiptProcessor = ReceiptProcessor(bulk_import.open_store(store))
+    assert receiptProcessor.get_points(receipt_id(RECEIPT)) == 14
+    receiptProcessor.close()
+
+
+def test_main_refuses_bad_rules(tmp_path, capsys):
+    rulesPath = tmp_path / "rules.json"
+    rulesPath.write_text(json.dumps([{"field": "nothing"}]))
+    store = f"sqlite:///{tmp_path / 'receipts.db'}"
+    with pytest.raises(SystemExit):
+        bulk_import.main(
+            ["-", "--store", store, "--rules", str(rulesPath)]
+        )
+    assert "cannot load rules" in capsys.readouterr().err
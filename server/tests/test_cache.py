@@ -0,0 +1,98 @@
+"""Tests the LRU cache behind the points responses."""
+
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.cache import LRUCache
+from receipt_processor.service import (
+    POINTS_CACHE_CONTROL,
+    POINTS_REVALIDATE_CACHE_CONTROL,
+    PointsResponses,
+)
+from receipt_processor.store import BoundedStore
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [{"shortDescription": "Mountain Dew 12PK", "price": "6.49"}],
+    "total": "6.49",
+}
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+
+def test_zero_entries_disables_the_cache():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_discard():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.discard("a")
+    cache.discard("b")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def bounded_responses(**limits):
+    clock = Clock()
+    receiptProcessor = ReceiptProcessor(BoundedStore(clock=clock, **limits))
+    return PointsResponses(receiptProcessor, maxEntries=10), clock
+
+
+def test_hits_refresh_bounded_store():
+    responses, clock = bounded_responses(ttl=10)
+    ID = responses.receiptProcessor.process_receipt(RECEIPT)
+    assert responses.get(ID)[2] is False
+    for _ in range(3):
+        clock.now += 6
+        # Each hit counts as a use, so the receipt never expires
+        assert responses.get(ID)[2] is True
+    assert responses.cacheControl == POINTS_REVALIDATE_CACHE_CONTROL
+
+
+@pytest.mark.parametrize(
+    "limits, forget",
+    [
+        pytest.param({"ttl": 10}, "expire", id="expired"),
+        pytest.param({"maxEntries": 1}, "evict", id="evicted"),
+    ],
+)
+def test_hits_end_when_bounded_store_forgets(limits, forget):
+    responses, clock = bounded_responses(**limits)
+    receiptProcessor = responses.receiptProcessor
+    ID = receiptProcessor.process_receipt(RECEIPT)
+    assert responses.get(ID) is not None
+    if forget == "expire":
+        clock.now += 10
+    else:
+        receiptProcessor.process_receipt({**RECEIPT, "retailer": "Other"})
+    assert responses.get(ID) is None
+    assert len(responses.cache) == 0
+
+
+def test_unbounded_store_responses_are_immutable():
+    responses = PointsResponses(ReceiptProcessor(), maxEntries=10)
+    assert responses.cacheControl == POINTS_CACHE_CONTROL
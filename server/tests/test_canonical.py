@@ -0,0 +1,119 @@
+"""Pins receipt ids. Ids are handed out to clients, so the streaming
+canonical encoding must keep producing exactly the ids of the original
+uuid5(json.dumps(receipt, sort_keys=True)) scheme."""
+
+import json
+import random
+import uuid
+from copy import deepcopy
+
+import pytest
+from receipt_processor.canonical import (
+    ITEMS_PER_CHUNK,
+    is_receipt_id,
+    receipt_id,
+)
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [
+        {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+        {"shortDescription": "Knorr Creamy Chicken", "price": "1.26"},
+        {"shortDescription": "Doritos Nacho Cheese", "price": "3.35"},
+        {"shortDescription": "   Klarbrunn 12-PK 12 FL OZ  ", "price": "12.00"},
+    ],
+    "total": "35.35",
+}
+
+
+def legacy_id(receipt) -> str:
+    receiptStr = json.dumps(receipt, sort_keys=True)
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, receiptStr))
+
+
+@pytest.mark.parametrize(
+    "receipt, expectedID",
+    [
+        pytest.param(
+            RECEIPT, "f62b87f4-3e03-51ed-9c19-ee97ba0baa7b", id="baseline"
+        ),
+        pytest.param(
+            {
+                "retailer": "Café & Co",
+                "purchaseDate": "2022-01-01",
+                "purchaseTime": "13:01",
+                "items": [
+                    {"shortDescription": "Crème brûlée", "price": "6.49"}
+                ],
+                "total": "6.49",
+            },
+            "6e20435b-65a8-537b-9397-146ac4e3c44f",
+            id="non-ascii characters",
+        ),
+        pytest.param(
+            {**RECEIPT, "notes": None},
+            "805630fa-cc03-592a-8253-70bbabb1c172",
+            id="extra field uses the fallback",
+        ),
+    ],
+)
+def test_receipt_id_is_pinned(receipt, expectedID: str):
+    assert receipt_id(receipt) == expectedID
+
+
+def test_receipt_id_ignores_field_order():
+    reordered = dict(reversed(list(RECEIPT.items())))
+    reordered["items"] = [
+        dict(reversed(list(item.items()))) for item in RECEIPT["items"]
+    ]
+    assert receipt_id(reordered) == receipt_id(RECEIPT)
+
+
+@pytest.mark.parametrize(
+    "itemCount",
+    [0, 1, ITEMS_PER_CHUNK - 1, ITEMS_PER_CHUNK, ITEMS_PER_CHUNK + 1, 1000],
+)
+def test_receipt_id_matches_legacy_for_any_item_count(itemCount: int):
+    rng = random.Random(itemCount)
+    receipt = deepcopy(RECEIPT)
+    receipt["items"] = [
+        {
+            "shortDescription": "".join(
+                rng.choices('ab -"\\\n\té€', k=rng.randint(0, 12))
+            ),
+            "price": f"{rng.randint(0, 99999) / 100:.2f}",
+        }
+        for _ in range(itemCount)
+    ]
+    assert receipt_id(receipt) == legacy_id(receipt)
+
+
+@pytest.mark.parametrize(
+    "receipt",
+    [
+        pytest.param({**RECEIPT, "total": 35.35}, id="non-string total"),
+        pytest.param({**RECEIPT, "items": "none"}, id="items not a list"),
+        pytest.param({**RECEIPT, "items": [["6.49"]]}, id="item not a dict"),
+        pytest.param(
+            {**RECEIPT, "items": [{"price": "6.49"}]}, id="missing item field"
+        ),
+        pytest.param(
+            {**RECEIPT, "items": [{"shortDescription": "Pizza", "price": 1}]},
+            id="non-string price",
+        ),
+        pytest.param({"retailer": "Target"}, id="missing fields"),
+        pytest.param([RECEIPT], id="not an object"),
+    ],
+)
+def test_receipt_id_matches_legacy_for_other_shapes(receipt):
+    assert receipt_id(receipt) == legacy_id(receipt)
+
+
+def test_ids_are_recognized():
+    assert is_receipt_id(receipt_id(RECEIPT))
+    assert is_receipt_id(receipt_id({"not": "a receipt"}))
+    assert not is_receipt_id(receipt_id(RECEIPT).upper())
+    assert not is_receipt_id(str(uuid.uuid4()))
@@ -0,0 +1,365 @@
+"""Tests the consistent-hash ring, and a cluster of local host.py
+processes: routing, forwarding, and rebalancing as nodes join and leave."""
+
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+from copy import deepcopy
+
+import host
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.canonical import receipt_id
+from receipt_processor.cluster import (
+    HOP_HEADER,
+    SECRET_HEADER,
+    Cluster,
+    HashRing,
+)
+from receipt_processor.points import calculate_receipt_points
+from receipt_processor.store import BoundedStore, CompactStore
+
+SERVER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NODES = [f"http://10.0.0.{i}:8000" for i in range(4)]
+SECRET = "test secret"
+# Sent by the tests where a node would send them
+PEER = {SECRET_HEADER: SECRET}
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [{"shortDescription": "Mountain Dew 12PK", "price": "6.49"}],
+    "total": "6.49",
+}
+
+
+def make_receipts(count: int, prefix: str):
+    receipts = []
+    for i in range(count):
+        receipt = deepcopy(RECEIPT)
+        receipt["retailer"] = f"{prefix} {i}"
+        receipts.append(receipt)
+    return receipts
+
+
+def test_ring_balances_ids():
+    ring = HashRing(NODES)
+    shares = Counter(ring.owner(str(uuid.uuid4())) for _ in range(20_000))
+    assert set(shares) == set(NODES)
+    for count in shares.values():
+        assert count == pytest.approx(5000, rel=0.2)
+
+
+def test_ring_moves_few_ids():
+    ids = [str(uuid.uuid4()) for _ in range(20_000)]
+    before = HashRing(NODES)
+    joined = HashRing(NODES + ["http://10.0.0.4:8000"])
+    moved = [ID for ID in ids if before.owner(ID) != joined.owner(ID)]
+    # Only ids taken over by the new node move, about a fifth of them
+    assert {joined.owner(ID) for ID in moved} == {"http://10.0.0.4:8000"}
+    assert len(moved) == pytest.approx(len(ids) / 5, rel=0.25)
+
+    left = HashRing(NODES[1:])
+    moved = [ID for ID in ids if before.owner(ID) != left.owner(ID)]
+    assert {before.owner(ID) for ID in moved} == {NODES[0]}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def request(node, method, path, body=None, headers=None):
+    """Returns the status and the body, decoded from JSON when it is."""
+    url = node.removeprefix("http://")
+    connection = http.client.HTTPConnection(url, timeout=10)
+    headers = dict(headers or {})
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    connection.request(method, path, body, headers)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    if response.getheader("Content-Type", "").startswith("application/json"):
+        return response.status, json.loads(data)
+    return response.status, data
+
+
+class LocalCluster:
+    """host.py processes on local ports, all configured with every node."""
+
+    def __init__(self) -> None:
+        self.processes = {}
+
+    def start(self, nodes, node) -> None:
+        env = {
+            **os.environ,
+            "PORT": node.rsplit(":", 1)[1],
+            "CLUSTER_NODES": ",".join(nodes),
+            "CLUSTER_SELF": node,
+            "CLUSTER_SECRET": SECRET,
+            "RECEIPT_STORE": "memory",
+            "LOG_LEVEL": "WARNING",
+        }
+        self.processes[node] = subprocess.Popen(
+            [sys.executable, "host.py"],
+            cwd=SERVER,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 20
+        while True:
+            try:
+                request(node, "GET", "/cluster/nodes", headers=PEER)
+                return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def stop(self, node) -> None:
+        process = self.processes.pop(node)
+        process.terminate()
+        process.wait()
+
+    def close(self) -> None:
+        for node in list(self.processes):
+            self.stop(node)
+
+
+@pytest.fixture
+def local_cluster():
+    cluster = LocalCluster()
+    yield cluster
+    cluster.close()
+
+
+def held_by(node, IDs):
+    """The ids a node answers for itself, without forwarding."""
+    return {
+        ID
+        for ID in IDs
+        if request(
+            node,
+            "GET",
+            f"/receipts/{ID}/points",
+            headers={HOP_HEADER: "test", **PEER},
+        )[0]
+        == 200
+    }
+
+
+def set_nodes(node, nodes):
+    """Changes a node's list of nodes. Returns once it has rebalanced,
+    with the number of receipts it moved."""
+    status, _ = request(
+        node, "PUT", "/cluster/nodes", {"nodes": nodes}, headers=PEER
+    )
+    assert status == 202
+    while True:
+        status, body = request(node, "GET", "/cluster/nodes", headers=PEER)
+        assert status == 200
+        if not body["rebalancing"]:
+            return body["moved"]
+        time.sleep(0.01)
+
+
+def test_cluster_routes_by_id(local_cluster):
+    nodes = [f"http://127.0.0.1:{free_port()}" for _ in range(4)]
+    for node in nodes[:3]:
+        local_cluster.start(nodes[:3], node)
+    ring = HashRing(nodes[:3])
+
+    # Uploads to any node land on the owner
+    receipts = make_receipts(30, "Single")
+    IDs = []
+    for i, receipt in enumerate(receipts):
+        status, body = request(
+            nodes[i % 3], "POST", "/receipts/process", receipt
+        )
+        assert status == 200
+        IDs.append(body["id"])
+    batch = make_receipts(30, "Batch")
+    batch.insert(5, {**RECEIPT, "total": "6"})
+    status, body = request(nodes[1], "POST", "/receipts/process:batch", batch)
+    assert status == 200
+    assert body["ids"][5] is None
+    assert [error["index"] for error in body["errors"]] == [5]
+    assert body["errors"][0]["violations"]
+    IDs += [ID for ID in body["ids"] if ID is not None]
+    allReceipts = receipts + batch[:5] + batch[6:]
+    for node in nodes[:3]:
+        assert held_by(node, IDs) == {
+            ID for ID in IDs if ring.owner(ID) == node
+        }
+
+    # Every node answers for every id
+    for i, (ID, receipt) in enumerate(zip(IDs, allReceipts)):
+        status, body = request(nodes[i % 3], "GET", f"/receipts/{ID}/points")
+        assert status == 200
+        assert body == {"points": calculate_receipt_points(receipt)}
+    unknown = str(uuid.uuid4())
+    status, body = request(
+        nodes[2], "POST", "/receipts/points:batch", IDs + [unknown]
+    )
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert [line["id"] for line in lines] == IDs + [unknown]
+    assert [line["points"] for line in lines] == [
+        calculate_receipt_points(receipt) for receipt in allReceipts
+    ] + [None]
+
+    # A fourth node joins: only the ids it now owns move
+    local_cluster.start(nodes, nodes[3])
+    joined = HashRing(nodes)
+    moved = sum(set_nodes(node, nodes) for node in nodes)
+    taken = {ID for ID in IDs if joined.owner(ID) == nodes[3]}
+    assert 0 < moved == len(taken) < len(IDs) / 2
+    assert held_by(nodes[3], IDs) == taken
+    for i, ID in enumerate(IDs):
+        assert request(nodes[i % 4], "GET", f"/receipts/{ID}/points")[0] == 200
+
+    # The first node leaves, handing its receipts over
+    remaining = nodes[1:]
+    for node in nodes:
+        set_nodes(node, remaining)
+    local_cluster.stop(nodes[0])
+    for i, ID in enumerate(IDs):
+        status, _ = request(remaining[i % 3], "GET", f"/receipts/{ID}/points")
+        assert status == 200
+
+
+def test_unavailable_owner(local_cluster):
+    nodes = [f"http://127.0.0.1:{free_port()}" for _ in range(2)]
+    for node in nodes:
+        local_cluster.start(nodes, node)
+    receipts = make_receipts(10, "Store")
+    ring = HashRing(nodes)
+    receipt = next(
+        receipt
+        for receipt in receipts
+        if ring.owner(
+            request(nodes[1], "POST", "/receipts/process", receipt)[1]["id"]
+        )
+        == nodes[1]
+    )
+    local_cluster.stop(nodes[1])
+    status, _ = request(nodes[0], "POST", "/receipts/process", receipt)
+    assert status == 503
+
+
+@pytest.fixture
+def one_node(monkeypatch):
+    """host's app as the only node of a cluster, with a compact store."""
+    receiptProcessor = ReceiptProcessor(CompactStore())
+    monkeypatch.setattr(host, "receiptProcessor", receiptProcessor)
+    monkeypatch.setattr(host, "cluster", Cluster(NODES[0], NODES[:1], SECRET))
+    with host.app.test_client() as client:
+        yield client
+
+
+@pytest.mark.parametrize(
+    "method, path, headers",
+    [
+        pytest.param("GET", "/cluster/nodes", {}, id="nodes"),
+        pytest.param("PUT", "/cluster/receipts", {}, id="receipts"),
+        pytest.param(
+            "GET",
+            f"/receipts/{receipt_id(RECEIPT)}/points",
+            {HOP_HEADER: NODES[1]},
+            id="hop",
+        ),
+    ],
+)
+@pytest.mark.parametrize(
+    "secret",
+    [
+        pytest.param(None, id="no secret"),
+        pytest.param("guess", id="wrong secret"),
+    ],
+)
+def test_node_requests_need_the_secret(
+    one_node, method, path, headers, secret
+):
+    if secret is not None:
+        headers = {**headers, SECRET_HEADER: secret}
+    response = one_node.open(path, method=method, headers=headers, json=[])
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize(
+    "pair",
+    [
+        pytest.param(["not-a-receipt-id", 1], id="malformed id"),
+        pytest.param([receipt_id(RECEIPT), -1], id="negative points"),
+        pytest.param([receipt_id(RECEIPT), 2**32], id="points out of range"),
+        pytest.param([receipt_id(RECEIPT), "1"], id="points not an int"),
+    ],
+)
+def test_received_receipts_are_checked(one_node, pair):
+    response = one_node.put("/cluster/receipts", json=[pair], headers=PEER)
+    assert response.status_code == 400
+    assert len(host.receiptProcessor.receipts) == 0
+
+    response = one_node.put(
+        "/cluster/receipts", json=[[receipt_id(RECEIPT), 7]], headers=PEER
+    )
+    assert (response.status_code, response.json) == (200, {"stored": 1})
+
+
+def test_nodes_rebalance_in_background(one_node, monkeypatch):
+    started = []
+    monkeypatch.setattr(
+        host.cluster, "start_rebalance", lambda processor: started.append(1)
+    )
+    response = one_node.put(
+        "/cluster/nodes", json={"nodes": NODES[:2]}, headers=PEER
+    )
+    assert response.status_code == 202
+    assert response.json == {"nodes": NODES[:2], "rebalancing": True}
+    assert started == [1]
+
+
+def test_rebalance_skips_dropped_ids_and_frees_bounded_stores(monkeypatch):
+    store = BoundedStore()
+    receiptProcessor = ReceiptProcessor(store)
+    cluster = Cluster(NODES[0], NODES[:2], SECRET)
+    IDs = [
+        receiptProcessor.process_receipt(receipt)
+        for receipt in make_receipts(40, "Moved")
+    ]
+    moving = [ID for ID in IDs if cluster.owner(ID) == NODES[1]]
+    assert len(moving) > 1
+    # Dropped by the store between listing its ids and reading them
+    evicted = moving[0]
+    getMany = store.get_many
+    monkeypatch.setattr(
+        store,
+        "get_many",
+        lambda IDs: [
+            None if ID == evicted else points
+            for ID, points in zip(IDs, getMany(IDs))
+        ],
+    )
+    sent = []
+
+    def forward(node, method, path, body=None, headers=None):
+        sent.extend(json.loads(body))
+        return 200, [], b""
+
+    monkeypatch.setattr(cluster, "forward", forward)
+    assert cluster.rebalance(receiptProcessor) == len(moving) - 1
+    assert sorted(ID for ID, _ in sent) == sorted(moving[1:])
+    assert all(points is not None for _, points in sent)
+    # Handed over receipts are dropped, without counting as evictions
+    assert set(store.ids()) == set(IDs) - set(moving[1:])
+    assert store.evictions == {"expired": 0, "entries": 0, "bytes": 0}
@@ -0,0 +1,105 @@
+"""Tests that both JSON backends decode the same documents to the same
+values and encode values to the same bytes as Flask's default jsonify."""
+
+import json
+import random
+
+import pytest
+from host import app
+from receipt_processor import codec
+
+orjson = pytest.importorskip("orjson")
+
+RECEIPT = {
+    "retailer": "M&M Corner Market",
+    "purchaseDate": "2022-03-20",
+    "purchaseTime": "14:33",
+    "items": [{"shortDescription": "Gatorade", "price": "2.25"}] * 4,
+    "total": "9.00",
+}
+
+DOCUMENTS = [
+    pytest.param(RECEIPT, id="receipt"),
+    pytest.param({"ids": ["a", None], "errors": []}, id="batch response"),
+    pytest.param({"points": 2**70}, id="integer over 64 bits"),
+    pytest.param({"retailer": "Café ☃ \U0001F600"}, id="non-ASCII"),
+    pytest.param({"s": "\x00\x1f\x7f\"\\/\b\f\n\r\t"}, id="escapes"),
+    pytest.param({"b": [1, -0, True, False, None, {}]}, id="mixed"),
+    pytest.param([{"n": 2**64 - 1}, {"n": -(2**63)}], id="64-bit edges"),
+]
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request):
+    codec.use_backend(request.param)
+    yield request.param
+    codec.use_backend()
+
+
+def reference_dumps(obj):
+    """What Flask's default provider writes for jsonify."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("obj", DOCUMENTS)
+def test_dumps_matches_jsonify(backend, obj):
+    assert codec.dumps(obj) == reference_dumps(obj)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        pytest.param(json.dumps(RECEIPT), id="receipt"),
+        pytest.param('{"a": 1, "a": 2}', id="duplicate keys"),
+        pytest.param('{"n": NaN, "i": -Infinity}', id="NaN"),
+        pytest.param("[18446744073709551615]", id="largest 64-bit integer"),
+        pytest.param('["12345678901234567890"]', id="digits in a string"),
+        pytest.param('["\\ud800"]', id="lone surrogate"),
+        pytest.param('  {"a": [1.5, 1e-7, 10E2]}\n', id="numbers"),
+    ],
+)
+def test_loads_matches_json(backend, text):
+    expected = json.loads(text)
+    for data in [text, text.encode()]:
+        assert repr(codec.loads(data)) == repr(expected)
+
+
+def test_loads_rejects_what_json_rejects(backend):
+    for text in ["{", "[1,]", "", "{'a': 1}"]:
+        with pytest.raises(ValueError):
+            codec.loads(text)
+
+
+def test_random_strings_encode_identically():
+    rng = random.Random(0)
+    alphabet = [chr(i) for i in range(0x80)] + ["é", " ", "\U0001F600"]
+    for _ in range(2000):
+        value = "".join(rng.choices(alphabet, k=rng.randint(0, 20)))
+        obj = {"id": value, "points": rng.randint(0, 1000)}
+        codec.use_backend("orjson")
+        fast = codec.dumps(obj)
+        codec.use_backend("json")
+        slow = codec.dumps(obj)
+        codec.use_backend()
+        assert fast == slow == reference_dumps(obj)
+
+
+def test_responses_identical_across_backends():
+    bodies = {}
+    for name in ["json", "orjson"]:
+        codec.use_backend(name)
+        with app.test_client() as server:
+            upload = server.post("/receipts/process", json=RECEIPT)
+            ID = upload.get_json()["id"]
+            batch = server.post(
+                "/receipts/process:batch", json=[RECEIPT, {"total": "1"}]
+            )
+            points = server.get(f"/receipts/{ID}/points")
+            # orjson reads this total as a float, json as an int
+            bigTotal = server.post(
+                "/receipts/process:batch", json=[{**RECEIPT, "total": 2**70}]
+            )
+            bodies[name] = [upload.data, batch.data, points.data, bigTotal.data]
+    codec.use_backend()
+    assert bodies["json"] == bodies["orjson"]
+    assert bodies["json"][0] == reference_dumps({"id": ID}).encode() + b"\n"
@@ -2,6 +2,7 @@
 api contract."""
 from host import app
 from copy import deepcopy
+import json
 import pytest
 from flask import jsonify
 
@@ -108,6 +109,124 @@ def test_endpoint_integration_valid_receipt():
         assert "points" in response_json
 
 
+def test_receipts_points_conditional_request():
+    """Points are served with a strong ETag and 304 when it matches"""
+    with app.test_client() as server:
+        ID = server.post(f'/receipts/process', json=VALID_RECEIPT).get_json()["id"]
+        first = server.get(f'/receipts/{ID}/points')
+        assert first.status_code == 200
+        etag = first.headers["ETag"]
+        assert etag.startswith('"') and etag.endswith('"')
+        assert "immutable" in first.headers["Cache-Control"]
+
+        # Served again from the cache, byte for byte
+        second = server.get(f'/receipts/{ID}/points')
+        assert second.data == first.data
+        assert second.headers["ETag"] == etag
+
+        response = server.get(
+            f'/receipts/{ID}/points', headers={"If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == etag
+
+        response = server.get(
+            f'/receipts/{ID}/points', headers={"If-None-Match": '"other"'}
+        )
+        assert response.status_code == 200
+        assert response.get_json() == first.get_json()
+
+
+def test_receipts_points_batch():
+    """Bulk lookups stream one line per id, in order, misses included"""
+    unknown = "2c37898a-dc27-56ac-b9d4-cb755b426579"
+    with app.test_client() as server:
+        ID = server.post(f'/receipts/process', json=VALID_RECEIPT).get_json()["id"]
+        points = server.get(f'/receipts/{ID}/points').get_json()["points"]
+        expected = [
+            {"id": ID, "points": points},
+            {"id": unknown, "points": None},
+            {"id": ID, "points": points},
+        ]
+
+        response = server.post(
+            '/receipts/points:batch', json=[ID, unknown, ID]
+        )
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line) for line in lines] == expected
+
+        response = server.post(
+            '/receipts/points:batch',
+            data=f'{ID}\n\n"{unknown}"\n{ID}',
+            content_type="application/x-ndjson",
+        )
+        lines = response.get_data(as_text=True).splitlines()
+        assert [json.loads(line) for line in lines] == expected
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        pytest.param({"ids": []}, id="object"),
+        pytest.param([1, 2], id="not strings"),
+    ],
+)
+def test_receipts_points_batch_invalid_body(body):
+    with app.test_client() as server:
+        response = server.post('/receipts/points:batch', json=body)
+        assert response.status_code == 400
+        assert response.data == b"The id list is invalid"
+
+
+def test_receipts_process_batch():
+    """Batch ids line up with the input, duplicates share an id, and
+    invalid receipts are reported by index"""
+    invalidReceipt = {**deepcopy(VALID_RECEIPT), "total": "35."}
+    otherReceipt = {**deepcopy(VALID_RECEIPT), "retailer": "Walgreens"}
+    batch = [VALID_RECEIPT, invalidReceipt, otherReceipt, VALID_RECEIPT]
+    with app.test_client() as server:
+        response = server.post('/receipts/process:batch', json=batch)
+        assert response.status_code == 200
+        response_json = response.get_json()
+        IDs = response_json["ids"]
+        assert len(IDs) == 4
+        assert IDs[1] is None
+        assert IDs[0] == IDs[3] != IDs[2]
+        assert response_json["errors"] == [
+            {
+                "index": 1,
+                "error": "The receipt is invalid",
+                "violations": ["$.total: must match ^\\d+\\.\\d{2}$"],
+            }
+        ]
+
+        # Batch ids resolve and match the single receipt endpoint
+        response = server.post('/receipts/process', json=otherReceipt)
+        assert response.get_json()["id"] == IDs[2]
+        response = server.get(f'receipts/{IDs[2]}/points')
+        assert response.status_code == 200
+
+
+def test_receipts_process_batch_ndjson():
+    body = "\n".join([json.dumps(VALID_RECEIPT), "{not json", ""])
+    with app.test_client() as server:
+        response = server.post(
+            '/receipts/process:batch',
+            data=body,
+            content_type="application/x-ndjson",
+        )
+        assert response.status_code == 200
+        response_json = response.get_json()
+        assert response_json["ids"][0] is not None
+        assert response_json["ids"][1] is None
+        assert response_json["errors"] == [
+            {"index": 1, "error": "The receipt is not valid JSON"}
+        ]
+
+
 #   ===== Tesing inappropriate usage =====
 
 # Lots of testcases here to inject invalid receipt fields
@@ -130,6 +249,10 @@ def test_endpoint_integration_valid_receipt():
             {**deepcopy(VALID_RECEIPT), "purchaseDate": "2022-02-30"},
             id="purchaseDate non-existent date"
         ),
+        pytest.param(
+            {**deepcopy(VALID_RECEIPT), "purchaseDate": "2022-1-1"},
+            id="purchaseDate without zero padding"
+        ),
         pytest.param(
             {**deepcopy(VALID_RECEIPT), "purchaseTime": "1:01 PM"},
             id="purchaseTime invalid format"
@@ -138,6 +261,10 @@ def test_endpoint_integration_valid_receipt():
             {**deepcopy(VALID_RECEIPT), "purchaseTime": "25:01"},
             id="purchaseTime out of range"
         ),
+        pytest.param(
+            {**deepcopy(VALID_RECEIPT), "purchaseTime": "1:01"},
+            id="purchaseTime without zero padding"
+        ),
         pytest.param(
             {**deepcopy(VALID_RECEIPT), "items": []},
             id="empty items list"
@@ -186,6 +313,45 @@ def test_receipts_process_invalid_receipt(invalidReceipt):
         assert response.status_code == 400
         assert response.data == b"The receipt is invalid"
 
+@pytest.mark.parametrize(
+    "receipt, status",
+    [
+        pytest.param(VALID_RECEIPT, 200, id="valid receipt"),
+        pytest.param(
+            {**deepcopy(VALID_RECEIPT), "total": "35"}, 400,
+            id="invalid receipt"
+        ),
+    ]
+)
+def test_receipts_process_streamed(receipt, status, monkeypatch):
+    import host
+    with app.test_client() as server:
+        buffered = server.post('/receipts/process', json=receipt)
+        monkeypatch.setattr(host, "STREAM_BODY_BYTES", 0)
+        streamed = server.post('/receipts/process', json=receipt)
+        assert streamed.status_code == buffered.status_code == status
+        assert streamed.data == buffered.data
+
+def test_receipts_process_too_large(monkeypatch):
+    import host
+    monkeypatch.setattr(host, "MAX_BODY_BYTES", 100)
+    with app.test_client() as server:
+        response = server.post('/receipts/process', json=VALID_RECEIPT)
+        assert response.status_code == 413
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        pytest.param(VALID_RECEIPT, id="single receipt object"),
+        pytest.param("receipts", id="string"),
+    ]
+)
+def test_receipts_process_batch_invalid_body(body):
+    with app.test_client() as server:
+        response = server.post('/receipts/process:batch', json=body)
+        assert response.status_code == 400
+        assert response.data == b"The receipt batch is invalid"
+
 def test_receipts_process_invalid_method():
     with app.test_client() as server:
         response = server.get(f'/receipts/process')
@@ -202,4 +368,73 @@ def test_receipts_points_invalid_method():
     with app.test_client() as server:
         ID = "2c37898a-dc27-56ac-b9d4-cb755b426579"
         response = server.post(f'/receipts/{ID}/points')
-        assert response.status_code == 405
\ No newline at end of file
+        assert response.status_code == 405
+
+def test_metrics():
+    with app.test_client() as server:
+        server.post('/receipts/process', json=VALID_RECEIPT)
+        server.post('/receipts/process', json=VALID_RECEIPT)
+        response = server.get('/metrics')
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        body = response.get_data(as_text=True)
+        assert 'receipts_processed_total{result="duplicate"}' in body
+        assert (
+            'http_requests_total{route="/receipts/process",status="200"}'
+            in body
+        )
+        assert "http_request_seconds_bucket" in body
+        assert "receipts_stored " in body
+
+def test_analytics(monkeypatch):
+    import host
+    from receipt_processor import ReceiptProcessor
+    processor = ReceiptProcessor()
+    monkeypatch.setattr(host, "receiptProcessor", processor)
+    receipts = [
+        VALID_RECEIPT,
+        {**deepcopy(VALID_RECEIPT), "purchaseDate": "2022-01-02"},
+        {**deepcopy(VALID_RECEIPT), "retailer": "M&M Corner Market"},
+    ]
+    with app.test_client() as server:
+        points = []
+        for receipt in receipts + [VALID_RECEIPT]:
+            ID = server.post('/receipts/process', json=receipt).json["id"]
+            points.append(processor.get_points(ID))
+
+        response = server.get('/analytics/daily?end=2022-01-01')
+        assert response.status_code == 200
+        assert response.json == {"days": [
+            {"retailer": "M&M Corner Market", "purchaseDate": "2022-01-01",
+             "receipts": 1, "points": points[2]},
+            {"retailer": "Target", "purchaseDate": "2022-01-01",
+             "receipts": 1, "points": points[0]},
+        ]}
+
+        response = server.get('/analytics/retailers?limit=1')
+        assert response.json == {"retailers": [
+            {"retailer": "Target", "receipts": 2,
+             "points": points[0] + points[1]},
+        ]}
+
+        response = server.get('/analytics/points?retailer=Target')
+        assert response.json["receipts"] == 2
+        buckets = response.json["buckets"]
+        assert buckets[0] == {"min": 0, "max": 9, "receipts": 0}
+        assert buckets[-1]["max"] is None
+        assert sum(bucket["receipts"] for bucket in buckets) == 2
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        pytest.param("/analytics/daily?start=2022-13-01", id="bad start"),
+        pytest.param("/analytics/points?end=yesterday", id="bad end"),
+        pytest.param("/analytics/retailers?limit=0", id="zero limit"),
+        pytest.param("/analytics/retailers?limit=ten", id="word limit"),
+    ]
+)
+def test_analytics_invalid_filters(query):
+    with app.test_client() as server:
+        response = server.get(query)
+        assert response.status_code == 400
+        assert response.data == b"The analytics filters are invalid"
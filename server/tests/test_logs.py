@@ -0,0 +1,55 @@
+"""Tests structured, sampled, queued logging."""
+
+import io
+import json
+import logging
+
+from receipt_processor.logs import (
+    SAMPLED,
+    JsonFormatter,
+    SamplingFilter,
+    configure_logging,
+    shutdown_logging,
+)
+
+
+def make_record(**extra) -> logging.LogRecord:
+    record = logging.makeLogRecord(
+        {"name": "test", "levelname": "INFO", "msg": "New receipt stored"}
+    )
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter_includes_extra_fields():
+    entry = json.loads(
+        JsonFormatter().format(make_record(id="abc", points=28, **SAMPLED))
+    )
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test"
+    assert entry["message"] == "New receipt stored"
+    assert entry["id"] == "abc"
+    assert entry["points"] == 28
+    assert "sampled" not in entry
+
+
+def test_sampling_filter_only_drops_sampled_records():
+    dropAll = SamplingFilter(0.0)
+    assert not dropAll.filter(make_record(**SAMPLED))
+    assert dropAll.filter(make_record())
+    assert SamplingFilter(1.0).filter(make_record(**SAMPLED))
+
+
+def test_configure_logging_writes_json_lines():
+    stream = io.StringIO()
+    configure_logging(level="INFO", sampleRate=0.0, stream=stream)
+    log = logging.getLogger("receipt_processor.test")
+    log.info("Unknown receipt queried", extra={"id": "abc"})
+    log.info("Valid receipt queried", extra={"id": "abc", **SAMPLED})
+    log.debug("Processing receipt")
+    # Shutting down writes out everything still queued
+    shutdown_logging()
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == [
+        "Unknown receipt queried"
+    ]
@@ -0,0 +1,163 @@
+"""Tests metric rendering and the optional stage and rule timers."""
+
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.metrics import (
+    RECEIPTS,
+    STAGE_SECONDS,
+    TIMING,
+    Counter,
+    Gauge,
+    Histogram,
+    Metric,
+    Registry,
+    SharedMetric,
+)
+from receipt_processor.points import calculate_parsed_points
+from receipt_processor.validator import ReceiptValidator
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "15:01",
+    "items": [
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+        {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+    ],
+    "total": "18.74",
+}
+
+
+@pytest.fixture
+def timing():
+    TIMING.enabled = True
+    yield TIMING
+    TIMING.enabled = False
+
+
+def test_counter_render():
+    counter = Counter("requests_total", "Requests.", ["route", "status"])
+    counter.inc("/a", "200")
+    counter.inc("/a", "200", amount=2)
+    assert counter.value("/a", "200") == 3
+    assert counter.render() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a",status="200"} 3',
+    ]
+
+
+def test_histogram_render_is_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=[0.1, 1.0])
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+    assert histogram.count() == 4
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 2.65",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_gauge_reads_on_render():
+    values = [1, 2]
+    gauge = Gauge("stored", "Stored.", values.pop)
+    assert gauge.render()[2] == "stored 2"
+    assert gauge.render()[2] == "stored 1"
+
+
+class Samples(Metric):
+    def _samples(self):
+        return []
+
+
+@pytest.mark.parametrize(
+    "base",
+    [
+        pytest.param(Metric, id="metric"),
+        pytest.param(SharedMetric, id="shared"),
+    ],
+)
+def test_incomplete_metric_fails_when_created(base):
+    class Incomplete(base):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete("incomplete", "Incomplete.")
+
+
+def test_shared_metric_needs_snapshot_and_merged():
+    class Unshared(Samples):
+        pass
+
+    class Shared(SharedMetric):
+        _samples = Samples._samples
+
+    Unshared("unshared", "Unshared.")
+    with pytest.raises(TypeError):
+        Shared("shared", "Shared.")
+
+
+def test_processor_counts_results():
+    receiptProcessor = ReceiptProcessor()
+    before = {r: RECEIPTS.value(r) for r in ["new", "duplicate", "invalid"]}
+    receiptProcessor.process_receipt(RECEIPT)
+    receiptProcessor.process_receipt(RECEIPT)
+    with pytest.raises(ValueError):
+        receiptProcessor.process_receipt({**RECEIPT, "total": "1"})
+    for result in ["new", "duplicate", "invalid"]:
+        assert RECEIPTS.value(result) == before[result] + 1
+
+
+def test_timers_record_every_stage_and_rule(timing):
+    stages = [
+        "generate_id", "validate", "score", "store", "rule_retailer",
+        "rule_total", "rule_item_pairs", "rule_item_desc",
+        "rule_purchase_date", "rule_purchase_time",
+    ]
+    before = {stage: STAGE_SECONDS.count(stage) for stage in stages}
+    ReceiptProcessor().process_receipt(RECEIPT)
+    for stage in stages:
+        assert STAGE_SECONDS.count(stage) == before[stage] + 1
+
+
+def test_timed_scoring_matches_untimed():
+    parsed = ReceiptValidator().check(RECEIPT)[0]
+    untimed = calculate_parsed_points(parsed)
+    TIMING.enabled = True
+    try:
+        assert calculate_parsed_points(parsed) == untimed
+    finally:
+        TIMING.enabled = False
+
+
+def test_registry_adds_up_shared_processes(tmp_path):
+    def worker(name, requests, seconds):
+        registry = Registry()
+        counter = registry.register(
+            Counter("requests_total", "Requests.", ["route"])
+        )
+        histogram = registry.register(
+            Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        )
+        registry.register(Gauge("workers", "Workers.", lambda: 1))
+        registry.share(str(tmp_path), name=name, interval=3600)
+        counter.inc("/a", amount=requests)
+        histogram.observe(seconds)
+        return registry
+
+    first = worker("1", 2, 0.05)
+    second = worker("2", 3, 0.5)
+    first.write_snapshot()
+    rendered = second.render().splitlines()
+    assert 'requests_total{route="/a"} 5' in rendered
+    assert 'latency_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'latency_seconds_bucket{le="1.0"} 2' in rendered
+    assert "latency_seconds_count 2" in rendered
+    # Gauges are read by the rendering process only
+    assert "workers 1" in rendered
+    # An exited process's totals are kept
+    del first
+    assert 'requests_total{route="/a"} 5' in second.render().splitlines()
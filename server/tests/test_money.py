@@ -0,0 +1,76 @@
+"""Differential tests of the integer-cents point rules against the same
+rules computed with decimal.Decimal."""
+
+import random
+from decimal import ROUND_CEILING, Decimal
+
+import pytest
+from receipt_processor.configuration import (
+    DESC_MULTIPLIER,
+    MULTIPLE_TOTAL_POINTS,
+    ROUND_TOTAL_POINTS,
+)
+from receipt_processor.money import exact_ratio, parse_cents
+from receipt_processor.points import (
+    calculate_item_desc_points,
+    calculate_total_points,
+)
+
+MULTIPLIER = Decimal(repr(DESC_MULTIPLIER))
+RANDOM_PRICES = 1_000_000
+
+
+def decimal_desc_points(price: str) -> int:
+    return int(
+        (Decimal(price) * MULTIPLIER).to_integral_value(rounding=ROUND_CEILING)
+    )
+
+
+def decimal_total_points(total: str) -> int:
+    points = 0
+    if Decimal(total) % 1 == 0:
+        points += ROUND_TOTAL_POINTS
+    if Decimal(total) % Decimal("0.25") == 0:
+        points += MULTIPLE_TOTAL_POINTS
+    return points
+
+
+def amounts(count: int, seed: int):
+    """Every amount up to $1000.00, then random amounts of up to 12 digits"""
+    for cents in range(100_001):
+        yield f"{cents // 100}.{cents % 100:02d}"
+    rng = random.Random(seed)
+    for _ in range(count):
+        cents = rng.randrange(10 ** rng.randint(3, 14))
+        yield f"{cents // 100}.{cents % 100:02d}"
+
+
+@pytest.mark.parametrize(
+    "amount, expectedCents",
+    [
+        pytest.param("0.00", 0, id="zero"),
+        pytest.param("0.01", 1, id="one cent"),
+        pytest.param("09.99", 999, id="leading zero"),
+        pytest.param("12.25", 1225, id="baseline"),
+        pytest.param("10000.00", 1000000, id="large amount"),
+    ],
+)
+def test_parse_cents(amount: str, expectedCents: int):
+    assert parse_cents(amount) == expectedCents
+
+
+def test_exact_ratio():
+    assert exact_ratio(0.2) == (1, 5)
+    assert exact_ratio(0.15) == (3, 20)
+    assert exact_ratio(2.0) == (2, 1)
+
+
+def test_item_desc_points_match_decimal():
+    for price in amounts(RANDOM_PRICES, seed=4):
+        item = {"shortDescription": "abc", "price": price}
+        assert calculate_item_desc_points(item) == decimal_desc_points(price)
+
+
+def test_total_points_match_decimal():
+    for total in amounts(RANDOM_PRICES // 10, seed=25):
+        assert calculate_total_points(total) == decimal_total_points(total)
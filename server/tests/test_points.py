@@ -3,6 +3,7 @@ with the API contract, i.e. nothing that invalidates the contract should be
 tested here."""
 
 import math
+from datetime import date, datetime, timedelta
 from typing import Any, Dict, List
 
 import pytest
@@ -16,14 +17,17 @@ from receipt_processor.configuration import (
     ROUND_TOTAL_POINTS,
 )
 from receipt_processor.points import (
+    calculate_batch_points,
     calculate_item_desc_points,
     calculate_item_pairs_points,
+    calculate_parsed_points,
     calculate_purchase_date_points,
     calculate_purchase_time_points,
     calculate_receipt_points,
     calculate_retailer_points,
     calculate_total_points,
 )
+from receipt_processor.validator import ReceiptValidator
 
 #   ===== Testing retailer name =====
 
@@ -164,6 +168,12 @@ def test_calculate_item_pairs_points(
             math.ceil(12.34 * DESC_MULTIPLIER),
             id="Desc of just whitespace",
         ),
+        # 15.00 * 0.2 is 3.0000000000000004 in floating point
+        pytest.param(
+            {"shortDescription": "abc", "price": "15.00"},
+            3,
+            id="Exact multiple of the multiplier",
+        ),
         # Hypens are allowed via the contract
         pytest.param(
             {"shortDescription": " ---  ", "price": "12.34"},
@@ -220,6 +230,45 @@ def test_calculate_purchase_time_points(
     assert calculate_purchase_time_points(purchaseTime) == expectedPoints
 
 
+#   ===== Fast path against the original strptime implementation =====
+
+
+def reference_purchase_time_points(purchaseTime: str) -> int:
+    minTime = datetime.strptime("14:00", "%H:%M").time()
+    maxTime = datetime.strptime("16:00", "%H:%M").time()
+    formattedPurchaseTime = datetime.strptime(purchaseTime, "%H:%M").time()
+    return (
+        PURCHASE_TIME_POINTS
+        if minTime < formattedPurchaseTime < maxTime
+        else 0
+    )
+
+
+def reference_purchase_date_points(purchaseDate: str) -> int:
+    return (
+        ODD_PURCHASE_DATE_POINTS if int(purchaseDate.split("-")[-1]) % 2 else 0
+    )
+
+
+def test_purchase_time_points_every_minute():
+    for hour in range(24):
+        for minute in range(60):
+            purchaseTime = f"{hour:02d}:{minute:02d}"
+            assert calculate_purchase_time_points(
+                purchaseTime
+            ) == reference_purchase_time_points(purchaseTime)
+
+
+def test_purchase_date_points_every_date():
+    day = date(1900, 1, 1)
+    while day <= date(2100, 12, 31):
+        purchaseDate = day.isoformat()
+        assert calculate_purchase_date_points(
+            purchaseDate
+        ) == reference_purchase_date_points(purchaseDate)
+        day += timedelta(days=1)
+
+
 #   ===== Integration testing for entire processor =====
 
 # Assuming all composite functions pass testing, this should be simple.
@@ -275,3 +324,34 @@ def test_calculate_purchase_time_points(
 )
 def test_process_receipt(receipt: Dict[str, Any], expectedPoints: int):
     assert calculate_receipt_points(receipt) == expectedPoints
+
+
+def test_calculate_batch_points():
+    """Scoring parsed receipts, alone or in a batch, must agree with scoring
+    each raw receipt on its own"""
+    validator = ReceiptValidator()
+    receipts = [
+        {
+            "retailer": retailer,
+            "purchaseDate": purchaseDate,
+            "purchaseTime": purchaseTime,
+            "items": [
+                {"shortDescription": "Emils Cheese Pizza", "price": total},
+                {"shortDescription": " abc ", "price": "1.26"},
+            ][:itemCount],
+            "total": total,
+        }
+        for retailer in ["Target", "M&M Corner Market"]
+        for purchaseDate in ["2022-01-01", "2022-01-02"]
+        for purchaseTime in ["13:01", "15:00"]
+        for total in ["35.35", "35.00", "9.25"]
+        for itemCount in [1, 2]
+    ]
+    parsedReceipts = [validator.check(receipt)[0] for receipt in receipts]
+    assert [
+        calculate_parsed_points(parsed) for parsed in parsedReceipts
+    ] == [calculate_receipt_points(receipt) for receipt in receipts]
+    assert calculate_batch_points(parsedReceipts) == [
+        calculate_receipt_points(receipt) for receipt in receipts
+    ]
+    assert calculate_batch_points([]) == []
@@ -0,0 +1,295 @@
+"""Stress tests ReceiptProcessor from many threads at once. Every receipt
+must be stored exactly once, under one id, however many threads upload it.
+Also checks that scoring in the process pool gives the same results as
+inline."""
+
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from copy import deepcopy
+
+import pytest
+from receipt_processor import ReceiptProcessor, processor
+from receipt_processor.metrics import ID_LOOKUPS
+from receipt_processor.processor import InvalidReceiptError
+from receipt_processor.store import CompactStore, MemoryStore, open_store
+
+THREADS = 64
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [{"shortDescription": "Mountain Dew 12PK", "price": "6.49"}],
+    "total": "6.49",
+}
+
+
+@pytest.fixture
+def scored(monkeypatch):
+    """Counts how many times each parsed receipt is scored, pausing inside
+    the scoring so that racing threads overlap"""
+    counts = Counter()
+    lock = threading.Lock()
+    single = processor.calculate_parsed_points
+    batch = processor.calculate_batch_points
+
+    def count(parsedReceipts):
+        with lock:
+            counts.update(parsed.retailer for parsed in parsedReceipts)
+        time.sleep(0.001)
+
+    def counting_single(parsed):
+        count([parsed])
+        return single(parsed)
+
+    def counting_batch(parsedReceipts):
+        count(parsedReceipts)
+        return batch(parsedReceipts)
+
+    monkeypatch.setattr(processor, "calculate_parsed_points", counting_single)
+    monkeypatch.setattr(processor, "calculate_batch_points", counting_batch)
+    switchInterval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield counts
+    sys.setswitchinterval(switchInterval)
+
+
+def run_threads(target) -> None:
+    barrier = threading.Barrier(THREADS)
+    errors = []
+
+    def run(index: int) -> None:
+        barrier.wait()
+        try:
+            target(index)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [
+        threading.Thread(target=run, args=(i,)) for i in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def make_receipts(count: int):
+    receipts = []
+    for i in range(count):
+        receipt = deepcopy(RECEIPT)
+        receipt["retailer"] = f"Store {i}"
+        receipts.append(receipt)
+    return receipts
+
+
+@pytest.mark.parametrize("store", [MemoryStore, CompactStore])
+def test_each_receipt_stored_once(scored, store):
+    receiptProcessor = ReceiptProcessor(store())
+    receipts = make_receipts(50)
+    ids = [[] for _ in range(THREADS)]
+
+    def upload(index: int) -> None:
+        order = random.Random(index).sample(receipts, len(receipts))
+        for receipt in order:
+            ids[index].append(
+                (receipt["retailer"], receiptProcessor.process_receipt(receipt))
+            )
+
+    run_threads(upload)
+    # Receipts are scored outside the locks, so racing uploads may each
+    # score one, but it is stored once
+    assert set(scored) == {r["retailer"] for r in receipts}
+    assert len(receiptProcessor.receipts) == len(receipts)
+    # Every thread got the same id for the same receipt
+    assert len({pair for pairs in ids for pair in pairs}) == len(receipts)
+
+
+def test_each_receipt_stored_once_in_batches(scored):
+    receiptProcessor = ReceiptProcessor()
+    receipts = make_receipts(200)
+    ids = [{} for _ in range(THREADS)]
+
+    def upload(index: int) -> None:
+        rng = random.Random(index)
+        if index % 2:
+            sample = rng.sample(receipts, 100)
+            IDs, _ = receiptProcessor.process_receipts(sample)
+            pairs = zip(sample, IDs)
+        else:
+            sample = rng.sample(receipts, 20)
+            pairs = [(r, receiptProcessor.process_receipt(r)) for r in sample]
+        ids[index].update((r["retailer"], ID) for r, ID in pairs)
+
+    run_threads(upload)
+    # Batches score outside the locks, so a receipt may be scored by more
+    # than one upload, but it is stored once, under one id
+    assert len(receiptProcessor.receipts) == len(scored)
+    assert len({pair for pairs in ids for pair in pairs.items()}) == len(
+        scored
+    )
+
+
+def test_batch_scoring_does_not_block_uploads(monkeypatch):
+    receiptProcessor = ReceiptProcessor()
+    scoring, release = threading.Event(), threading.Event()
+    batch = processor.calculate_batch_points
+
+    def slow_batch(parsedReceipts):
+        scoring.set()
+        release.wait(5)
+        return batch(parsedReceipts)
+
+    monkeypatch.setattr(processor, "calculate_batch_points", slow_batch)
+    # Enough new ids to take every stripe
+    receipts = make_receipts(2000)
+    thread = threading.Thread(
+        target=receiptProcessor.process_receipts, args=(receipts,)
+    )
+    thread.start()
+    assert scoring.wait(5)
+    # Not blocked by the batch still being scored
+    done = []
+    single = threading.Thread(
+        target=lambda: done.append(
+            receiptProcessor.process_receipt({**RECEIPT, "total": "1.00"})
+        )
+    )
+    single.start()
+    single.join(2)
+    assert done and receiptProcessor.get_points(done[0]) is not None
+    release.set()
+    thread.join()
+    assert len(receiptProcessor.receipts) == len(receipts) + 1
+
+
+def test_scoring_does_not_block_its_stripe(monkeypatch):
+    # A single stripe, that every id shares
+    receiptProcessor = ReceiptProcessor(lockStripes=1)
+    scoring, release = threading.Event(), threading.Event()
+    single = processor.calculate_parsed_points
+
+    def slow_single(parsed):
+        if parsed.retailer == "Slow":
+            scoring.set()
+            release.wait(5)
+        return single(parsed)
+
+    monkeypatch.setattr(processor, "calculate_parsed_points", slow_single)
+    thread = threading.Thread(
+        target=receiptProcessor.process_receipt,
+        args=({**RECEIPT, "retailer": "Slow"},),
+    )
+    thread.start()
+    assert scoring.wait(5)
+    done = []
+    other = threading.Thread(
+        target=lambda: done.append(receiptProcessor.process_receipt(RECEIPT))
+    )
+    other.start()
+    other.join(2)
+    assert done and receiptProcessor.get_points(done[0]) is not None
+    release.set()
+    thread.join()
+    assert len(receiptProcessor.receipts) == 2
+
+
+@pytest.fixture(scope="module")
+def pooled():
+    # Every receipt and batch goes to the pool
+    receiptProcessor = ReceiptProcessor(workers=2, inlineItems=1)
+    yield receiptProcessor
+    receiptProcessor.close()
+
+
+def test_pool_scores_like_inline(pooled):
+    inline = ReceiptProcessor()
+    receipts = make_receipts(20)
+    receipts[3]["total"] = "6"
+    receipts[7] = receipts[5]
+    receipts.append(["not", "a", "receipt"])
+
+    ids, invalid = pooled.process_receipts(receipts)
+    assert (ids, invalid) == inline.process_receipts(receipts)
+    assert sorted(invalid) == [3, 20]
+    for ID in filter(None, ids):
+        assert pooled.get_points(ID) == inline.get_points(ID)
+
+
+def test_pool_single_receipt(pooled):
+    receipt = {**RECEIPT, "retailer": "Pooled"}
+    inline = ReceiptProcessor()
+    ID = pooled.process_receipt(receipt)
+    assert ID == inline.process_receipt(receipt)
+    assert pooled.get_points(ID) == inline.get_points(ID)
+    with pytest.raises(InvalidReceiptError) as error:
+        pooled.process_receipt({**receipt, "total": "6"})
+    assert [v.path for v in error.value.violations] == ["$.total"]
+
+
+@pytest.mark.parametrize(
+    "ID",
+    [
+        pytest.param("2C37898A-DC27-56AC-B9D4-CB755B426579", id="upper_case"),
+        pytest.param("7fb1377b-b223-49d9-a31a-5a02701dd310", id="uuid4"),
+        pytest.param("2c37898adc2756acb9d4cb755b426579", id="no_dashes"),
+        pytest.param("../../etc/passwd", id="path"),
+        pytest.param("", id="empty"),
+    ],
+)
+def test_malformed_ids_are_not_looked_up(ID):
+    class FailingStore(MemoryStore):
+        def get(self, ID):
+            raise AssertionError(f"{ID} looked up")
+
+    receiptProcessor = ReceiptProcessor(FailingStore())
+    malformed = ID_LOOKUPS.value("malformed")
+    assert receiptProcessor.get_points(ID) is None
+    assert ID_LOOKUPS.value("malformed") == malformed + 1
+    valid = receiptProcessor.process_receipt(RECEIPT)
+    assert receiptProcessor.get_many_points([ID, valid]) == [
+        None,
+        receiptProcessor.receipts._receipts[valid],
+    ]
+
+
+@pytest.mark.parametrize(
+    "url, price",
+    [
+        pytest.param("sqlite", "99999999999999999999.00", id="sqlite"),
+        pytest.param(
+            "sqlite?shared=1", "99999999999999999999.00", id="shared sqlite"
+        ),
+        # One item of about $21.5B scores 2**32 points
+        pytest.param("compact", "21474836480.00", id="compact"),
+        pytest.param("log", "21474836480.00", id="log"),
+    ],
+)
+def test_points_the_store_cannot_hold_are_refused(tmp_path, url, price):
+    if url == "compact":
+        store = open_store(url)
+    elif url == "log":
+        store = open_store(f"log:///{tmp_path}/log")
+    else:
+        store = open_store(url.replace("sqlite", f"sqlite:///{tmp_path}/r.db"))
+    receiptProcessor = ReceiptProcessor(store)
+    huge = {
+        **RECEIPT,
+        "items": [{"shortDescription": "Ingots", "price": price}],
+    }
+    with pytest.raises(InvalidReceiptError) as error:
+        receiptProcessor.process_receipt(huge)
+    [violation] = error.value.violations
+    assert violation.path == "$" and "cannot be stored" in violation.message
+    IDs, invalid = receiptProcessor.process_receipts([huge, RECEIPT])
+    assert IDs[0] is None and list(invalid) == [0]
+    # Receipts uploaded afterwards are still stored
+    ID = receiptProcessor.process_receipt({**RECEIPT, "total": "1.00"})
+    store.flush()
+    assert receiptProcessor.get_points(ID) is not None
+    assert receiptProcessor.get_points(IDs[1]) is not None
+    receiptProcessor.close()
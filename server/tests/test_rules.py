@@ -0,0 +1,252 @@
+"""Tests the compiled rules engine. The default rules are checked against
+points.py on every case of test_points.py, then rule loading, errors and
+hot reloading."""
+
+import json
+import os
+
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.money import parse_cents
+from receipt_processor.points import (
+    calculate_receipt_points,
+    day_of_month,
+    minute_of_day,
+    purchase_minute_points,
+)
+from receipt_processor.rules import (
+    DEFAULT_RULES,
+    RuleError,
+    RuleSet,
+    compile_rules,
+)
+from receipt_processor.validator import ParsedReceipt, ReceiptValidator
+
+from . import test_points
+
+# A receipt that no default rule awards points to
+NEUTRAL = ParsedReceipt("&", day=2, minute=0, total=1, items=[])
+
+
+def rules_for(field):
+    return compile_rules([r for r in DEFAULT_RULES if r["field"] == field])
+
+
+def cases(test):
+    """The parameters of a test in test_points.py."""
+    (mark,) = test.pytestmark
+    return [
+        pytest.param(*param.values, id=param.id) for param in mark.args[1]
+    ]
+
+
+@pytest.mark.parametrize(
+    "retailer, expectedPoints",
+    cases(test_points.test_calculate_retailer_points),
+)
+def test_retailer_rules(retailer, expectedPoints):
+    receipt = NEUTRAL._replace(retailer=retailer)
+    assert rules_for("retailer")(receipt) == expectedPoints
+
+
+@pytest.mark.parametrize(
+    "total, expectedPoints", cases(test_points.test_calculate_total_points)
+)
+def test_total_rules(total, expectedPoints):
+    receipt = NEUTRAL._replace(total=parse_cents(total))
+    assert rules_for("total")(receipt) == expectedPoints
+
+
+@pytest.mark.parametrize(
+    "items, expectedPoints",
+    cases(test_points.test_calculate_item_pairs_points),
+)
+def test_item_pairs_rules(items, expectedPoints):
+    receipt = NEUTRAL._replace(items=items)
+    assert rules_for("items")(receipt) == expectedPoints
+
+
+@pytest.mark.parametrize(
+    "item, expectedPoints", cases(test_points.test_calculate_item_desc_points)
+)
+def test_item_rules(item, expectedPoints):
+    receipt = NEUTRAL._replace(
+        items=[(item["shortDescription"], parse_cents(item["price"]))]
+    )
+    assert rules_for("item")(receipt) == expectedPoints
+
+
+@pytest.mark.parametrize(
+    "purchaseDate, expectedPoints",
+    cases(test_points.test_calculate_purchase_date_points),
+)
+def test_purchase_date_rules(purchaseDate, expectedPoints):
+    receipt = NEUTRAL._replace(day=day_of_month(purchaseDate))
+    assert rules_for("purchaseDate")(receipt) == expectedPoints
+
+
+@pytest.mark.parametrize(
+    "purchaseTime, expectedPoints",
+    cases(test_points.test_calculate_purchase_time_points),
+)
+def test_purchase_time_rules(purchaseTime, expectedPoints):
+    receipt = NEUTRAL._replace(minute=minute_of_day(purchaseTime))
+    assert rules_for("purchaseTime")(receipt) == expectedPoints
+
+
+def test_purchase_time_rules_every_minute():
+    score = rules_for("purchaseTime")
+    for minute in range(24 * 60):
+        receipt = NEUTRAL._replace(minute=minute)
+        assert score(receipt) == purchase_minute_points(minute)
+
+
+@pytest.mark.parametrize(
+    "receipt, expectedPoints", cases(test_points.test_process_receipt)
+)
+def test_default_rules(receipt, expectedPoints):
+    parsed, _ = ReceiptValidator().check(receipt)
+    assert compile_rules(DEFAULT_RULES)(parsed) == expectedPoints
+
+
+def test_default_rules_match_points():
+    validator = ReceiptValidator()
+    score = compile_rules(DEFAULT_RULES)
+    for retailer in ["Target", "M&M Corner Market"]:
+        for total in ["35.35", "35.00", "9.25", "0.00"]:
+            for time in ["13:01", "15:00"]:
+                receipt = {
+                    "retailer": retailer,
+                    "purchaseDate": "2022-01-01",
+                    "purchaseTime": time,
+                    "items": [
+                        {"shortDescription": "Cheese Pizza", "price": total},
+                        {"shortDescription": " abc ", "price": "1.26"},
+                        {"shortDescription": "Pizz", "price": total},
+                    ],
+                    "total": total,
+                }
+                parsed, _ = validator.check(receipt)
+                assert score(parsed) == calculate_receipt_points(receipt)
+
+
+def test_new_rule_is_compiled():
+    rules = DEFAULT_RULES + [
+        {
+            "name": "even_day_promo",
+            "field": "purchaseDate",
+            "when": {"odd": False},
+            "award": {"points": 100},
+        }
+    ]
+    score = compile_rules(rules)
+    assert "even_day_promo" in score.source
+    assert score(NEUTRAL) == 100 + compile_rules(DEFAULT_RULES)(NEUTRAL)
+
+
+@pytest.mark.parametrize(
+    "rule, message",
+    [
+        pytest.param(
+            {"name": "a b", "field": "total", "award": {"points": 1}},
+            "Invalid rule name",
+            id="name",
+        ),
+        pytest.param(
+            {"name": "a", "field": "tip", "award": {"points": 1}},
+            "unknown field",
+            id="field",
+        ),
+        pytest.param(
+            {"name": "a", "field": "total", "award": {"points": "1"}},
+            "points must be an integer",
+            id="award value",
+        ),
+        pytest.param(
+            {"name": "a", "field": "total", "award": {"per_pair": 1}},
+            "unknown award",
+            id="award for another field",
+        ),
+        pytest.param(
+            {
+                "name": "a",
+                "field": "total",
+                "when": {"multiple_of": "0.00"},
+                "award": {"points": 1},
+            },
+            "must not be 0.00",
+            id="zero multiple",
+        ),
+        pytest.param(
+            {
+                "name": "a",
+                "field": "purchaseTime",
+                "when": {"between": ["14:00", "4pm"]},
+                "award": {"points": 1},
+            },
+            "invalid time",
+            id="time",
+        ),
+        pytest.param(
+            {
+                "name": "a",
+                "field": "total",
+                "award": {"points": 1},
+                "extra": True,
+            },
+            "unknown keys",
+            id="extra key",
+        ),
+    ],
+)
+def test_invalid_rules(rule, message):
+    with pytest.raises(RuleError, match=message):
+        compile_rules([rule])
+
+
+def test_rule_set_reloads_on_change(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(DEFAULT_RULES))
+    rules = RuleSet(str(path))
+    receiptProcessor = ReceiptProcessor(rules=rules)
+    receipt = {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-02",
+        "purchaseTime": "13:01",
+        "items": [{"shortDescription": "Pizz", "price": "1.00"}],
+        "total": "1.01",
+    }
+    ID = receiptProcessor.process_receipt(receipt)
+    assert receiptProcessor.get_points(ID) == 6
+    assert not rules.reload()
+
+    path.write_text(json.dumps(DEFAULT_RULES[:1]))
+    os.utime(path, (0, 0))
+    assert rules.reload()
+    assert rules.score(NEUTRAL._replace(retailer="Target", day=1)) == 6
+
+    # A broken file keeps the rules in use
+    path.write_text("[{")
+    os.utime(path, (1, 1))
+    assert not rules.reload()
+    assert rules.rules == DEFAULT_RULES[:1]
+
+
+def test_pool_uses_the_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(DEFAULT_RULES[:1]))
+    receiptProcessor = ReceiptProcessor(
+        workers=1, inlineItems=1, rules=RuleSet(str(path))
+    )
+    receipt = {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "15:01",
+        "items": [{"shortDescription": "abc", "price": "1.00"}],
+        "total": "1.00",
+    }
+    try:
+        (ID,), _ = receiptProcessor.process_receipts([receipt])
+        assert receiptProcessor.get_points(ID) == 6
+    finally:
+        receiptProcessor.close()
@@ -0,0 +1,535 @@
+"""Tests every receipt store backend against the same expectations."""
+
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from receipt_processor import ReceiptProcessor
+from receipt_processor.metrics import ID_LOOKUPS, STORE_EVICTIONS
+from receipt_processor.store import (
+    ENTRY_BYTES,
+    BoundedStore,
+    CompactStore,
+    FilteredStore,
+    LogStore,
+    MemoryStore,
+    NewReceipt,
+    SQLiteStore,
+    open_store,
+)
+
+ID = "2c37898a-dc27-56ac-b9d4-cb755b426579"
+OTHER_ID = "7fb1377b-b223-49d9-a31a-5a02701dd310"
+
+
+@pytest.fixture(
+    params=["memory", "bounded", "compact", "log", "sqlite", "filtered"]
+)
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemoryStore()
+    elif request.param == "bounded":
+        store = BoundedStore(maxEntries=10_000, ttl=3600)
+    elif request.param == "compact":
+        store = CompactStore()
+    elif request.param == "log":
+        store = LogStore(str(tmp_path / "log"))
+    elif request.param == "sqlite":
+        store = SQLiteStore(str(tmp_path / "receipts.db"))
+    else:
+        store = FilteredStore(SQLiteStore(str(tmp_path / "receipts.db")))
+    yield store
+    store.close()
+
+
+def test_put_and_get(store):
+    assert store.get(ID) is None
+    assert ID not in store
+    store.put(ID, 28)
+    assert store.get(ID) == 28
+    assert ID in store
+    assert len(store) == 1
+
+
+def test_put_many(store):
+    store.put_many([(ID, 28), (OTHER_ID, 0)])
+    assert store.get(ID) == 28
+    assert store.get(OTHER_ID) == 0
+    assert OTHER_ID in store
+    assert len(store) == 2
+
+
+def test_unknown_ids(store):
+    store.put(ID, 28)
+    for unknown in [OTHER_ID, "", "not-a-uuid", ID.replace("-", "")]:
+        assert store.get(unknown) is None
+        assert unknown not in store
+
+
+def test_get_many(store):
+    ids = [str(uuid.uuid4()) for _ in range(1200)]
+    store.put_many((ID, points) for points, ID in enumerate(ids))
+    store.flush()
+    # Pending writes are found as well as committed ones
+    store.put(ID, 28)
+    lookup = [ID, OTHER_ID, "not-a-uuid"] + ids
+    expected = [28, None, None] + list(range(len(ids)))
+    assert store.get_many(lookup) == expected
+    assert store.get_many([]) == []
+
+
+def test_ids(store):
+    ids = [str(uuid.uuid4()) for _ in range(25)]
+    store.put_many((ID, 1) for ID in ids)
+    assert sorted(store.ids()) == sorted(ids)
+
+
+class CountingStore(MemoryStore):
+    def __init__(self) -> None:
+        super().__init__()
+        self.lookups = 0
+
+    def get(self, ID):
+        self.lookups += 1
+        return super().get(ID)
+
+    def get_many(self, IDs):
+        self.lookups += len(IDs)
+        return super().get_many(IDs)
+
+
+def test_filtered_store_answers_unknown_ids():
+    inner = CountingStore()
+    inner.put(ID, 28)
+    store = FilteredStore(inner, capacity=1000)
+    # Filled from the stored ids
+    assert store.get(ID) == 28
+    store.put(OTHER_ID, 0)
+    assert store.get_many([ID, OTHER_ID]) == [28, 0]
+    assert inner.lookups == 3
+
+    filtered = ID_LOOKUPS.value("filtered")
+    falsePositives = ID_LOOKUPS.value("false_positive")
+    unknown = [str(uuid.uuid4()) for _ in range(1000)] + ["not-a-uuid"]
+    assert store.get_many(unknown) == [None] * len(unknown)
+    assert all(store.get(ID) is None for ID in unknown)
+    reached = inner.lookups - 3
+    assert reached < 0.05 * len(unknown)
+    assert ID_LOOKUPS.value("false_positive") - falsePositives == reached
+    filteredNow = ID_LOOKUPS.value("filtered")
+    assert filteredNow - filtered == 2 * len(unknown) - reached
+    assert store.false_positive_rate() < 0.01
+
+
+def test_filtered_store_rejects_shared_stores(tmp_path):
+    shared = open_store(f"sqlite:///{tmp_path / 'receipts.db'}?shared=1")
+    with pytest.raises(ValueError):
+        FilteredStore(shared)
+    shared.close()
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_bounded_store_evicts_least_recently_used():
+    store = BoundedStore(maxEntries=2)
+    store.put("a", 1)
+    store.put("b", 2)
+    # Looking a up makes b the least recently used
+    assert store.get("a") == 1
+    store.put("c", 3)
+    assert store.get_many(["a", "b", "c"]) == [1, None, 3]
+    assert len(store) == 2
+    assert store.evictions == {"expired": 0, "entries": 1, "bytes": 0}
+
+
+def test_bounded_store_expires_entries():
+    clock = Clock()
+    store = BoundedStore(ttl=10, clock=clock)
+    store.put_many([("a", 1), ("b", 2)])
+    clock.now = 5
+    assert "a" in store
+    clock.now = 12
+    # b expired at 10, a lives until 15 since it was looked up at 5
+    assert store.get("b") is None
+    assert store.evictions["expired"] == 1
+    assert store.get("a") == 1
+    clock.now = 30
+    # Expired entries that are never looked up go at the next write
+    store.put("c", 3)
+    assert store.evictions["expired"] == 2
+    assert len(store) == 1
+    clock.now = 45
+    assert len(store) == 0
+
+
+def test_bounded_store_limits_bytes():
+    ids = [str(uuid.uuid4()) for _ in range(10)]
+    entryBytes = sys.getsizeof(ids[0]) + ENTRY_BYTES
+    store = BoundedStore(maxBytes=entryBytes * 4)
+    before = STORE_EVICTIONS.value("bytes")
+    store.put_many((ID, 1) for ID in ids)
+    assert len(store) == 4
+    assert store.nbytes == entryBytes * 4
+    assert store.get_many(ids[-4:]) == [1] * 4
+    assert store.evictions["bytes"] == 6
+    assert STORE_EVICTIONS.value("bytes") - before == 6
+
+
+def test_evicted_receipts_are_rescored_under_the_same_id():
+    processor = ReceiptProcessor(BoundedStore(maxEntries=1))
+    receipt = {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "13:01",
+        "items": [{"shortDescription": "Pepsi", "price": "1.25"}],
+        "total": "1.25",
+    }
+    other = dict(receipt, retailer="Walgreens")
+    ID = processor.process_receipt(receipt)
+    points = processor.get_points(ID)
+    processor.process_receipt(other)
+    assert processor.get_points(ID) is None
+    assert processor.process_receipt(receipt) == ID
+    assert processor.get_points(ID) == points
+
+
+@pytest.mark.parametrize(
+    "url, limits",
+    [
+        pytest.param(
+            "memory?max_entries=100&ttl=60", (100, 0, 60), id="entries_ttl"
+        ),
+        pytest.param("memory?max_bytes=4096", (0, 4096, 0), id="bytes"),
+    ],
+)
+def test_open_bounded_store(url, limits):
+    store = open_store(url)
+    assert isinstance(store, BoundedStore)
+    assert (store.maxEntries, store.maxBytes, store.ttl) == limits
+
+
+def test_compact_store_grows():
+    store = CompactStore(capacity=8)
+    ids = [str(uuid.uuid4()) for _ in range(5000)]
+    for points, ID in enumerate(ids):
+        store.put(ID, points)
+    store.put(ids[0], 0)
+    assert len(store) == len(ids)
+    assert all(store.get(ID) == points for points, ID in enumerate(ids))
+    assert store.bytes_per_entry() < 40
+
+
+@pytest.mark.parametrize(
+    "ID",
+    [
+        pytest.param("00000000-0000-0000-0000-000000000000", id="nil uuid"),
+        pytest.param("not-a-uuid", id="malformed"),
+    ],
+)
+def test_compact_store_rejects_ids(ID):
+    with pytest.raises(ValueError):
+        CompactStore().put(ID, 1)
+
+
+def test_sqlite_reads_pending_writes(tmp_path):
+    store = SQLiteStore(
+        str(tmp_path / "receipts.db"), batchSize=10, commitInterval=60
+    )
+    store.put(ID, 28)
+    assert store._pending == {ID: 28}
+    assert store.get(ID) == 28
+    store.close()
+
+
+def test_sqlite_persists_across_restarts(tmp_path):
+    path = str(tmp_path / "receipts.db")
+    store = SQLiteStore(path)
+    store.put(ID, 28)
+    store.close()
+
+    store = SQLiteStore(path)
+    assert store.get(ID) == 28
+    assert len(store) == 1
+    store.close()
+
+
+def test_log_store_recovers_snapshot_and_log(tmp_path):
+    directory = str(tmp_path / "log")
+    ids = [str(uuid.uuid4()) for _ in range(3000)]
+    store = LogStore(directory)
+    store.put_many((ID, points) for points, ID in enumerate(ids[:2000]))
+    store.snapshot()
+    # Grows the table past the snapshot's size after recovery
+    store.put_many((ID, points) for points, ID in enumerate(ids[2000:2100]))
+    store.close()
+    assert sorted(os.listdir(directory)) == [
+        "receipts.1.log",
+        "receipts.snapshot",
+    ]
+
+    store = LogStore(directory)
+    assert len(store) == 2100
+    assert store.get_many(ids[1998:2002]) == [1998, 1999, 0, 1]
+    store.put_many((ID, points) for points, ID in enumerate(ids[2100:]))
+    store.snapshot()
+    store.put(ID, 28)
+    store.close()
+
+    store = LogStore(directory)
+    assert len(store) == 3001
+    assert store.get(ids[-1]) == 899
+    assert store.get(ID) == 28
+    store.close()
+
+
+def test_log_store_cuts_torn_records(tmp_path):
+    directory = str(tmp_path / "log")
+    store = LogStore(directory)
+    store.put(ID, 28)
+    store.close()
+    with open(os.path.join(directory, "receipts.0.log"), "ab") as file:
+        file.write(b"\x01" * 7)
+
+    store = LogStore(directory)
+    assert len(store) == 1
+    store.put(OTHER_ID, 0)
+    store.close()
+
+    store = LogStore(directory)
+    assert store.get_many([ID, OTHER_ID]) == [28, 0]
+    store.close()
+
+
+def test_log_store_snapshots_in_the_background(tmp_path):
+    directory = str(tmp_path / "log")
+    store = LogStore(
+        directory, syncInterval=0.01, batchSize=10, snapshotRecords=100
+    )
+    ids = [str(uuid.uuid4()) for _ in range(250)]
+    for ID in ids:
+        store.put(ID, 1)
+    deadline = time.monotonic() + 5
+    while not store._generation and time.monotonic() < deadline:
+        time.sleep(0.01)
+    store.close()
+    assert "receipts.snapshot" in os.listdir(directory)
+    assert "receipts.0.log" not in os.listdir(directory)
+
+    store = LogStore(directory)
+    assert store.get_many(ids) == [1] * len(ids)
+    store.close()
+
+
+def test_log_store_rejects_other_files(tmp_path):
+    directory = tmp_path / "log"
+    directory.mkdir()
+    (directory / "receipts.snapshot").write_bytes(b"not a snapshot" * 4)
+    with pytest.raises(ValueError):
+        LogStore(str(directory))
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        pytest.param("sqlite:///{path}/receipts.db", id="sqlite"),
+        pytest.param("log:///{path}/log", id="log"),
+    ],
+)
+def test_processor_ids_survive_restarts(tmp_path, url):
+    url = url.format(path=tmp_path)
+    receipt = {
+        "retailer": "Target",
+        "purchaseDate": "2022-01-01",
+        "purchaseTime": "13:01",
+        "items": [{"shortDescription": "Pepsi - 12-oz", "price": "1.25"}],
+        "total": "1.25",
+    }
+    processor = ReceiptProcessor(open_store(url))
+    ID = processor.process_receipt(receipt)
+    points = processor.get_points(ID)
+    processor.close()
+
+    processor = ReceiptProcessor(open_store(url))
+    assert processor.get_points(ID) == points
+    processor.close()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        pytest.param("redis://localhost", id="scheme"),
+        pytest.param("memory?max_size=10", id="option"),
+        pytest.param("memory?ttl=soon", id="value"),
+    ],
+)
+def test_open_store_rejects_unknown_url(url):
+    with pytest.raises(ValueError):
+        open_store(url)
+
+
+def test_shared_sqlite_commits_before_put_returns(tmp_path):
+    url = f"sqlite:///{tmp_path / 'receipts.db'}?shared=1"
+    writer, reader = open_store(url), open_store(url)
+    assert writer.shared
+    writer.put(ID, 28)
+    assert reader.get(ID) == 28
+    writer.close()
+    reader.close()
+
+
+def test_shared_sqlite_groups_concurrent_writes(tmp_path):
+    store = open_store(f"sqlite:///{tmp_path / 'receipts.db'}?shared=1")
+    ids = [str(uuid.uuid4()) for _ in range(200)]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(store.put, ids, range(len(ids))))
+    assert store._pending == {}
+    assert len(store) == len(ids)
+    store.close()
+
+
+def count_receipts(store):
+    return {
+        (row.retailer, row.purchaseDate): (row.receipts, row.points)
+        for row in store.aggregate_rows()
+    }
+
+
+def test_put_receipts_counts_aggregates(store):
+    store.put_receipt(NewReceipt(ID, 28, "Target", "2022-01-01"))
+    store.put_receipts(
+        [
+            NewReceipt(OTHER_ID, 12, "Target", "2022-01-01"),
+            NewReceipt(str(uuid.uuid4()), 5, "Aldi", "2022-01-02"),
+            # Moved from another node, stored but not counted
+            NewReceipt(str(uuid.uuid4()), 7),
+        ]
+    )
+    assert len(store) == 4
+    assert store.get(OTHER_ID) == 12
+    assert count_receipts(store) == {
+        ("Target", "2022-01-01"): (2, 40),
+        ("Aldi", "2022-01-02"): (1, 5),
+    }
+    [row] = store.aggregate_rows("Aldi", "2022-01-02", "2022-01-02")
+    assert row.histogram[0] == 1 and sum(row.histogram) == 1
+    assert store.aggregate_rows(start="2022-01-03") == []
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        pytest.param("sqlite:///{path}/receipts.db", id="sqlite"),
+        pytest.param("log:///{path}/log", id="log"),
+    ],
+)
+def test_aggregates_survive_restarts(tmp_path, url):
+    url = url.format(path=tmp_path)
+    store = open_store(url)
+    store.put_receipt(NewReceipt(ID, 28, "Target", "2022-01-01"))
+    store.close()
+
+    store = open_store(url)
+    # Ids already stored are not counted again
+    store.put_receipt(NewReceipt(ID, 28, "Target", "2022-01-01"))
+    store.put_receipt(NewReceipt(OTHER_ID, 12, "Target", "2022-01-01"))
+    store.close()
+
+    store = open_store(url)
+    assert count_receipts(store) == {("Target", "2022-01-01"): (2, 40)}
+    store.close()
+
+
+def test_log_store_snapshots_aggregates(tmp_path):
+    directory = str(tmp_path / "log")
+    store = LogStore(directory)
+    store.put_receipt(NewReceipt(ID, 28, "Café M&M", "2022-01-01"))
+    store.snapshot()
+    store.put_receipt(NewReceipt(OTHER_ID, 12, "Café M&M", "2022-01-01"))
+    store.close()
+    with open(os.path.join(directory, "receipts.1.log"), "ab") as file:
+        # Fields torn before their receipt's record
+        file.write(b"\0" * 16 + b"\x20\0\0\0" + b'["Aldi"')
+
+    store = LogStore(directory)
+    assert len(store) == 2
+    assert count_receipts(store) == {("Café M&M", "2022-01-01"): (2, 40)}
+    store.close()
+    assert os.path.getsize(os.path.join(directory, "receipts.1.log")) == (
+        20 + len('["Caf\\u00e9 M&M", "2022-01-01"]') + 20
+    )
+
+
+def test_shared_sqlite_counts_each_id_once(tmp_path):
+    url = f"sqlite:///{tmp_path / 'receipts.db'}?shared=1"
+    first, second = open_store(url), open_store(url)
+    # Both processes checked the id before either stored it
+    first.put_receipt(NewReceipt(ID, 28, "Target", "2022-01-01"))
+    second.put_receipt(NewReceipt(ID, 28, "Target", "2022-01-01"))
+    assert count_receipts(second) == {("Target", "2022-01-01"): (1, 28)}
+    first.close()
+    second.close()
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_sqlite_refuses_points_it_cannot_hold(tmp_path, shared):
+    store = SQLiteStore(str(tmp_path / "receipts.db"), shared=shared)
+    assert not store.holds(2**63)
+    with pytest.raises(ValueError):
+        store.put(ID, 2**63)
+    with pytest.raises(ValueError):
+        store.put_receipts([NewReceipt(ID, -(2**63) - 1, "Target", "x")])
+    store.put(OTHER_ID, 28)
+    store.flush()
+    assert store.get(ID) is None
+    assert len(store) == 1
+    store.close()
+
+
+@pytest.mark.parametrize("shared", [False, True])
+def test_sqlite_commits_around_a_bad_row(tmp_path, shared):
+    store = SQLiteStore(str(tmp_path / "receipts.db"), shared=shared)
+    with store._lock:
+        # A row that only fails once it is committed
+        store._pending[ID] = 2**64
+    # In shared mode this waits for the committer, which must survive
+    store.put(OTHER_ID, 28)
+    store.put(str(uuid.uuid4()), 5)
+    store.flush()
+    assert store.get(ID) is None
+    assert store.get(OTHER_ID) == 28
+    assert len(store) == 2
+    assert store._committer.is_alive()
+    store.close()
+
+
+@pytest.mark.parametrize("kind", ["compact", "log"])
+@pytest.mark.parametrize("points", [2**32, -1])
+def test_compact_stores_refuse_points_they_cannot_hold(tmp_path, kind, points):
+    if kind == "compact":
+        store = CompactStore()
+    else:
+        store = LogStore(str(tmp_path / "log"))
+    assert store.holds(2**32 - 1) and not store.holds(points)
+    for put in [
+        lambda: store.put(ID, points),
+        lambda: store.put_many([(OTHER_ID, 1), (ID, points)]),
+        lambda: store.put_receipts(
+            [NewReceipt(OTHER_ID, 1), NewReceipt(ID, points)]
+        ),
+    ]:
+        with pytest.raises(ValueError):
+            put()
+    # Nothing of a refused batch is stored
+    assert len(store) == 0
+    store.put(ID, 2**32 - 1)
+    assert store.get(ID) == 2**32 - 1
+    store.close()
@@ -0,0 +1,315 @@
+"""Tests reading single receipts from a stream of their JSON."""
+
+import io
+import json
+
+import pytest
+from receipt_processor import ReceiptProcessor, streaming
+from receipt_processor.processor import InvalidReceiptError
+from receipt_processor.rules import DEFAULT_RULES, RuleSet
+from receipt_processor.streaming import ReceiptTooLargeError, read_receipt
+from receipt_processor.validator import ReceiptValidator
+
+RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [
+        {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+        {"shortDescription": "Knorr Creamy Chicken", "price": "1.26"},
+    ],
+    "total": "35.35",
+}
+
+
+def with_items(count):
+    return {
+        **RECEIPT,
+        "items": [
+            {"shortDescription": f"Item {i:03}", "price": f"{i % 50}.25"}
+            for i in range(count)
+        ],
+    }
+
+
+class Trickle(io.RawIOBase):
+    """A stream that hands out a few bytes per read, like a slow client,
+    and counts how many were read."""
+
+    def __init__(self, body, size=7):
+        self.body = body
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        size = self.size if size < 0 else min(size, self.size)
+        chunk = self.body[self.position:self.position + size]
+        self.position += len(chunk)
+        return chunk
+
+
+def stream(receipt, **kwargs):
+    return Trickle(json.dumps(receipt, **kwargs).encode(), 7)
+
+
+def read(body, **limits):
+    processor = ReceiptProcessor()
+    return read_receipt(
+        Trickle(body), processor.validator, processor._score, **limits
+    )
+
+
+@pytest.mark.parametrize(
+    "receipt",
+    [
+        pytest.param(RECEIPT, id="contract order"),
+        pytest.param(
+            dict(sorted(RECEIPT.items())), id="sorted, items first"
+        ),
+        pytest.param(
+            {"total": RECEIPT["total"], **RECEIPT}, id="total first"
+        ),
+        pytest.param(with_items(1), id="one item"),
+        pytest.param(with_items(255), id="odd item count"),
+        pytest.param(with_items(256), id="one full chunk"),
+        pytest.param(with_items(513), id="chunks and a single item"),
+        pytest.param(
+            {**RECEIPT, "retailer": "Café M&M"},
+            id="non-ascii retailer",
+        ),
+        pytest.param(
+            {**RECEIPT, "notes": {"b": [1, 2.5], "a": None}},
+            id="unknown field after items",
+        ),
+        pytest.param(
+            {"comment": "paid cash", **RECEIPT},
+            id="unknown field before items",
+        ),
+        pytest.param(
+            {
+                **RECEIPT,
+                "items": [
+                    {"shortDescription": "Milk", "price": "1.00", "qty": 2}
+                ],
+            },
+            id="unknown item field",
+        ),
+    ],
+)
+def test_process_stream_matches_process_receipt(receipt):
+    expected = ReceiptProcessor()
+    streamed = ReceiptProcessor()
+    ID = expected.process_receipt(receipt)
+    assert streamed.process_stream(stream(receipt, indent=2)) == ID
+    assert streamed.get_points(ID) == expected.get_points(ID)
+
+
+def test_process_stream_with_rules(tmp_path):
+    rules = [
+        *DEFAULT_RULES,
+        {
+            "name": "every_item",
+            "field": "item",
+            "award": {"points": 3},
+        },
+    ]
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps(rules))
+    receipt = with_items(300)
+    expected = ReceiptProcessor(rules=RuleSet(str(path)))
+    streamed = ReceiptProcessor(rules=RuleSet(str(path)))
+    ID = expected.process_receipt(receipt)
+    assert streamed.process_stream(stream(receipt)) == ID
+    assert streamed.get_points(ID) == expected.get_points(ID)
+
+
+def test_process_stream_duplicate():
+    processor = ReceiptProcessor()
+    ID = processor.process_receipt(RECEIPT)
+    assert processor.process_stream(stream(RECEIPT)) == ID
+    assert processor.process_stream(stream(RECEIPT)) == ID
+    assert len(processor.receipts) == 1
+
+
+@pytest.mark.parametrize(
+    "body, path",
+    [
+        pytest.param(b"[]", "$", id="not an object"),
+        pytest.param(b"{}", "$.retailer", id="empty object"),
+        pytest.param(b'{"retailer": "Target"', "$", id="truncated"),
+        pytest.param(
+            json.dumps(RECEIPT).encode() + b" {}", "$", id="trailing data"
+        ),
+        pytest.param(b'{"retailer": "\xff"}', "$", id="not utf-8"),
+        pytest.param(
+            json.dumps({**RECEIPT, "retailer": "Tar*get"}).encode(),
+            "$.retailer",
+            id="retailer pattern",
+        ),
+        pytest.param(
+            json.dumps({**RECEIPT, "total": 35.35}).encode(),
+            "$.total",
+            id="total not a string",
+        ),
+        pytest.param(
+            json.dumps({**RECEIPT, "items": []}).encode(),
+            "$.items",
+            id="no items",
+        ),
+        pytest.param(
+            json.dumps({**RECEIPT, "items": None}).encode(),
+            "$.items",
+            id="items null",
+        ),
+        pytest.param(
+            json.dumps(
+                {k: v for k, v in RECEIPT.items() if k != "purchaseTime"}
+            ).encode(),
+            "$.purchaseTime",
+            id="missing purchaseTime",
+        ),
+    ],
+)
+def test_read_receipt_invalid(body, path):
+    streamed = read(body)
+    assert streamed.ID is None and streamed.points is None
+    assert [violation.path for violation in streamed.violations] == [path]
+
+
+def test_read_receipt_reports_the_validators_violation():
+    receipt = with_items(10)
+    receipt["items"][4] = {"shortDescription": "Milk", "price": "1"}
+    _, expected = ReceiptValidator().check(receipt)
+    streamed = read(json.dumps(receipt).encode())
+    assert streamed.violations == expected
+
+
+def test_read_receipt_reports_the_first_violation():
+    receipt = with_items(5000)
+    receipt["items"][1]["price"] = "free"
+    receipt["total"] = "35"
+    body = Trickle(json.dumps(receipt).encode(), 1 << 16)
+    processor = ReceiptProcessor()
+    streamed = read_receipt(body, processor.validator, processor._score)
+    assert [str(violation) for violation in streamed.violations] == [
+        "$.items[1].price: must match ^\\d+\\.\\d{2}$"
+    ]
+
+
+def fields(*pairs):
+    """A receipt body with the given (name, value) fields, in order, which
+    may repeat names."""
+    return (
+        "{"
+        + ", ".join(f"{json.dumps(k)}: {json.dumps(v)}" for k, v in pairs)
+        + "}"
+    ).encode()
+
+
+CONTRACT_FIELDS = list(RECEIPT.items())
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        pytest.param(
+            fields(*CONTRACT_FIELDS, ("total", "1.00")),
+            id="repeated field",
+        ),
+        pytest.param(
+            fields(("total", "35"), *CONTRACT_FIELDS),
+            id="invalid field repeated validly",
+        ),
+        pytest.param(
+            fields(*CONTRACT_FIELDS, ("total", "35")),
+            id="valid field repeated invalidly",
+        ),
+        pytest.param(
+            fields(
+                ("items", [{"shortDescription": "Milk", "price": "1"}]),
+                *CONTRACT_FIELDS,
+            ),
+            id="invalid items repeated validly",
+        ),
+        pytest.param(
+            fields(*CONTRACT_FIELDS, ("items", with_items(3)["items"])),
+            id="repeated items",
+        ),
+        pytest.param(
+            fields(*CONTRACT_FIELDS, ("amount", "1.00")),
+            id="field sorting before items after them",
+        ),
+    ],
+)
+def test_read_receipt_accepts_what_process_receipt_accepts(body):
+    """Receipts that cannot be hashed as they are read are parsed whole."""
+    expected = ReceiptProcessor()
+    try:
+        ID = expected.process_receipt(json.loads(body))
+    except InvalidReceiptError as error:
+        ID, violations = None, error.violations
+    else:
+        violations = []
+    streamed = read(body)
+    assert streamed.ID == ID
+    assert streamed.violations == violations
+    if ID is not None:
+        assert streamed.points == expected.get_points(ID)
+
+
+def test_read_receipt_parses_spooled_bodies_whole(monkeypatch):
+    monkeypatch.setattr(streaming, "SPOOL_BYTES", 1024)
+    receipt = with_items(300)
+    body = fields(*receipt.items(), ("notes", "x"), ("amount", "1.00"))
+    streamed = read(body)
+    assert streamed.ID == ReceiptProcessor().process_receipt(
+        json.loads(body)
+    )
+    with pytest.raises(ReceiptTooLargeError):
+        read(body, maxItems=299)
+
+
+@pytest.mark.parametrize(
+    "limits",
+    [
+        pytest.param({"maxBytes": 1000}, id="body"),
+        pytest.param({"maxItems": 99}, id="items"),
+    ],
+)
+def test_process_stream_limits(limits):
+    processor = ReceiptProcessor()
+    body = stream(with_items(100))
+    with pytest.raises(ReceiptTooLargeError):
+        processor.process_stream(body, **limits)
+    assert len(processor.receipts) == 0
+
+
+def test_process_stream_within_limits():
+    processor = ReceiptProcessor()
+    receipt = with_items(100)
+    body = json.dumps(receipt).encode()
+    ID = processor.process_stream(
+        Trickle(body), maxBytes=len(body), maxItems=100
+    )
+    assert ID == processor.process_receipt(receipt)
+
+
+def test_read_receipt_aggregate_fields():
+    streamed = read(json.dumps(RECEIPT).encode())
+    assert (streamed.retailer, streamed.purchaseDate) == (
+        "Target",
+        "2022-01-01",
+    )
+
+
+def test_process_stream_invalid_raises():
+    processor = ReceiptProcessor()
+    with pytest.raises(InvalidReceiptError) as error:
+        processor.process_stream(stream({**RECEIPT, "total": "35"}))
+    assert [str(violation) for violation in error.value.violations] == [
+        "$.total: must match ^\\d+\\.\\d{2}$"
+    ]
@@ -0,0 +1,222 @@
+"""Tests the single-pass validator, mainly that it reports every violation
+with its JSON path. Accept/reject behaviour through the API is covered in
+test_host.py."""
+
+from datetime import date, datetime, timedelta
+
+import pytest
+from receipt_processor.validator import (
+    ReceiptValidator,
+    Violation,
+    parse_date,
+    parse_time,
+)
+
+VALID_RECEIPT = {
+    "retailer": "Target",
+    "purchaseDate": "2022-01-01",
+    "purchaseTime": "13:01",
+    "items": [
+        {"shortDescription": "Mountain Dew 12PK", "price": "6.49"},
+        {"shortDescription": "Emils Cheese Pizza", "price": "12.25"},
+    ],
+    "total": "18.74",
+}
+
+validator = ReceiptValidator()
+
+
+def test_valid_receipt_has_no_violations():
+    assert validator.validate(VALID_RECEIPT) == []
+    assert validator.is_valid(VALID_RECEIPT)
+
+
+@pytest.mark.parametrize(
+    "receipt, expectedViolations",
+    [
+        pytest.param(
+            [VALID_RECEIPT],
+            [Violation("$", "must be an object")],
+            id="receipt not an object",
+        ),
+        pytest.param(
+            {},
+            [
+                Violation("$.retailer", "is required"),
+                Violation("$.purchaseDate", "is required"),
+                Violation("$.purchaseTime", "is required"),
+                Violation("$.items", "must be a non-empty array"),
+                Violation("$.total", "is required"),
+            ],
+            id="empty receipt",
+        ),
+        pytest.param(
+            {**VALID_RECEIPT, "retailer": 7, "purchaseDate": "2022-02-30"},
+            [
+                Violation("$.retailer", "must be a string"),
+                Violation("$.purchaseDate", "must be a valid YYYY-MM-DD date"),
+            ],
+            id="several top level fields",
+        ),
+        pytest.param(
+            {
+                **VALID_RECEIPT,
+                "items": [
+                    {"shortDescription": "Pizza", "price": "1.00"},
+                    {"shortDescription": "Pizza!", "price": "1."},
+                    "Soda",
+                ],
+            },
+            [
+                Violation(
+                    "$.items[1].shortDescription", "must match ^[\\w\\s\\-]+$"
+                ),
+                Violation("$.items[1].price", "must match ^\\d+\\.\\d{2}$"),
+                Violation("$.items[2]", "must be an object"),
+            ],
+            id="item paths",
+        ),
+    ],
+)
+def test_validate_reports_every_violation(receipt, expectedViolations):
+    assert validator.validate(receipt) == expectedViolations
+    assert not validator.is_valid(receipt)
+
+
+@pytest.mark.parametrize(
+    "field, value",
+    [
+        pytest.param("retailer", "Target", id="retailer"),
+        pytest.param("retailer", "Tar*get", id="retailer pattern"),
+        pytest.param("total", "18.74", id="total"),
+        pytest.param("total", 18.74, id="total not a string"),
+        pytest.param("purchaseDate", "2022-02-30", id="date out of range"),
+        pytest.param("purchaseTime", "13:01", id="time"),
+        pytest.param("purchaseTime", None, id="time missing"),
+    ],
+)
+def test_check_field_agrees_with_check(field, value):
+    receipt = {**VALID_RECEIPT, field: value}
+    parsed, violations = validator.check(receipt)
+    fieldValue, violation = validator.check_field(field, value)
+    if parsed is None:
+        assert [violation] == violations
+    else:
+        assert violation is None
+        parsedField = {"purchaseDate": "day", "purchaseTime": "minute"}
+        assert fieldValue == getattr(parsed, parsedField.get(field, field))
+
+
+def test_check_item_agrees_with_check():
+    items = [
+        {"shortDescription": "Milk", "price": "1.25"},
+        {"shortDescription": "Milk", "price": 1.25},
+        "Milk",
+    ]
+    parsed, violations = validator.check({**VALID_RECEIPT, "items": items})
+    assert validator.check_item(items[0], 0) == (("Milk", 125), None)
+    assert validator.check_item(items[1], 1) == (None, violations[0])
+    assert validator.check_item(items[2], 2) == (None, violations[1])
+
+
+class ItemDict(dict):
+    pass
+
+
+class Description(str):
+    pass
+
+
+@pytest.mark.parametrize(
+    "item",
+    [
+        pytest.param(
+            ItemDict(shortDescription="Milk", price="1.25"), id="dict subclass"
+        ),
+        pytest.param(
+            {"shortDescription": Description("Milk"), "price": "1.25"},
+            id="str subclass",
+        ),
+    ],
+)
+def test_items_of_builtin_subclasses_are_kept(item):
+    parsed, violations = validator.check({**VALID_RECEIPT, "items": [item]})
+    assert violations == []
+    assert parsed.items == [("Milk", 125)]
+    assert validator.check_item(item, 0) == (("Milk", 125), None)
+    assert validator.check_many([{**VALID_RECEIPT, "items": [item]}]) == [
+        (parsed, [])
+    ]
+
+
+def test_violation_str():
+    assert str(Violation("$.total", "is required")) == "$.total: is required"
+
+
+def test_parse_date_matches_datetime():
+    """Every day over several centuries, including leap years, plus the
+    invalid day after each month end"""
+    day = date(1896, 1, 1)
+    while day < date(2104, 1, 1):
+        assert parse_date(day.isoformat()) == (day.year, day.month, day.day)
+        day += timedelta(days=1)
+    for year in [1900, 2000, 2023, 2024]:
+        for month in range(1, 13):
+            for dayOfMonth in [0, 29, 30, 31, 32]:
+                value = f"{year:04d}-{month:02d}-{dayOfMonth:02d}"
+                try:
+                    expected = datetime.strptime(value, "%Y-%m-%d")
+                    expected = (expected.year, expected.month, expected.day)
+                except ValueError:
+                    expected = None
+                assert parse_date(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value",
+    ["2022-1-01", "2022-01-1", "20220101", "2022/01/01", "0000-01-01",
+     "2022-13-01", "2022-00-01", "2022-01-01 ", "２０２２-01-01"],
+)
+def test_parse_date_rejects(value: str):
+    assert parse_date(value) is None
+
+
+def test_parse_time_matches_every_minute():
+    for hour in range(24):
+        for minute in range(60):
+            assert parse_time(f"{hour:02d}:{minute:02d}") == (hour, minute)
+
+
+@pytest.mark.parametrize(
+    "value", ["24:00", "12:60", "1:01", "12:1", "12-01", "12:01 ", "-1:01"]
+)
+def test_parse_time_rejects(value: str):
+    assert parse_time(value) is None
+
+
+def test_check_many_matches_check():
+    validator = ReceiptValidator()
+    receipts = [
+        {
+            **VALID_RECEIPT,
+            "retailer": ["Target", "M&M", "Tar*get"][i % 3],
+            "purchaseDate": f"2022-02-{i % 31 + 1:02}",
+            "purchaseTime": f"{i % 26:02}:30",
+            "items": [
+                {"shortDescription": f"Item {i % 7}", "price": f"{i % 5}.25"},
+                {"shortDescription": "Milk", "price": f"{i % 11}.{i % 3}0"},
+            ],
+            "total": f"{i % 13}.{i % 4}5",
+        }
+        for i in range(300)
+    ]
+    receipts += [
+        None,
+        [],
+        {**receipts[0], "items": []},
+        {**receipts[0], "retailer": 5},
+        {**receipts[0], "items": [{"price": "1.00"}]},
+    ]
+    assert validator.check_many(receipts) == list(
+        map(validator.check, receipts)
+    )